@@ -1,7 +1,9 @@
 import { Request, Response } from 'express'
-import { PrintService, PrintJobStatus } from '../services/printService'
+import { PrintService, PrintJobStatus, DEFAULT_LEASE_SECONDS, isDocumentJobType } from '../services/printService'
+import { ControlAccesoService } from '../services/controlAccesoService'
 
 const printService = new PrintService()
+const controlAccesoService = new ControlAccesoService()
 
 export async function registerPrinter(req: Request, res: Response) {
   const { empresaId } = req.context
@@ -68,13 +70,15 @@ export async function listPrinters(req: Request, res: Response) {
 export async function updatePrinterConfig(req: Request, res: Response) {
   const { empresaId } = req.context
   const { id } = req.params
-  const { paperWidth, fontSize } = req.body || {}
+  const { paperWidth, fontSize, copies, orderCode } = req.body || {}
 
   const ok = await printService.updatePrinterConfig({
     empresaId,
     printerId: id,
     paperWidth,
-    fontSize
+    fontSize,
+    copies: typeof copies === 'number' ? copies : undefined,
+    orderCode: ['qr', 'code128', 'none'].includes(orderCode) ? orderCode : undefined
   })
 
   if (!ok) {
@@ -118,6 +122,48 @@ export async function createJob(req: Request, res: Response) {
   res.status(result.alreadyExisted ? 200 : 201).json({ jobId: result.jobId, alreadyExisted: result.alreadyExisted })
 }
 
+// Recibo, factura o cierre de caja desde la caja (impresión nativa en el agente)
+export async function createDocument(req: Request, res: Response) {
+  const { empresaId, nombre } = req.context
+  const { type, payload, printerId } = req.body || {}
+
+  if (!isDocumentJobType(type)) {
+    res.status(400).json({ error: 'type debe ser receipt, invoice o cash_close' })
+    return
+  }
+  if (payload != null && (typeof payload !== 'object' || Array.isArray(payload))) {
+    res.status(400).json({ error: 'payload debe ser un objeto' })
+    return
+  }
+
+  const result = await printService.createDocumentJob({
+    empresaId,
+    type,
+    payload: payload || {},
+    usuarioNombre: nombre,
+    printerId: typeof printerId === 'string' ? printerId : null
+  })
+  if (!result) {
+    res.status(404).json({ error: 'No hay una impresora activa para la empresa' })
+    return
+  }
+
+  res.status(201).json(result)
+}
+
+function parseLeaseSeconds(value: unknown): number {
+  const parsed = parseInt(String(value ?? ''), 10)
+  if (!parsed || Number.isNaN(parsed)) return DEFAULT_LEASE_SECONDS
+  return Math.min(Math.max(parsed, 15), 600)
+}
+
+// Versión del catálogo local del agente (ISO). Inválida o ausente = sin catálogo.
+function parseCatalogVersion(value: unknown): Date | null {
+  if (typeof value !== 'string' || !value) return null
+  const parsed = new Date(value)
+  return Number.isNaN(parsed.getTime()) ? null : parsed
+}
+
 export async function getJobs(req: Request, res: Response) {
   // Modo agente (apiKey) o modo admin (JWT)
   const isAgent = Boolean(req.printContext)
@@ -129,13 +175,38 @@ export async function getJobs(req: Request, res: Response) {
     const { printerId, empresaId } = req.printContext!
 
     if (status === 'pending') {
-      const jobs = await printService.claimPendingJobs(printerId, limit)
-      res.json({ success: true, jobs })
+      const leaseSeconds = parseLeaseSeconds(req.query.leaseSeconds)
+      // service_open: con el servicio cerrado o fuera de horario el agente espacia el poll
+      const serviceOpen = await controlAccesoService.servicioAbierto(empresaId)
+      // Agente con catálogo local: los jobs viajan con ids en vez de nombres
+      const catalogVersion = parseCatalogVersion(req.query.catalogVersion)
+      if (req.query.failover === '1') {
+        // Agente de respaldo: también cubre impresoras principales caídas o atrasadas
+        const claimed = await printService.claimFailoverJobs({ printerId, empresaId, limit, leaseSeconds })
+        const { covering } = claimed
+        const jobs = catalogVersion && claimed.jobs.length
+          ? await printService.compactJobPayloads(empresaId, claimed.jobs, catalogVersion)
+          : claimed.jobs
+        res.json({
+          success: true,
+          jobs,
+          failover: { covering },
+          server_time: new Date().toISOString(),
+          service_open: serviceOpen
+        })
+        return
+      }
+      let jobs = await printService.claimPendingJobs(printerId, limit, leaseSeconds)
+      if (catalogVersion && jobs.length) {
+        jobs = await printService.compactJobPayloads(empresaId, jobs, catalogVersion)
+      }
+      // server_time: el agente mide la antigüedad de los jobs sin depender del reloj del PC de caja
+      res.json({ success: true, jobs, server_time: new Date().toISOString(), service_open: serviceOpen })
       return
     }
 
-    // Para agente, solo permitimos ver su propia cola
-    const jobs = await printService.listJobs({ printerId, empresaId, status, limit })
+    // Para agente, solo permitimos ver su propia cola (incluye los jobs que cubre por failover)
+    const jobs = await printService.listJobs({ claimedBy: printerId, empresaId, status, limit })
     res.json({ success: true, jobs })
     return
   }
@@ -157,8 +228,8 @@ export async function ackJob(req: Request, res: Response) {
   const { id } = req.params
   const { status, info, reason, printedAt } = req.body || {}
 
-  if (status !== 'done' && status !== 'failed') {
-    res.status(400).json({ error: 'status debe ser done o failed' })
+  if (status !== 'done' && status !== 'failed' && status !== 'expired') {
+    res.status(400).json({ error: 'status debe ser done, failed o expired' })
     return
   }
 
@@ -179,6 +250,59 @@ export async function ackJob(req: Request, res: Response) {
   res.status(200).json({ success: true })
 }
 
+export async function renewLeases(req: Request, res: Response) {
+  if (!req.printContext) {
+    res.status(401).json({ error: 'apiKey requerida' })
+    return
+  }
+
+  const { printerId } = req.printContext
+  const { jobIds, leaseSeconds } = req.body || {}
+
+  if (!Array.isArray(jobIds) || jobIds.some((id) => typeof id !== 'string')) {
+    res.status(400).json({ error: 'jobIds debe ser una lista de ids' })
+    return
+  }
+
+  const renewed = await printService.renewLeases({
+    printerId,
+    jobIds: jobIds.slice(0, 100),
+    leaseSeconds: parseLeaseSeconds(leaseSeconds)
+  })
+
+  res.status(200).json({ success: true, renewed })
+}
+
+export async function releaseJob(req: Request, res: Response) {
+  if (!req.printContext) {
+    res.status(401).json({ error: 'apiKey requerida' })
+    return
+  }
+
+  const { printerId } = req.printContext
+  const { id } = req.params
+  const { reason } = req.body || {}
+
+  const ok = await printService.releaseJob({ printerId, jobId: id, reason })
+  if (!ok) {
+    res.status(404).json({ error: 'Job en proceso no encontrado para esta impresora' })
+    return
+  }
+
+  res.status(200).json({ success: true })
+}
+
+export async function getCatalog(req: Request, res: Response) {
+  if (!req.printContext) {
+    res.status(401).json({ error: 'apiKey requerida' })
+    return
+  }
+
+  const { empresaId } = req.printContext
+  const catalog = await printService.getCatalog(empresaId, parseCatalogVersion(req.query.since))
+  res.json({ success: true, ...catalog })
+}
+
 export async function heartbeat(req: Request, res: Response) {
   if (!req.printContext) {
     res.status(401).json({ error: 'apiKey requerida' })
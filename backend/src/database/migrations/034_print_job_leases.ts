@@ -0,0 +1,18 @@
+import { Kysely, sql } from 'kysely'
+
+export async function up(db: Kysely<any>): Promise<void> {
+  // Lease (visibility timeout) de jobs reclamados: si el agente no renueva ni confirma
+  // antes de lease_expires_at, el job vuelve a ser reclamable.
+  await sql`alter table print_jobs add column if not exists lease_expires_at timestamptz`.execute(db)
+
+  await sql`
+    create index if not exists print_jobs_printer_processing_lease_idx
+    on print_jobs (printer_id, lease_expires_at)
+    where status = 'processing'
+  `.execute(db)
+}
+
+export async function down(db: Kysely<any>): Promise<void> {
+  await sql`drop index if exists print_jobs_printer_processing_lease_idx`.execute(db)
+  await sql`alter table print_jobs drop column if exists lease_expires_at`.execute(db)
+}
@@ -0,0 +1,28 @@
+import { Kysely, sql } from 'kysely'
+
+export async function up(db: Kysely<any>): Promise<void> {
+  // Agente de respaldo (failover) que reclamó un job de otra impresora de la empresa.
+  // null = lo procesa la impresora dueña (printer_id).
+  await sql`
+    alter table print_jobs
+    add column if not exists claimed_by_printer_id uuid references printers(id) on delete set null
+  `.execute(db)
+
+  await sql`
+    create index if not exists print_jobs_claimed_by_idx
+    on print_jobs (claimed_by_printer_id)
+    where claimed_by_printer_id is not null
+  `.execute(db)
+
+  await sql`
+    create index if not exists print_jobs_printer_pending_created_idx
+    on print_jobs (printer_id, created_at)
+    where status = 'pending'
+  `.execute(db)
+}
+
+export async function down(db: Kysely<any>): Promise<void> {
+  await sql`drop index if exists print_jobs_printer_pending_created_idx`.execute(db)
+  await sql`drop index if exists print_jobs_claimed_by_idx`.execute(db)
+  await sql`alter table print_jobs drop column if exists claimed_by_printer_id`.execute(db)
+}
@@ -0,0 +1,21 @@
+import { Kysely, sql } from 'kysely'
+
+export async function up(db: Kysely<any>): Promise<void> {
+  // Un job expired (vencido o reemplazado al vaciar una cola atrasada) no bloquea reencolar
+  // el mismo external_id, igual que uno failed.
+  await sql`drop index if exists print_jobs_unique_active`.execute(db)
+  await sql`
+    create unique index if not exists print_jobs_unique_active
+    on print_jobs (printer_id, external_id, type)
+    where status not in ('failed', 'expired')
+  `.execute(db)
+}
+
+export async function down(db: Kysely<any>): Promise<void> {
+  await sql`drop index if exists print_jobs_unique_active`.execute(db)
+  await sql`
+    create unique index if not exists print_jobs_unique_active
+    on print_jobs (printer_id, external_id, type)
+    where status <> 'failed'
+  `.execute(db)
+}
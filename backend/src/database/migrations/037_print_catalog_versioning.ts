@@ -0,0 +1,36 @@
+import { Kysely, sql } from 'kysely'
+
+// Tablas del catálogo que el agente de impresión guarda localmente (GET /api/print/catalog).
+// La sincronización incremental se basa en updated_at: el trigger lo mantiene en cada update,
+// aunque el código que modifica la fila no lo actualice.
+const CATALOG_TABLES = ['productos', 'categorias_productos', 'items_personalizacion', 'usuarios']
+
+export async function up(db: Kysely<any>): Promise<void> {
+  await sql`alter table categorias_productos add column if not exists updated_at timestamp default now()`.execute(db)
+
+  await sql`
+    create or replace function print_catalog_touch_updated_at() returns trigger as $$
+    begin
+      new.updated_at := now();
+      return new;
+    end
+    $$ language plpgsql
+  `.execute(db)
+
+  for (const table of CATALOG_TABLES) {
+    await sql`drop trigger if exists ${sql.raw(`${table}_catalog_touch`)} on ${sql.table(table)}`.execute(db)
+    await sql`
+      create trigger ${sql.raw(`${table}_catalog_touch`)}
+      before update on ${sql.table(table)}
+      for each row execute function print_catalog_touch_updated_at()
+    `.execute(db)
+  }
+}
+
+export async function down(db: Kysely<any>): Promise<void> {
+  for (const table of CATALOG_TABLES) {
+    await sql`drop trigger if exists ${sql.raw(`${table}_catalog_touch`)} on ${sql.table(table)}`.execute(db)
+  }
+  await sql`drop function if exists print_catalog_touch_updated_at()`.execute(db)
+  await sql`alter table categorias_productos drop column if exists updated_at`.execute(db)
+}
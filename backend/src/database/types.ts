@@ -166,6 +166,8 @@ export interface PrintJobsTable {
   last_error: string | null
   info: string | null
   printed_at: Timestamp | null
+  lease_expires_at: Timestamp | null
+  claimed_by_printer_id: string | null
   created_at: Generated<Timestamp>
   updated_at: Generated<Timestamp>
 }
@@ -263,6 +265,7 @@ export interface CategoriasProductosTable {
   nombre: string
   orden: number
   activo: boolean
+  updated_at: Generated<Timestamp>
 }
 
 export interface ProductosTable {
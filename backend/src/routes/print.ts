@@ -8,8 +8,12 @@ import {
   updatePrinterConfig,
   deletePrinter,
   createJob,
+  createDocument,
   getJobs,
   ackJob,
+  renewLeases,
+  releaseJob,
+  getCatalog,
   heartbeat
 } from '../controllers/printController'
 import { verificarApiKeyImpresora, verificarApiKeyImpresoraOpcional } from '../utils/authApiKey'
@@ -74,11 +78,24 @@ router.post(
   (req, res) => createJob(req, res)
 )
 
+// Recibo / factura / cierre de caja desde la caja
+router.post(
+  '/documents',
+  verificarAutenticacion,
+  verificarPermiso('gestionar_caja'),
+  (req, res) => createDocument(req, res)
+)
+
 // Listar / reclamar jobs
 router.get('/jobs', verificarApiKeyImpresoraOpcional, authApiKeyOrJwt, (req, res) => getJobs(req, res))
 
-// Ack + heartbeat (solo agente)
+// Ack, lease, release + heartbeat (solo agente)
+router.post('/jobs/lease', verificarApiKeyImpresora, (req, res) => renewLeases(req, res))
 router.post('/jobs/:id/ack', verificarApiKeyImpresora, (req, res) => ackJob(req, res))
+router.post('/jobs/:id/release', verificarApiKeyImpresora, (req, res) => releaseJob(req, res))
 router.post('/printers/:id/heartbeat', verificarApiKeyImpresora, (req, res) => heartbeat(req, res))
 
+// Catálogo (productos, personalizaciones, usuarios) para el caché local del agente
+router.get('/catalog', verificarApiKeyImpresora, (req, res) => getCatalog(req, res))
+
 export default router
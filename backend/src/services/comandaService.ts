@@ -2,7 +2,7 @@ import { db } from '../database/database';
 import { ComandaRepository, NewComanda, NewComandaItem } from '../repositories/comandaRepository';
 import { InventarioService } from './inventarioService';
 import { v4 as uuidv4 } from 'uuid';
-import { PrintService } from './printService';
+import { PrintService, LocalPrintJob } from './printService';
 
 export class ComandaService {
     private comandaRepo: ComandaRepository;
@@ -128,61 +128,80 @@ export class ComandaService {
             usuarioNombre = u?.nombre || null;
         }
 
-        // Productos -> nombre (por si el frontend no envía producto completo)
+        // Productos -> nombre (por si el frontend no envía producto completo) y categoría
+        // (el agente la usa para repartir la comanda entre estaciones: bar, cocina, ...)
         const productIds = Array.from(new Set(itemsProcessed.map(i => i.producto_id)));
         const productos = productIds.length
             ? await trx
                   .selectFrom('productos')
-                  .select(['id', 'nombre'])
-                  .where('empresa_id', '=', empresaId)
-                  .where('id', 'in', productIds)
+                  .leftJoin('categorias_productos', 'categorias_productos.id', 'productos.categoria_id')
+                  .select(['productos.id as id', 'productos.nombre as nombre', 'categorias_productos.nombre as categoria'])
+                  .where('productos.empresa_id', '=', empresaId)
+                  .where('productos.id', 'in', productIds)
                   .execute()
             : [];
         const productoNombreById = new Map(productos.map((p: any) => [p.id, p.nombre]));
+        const categoriaById = new Map(productos.map((p: any) => [p.id, p.categoria || null]));
+
+        const toPrintable = (processed: NewComandaItem, index: number, cantidad: number) => {
+            const inputItem = items[index];
+
+            // Nombre producto
+            const productoNombre =
+                inputItem?.producto?.nombre ||
+                inputItem?.producto_nombre ||
+                productoNombreById.get(processed.producto_id) ||
+                'Producto';
+
+            // Personalizaciones: flatten de IDs a nombres (los ids, en el mismo orden, permiten
+            // entregar el job sin nombres a un agente con catálogo local)
+            const personalizaciones: string[] = [];
+            const personalizacionIds: string[] = [];
+            const personalizacion = inputItem?.personalizacion;
+            if (personalizacion && typeof personalizacion === 'object') {
+                Object.entries(personalizacion).forEach(([key, val]) => {
+                    if (key === 'precio_adicional') return;
+                    const pushId = (id: any) => {
+                        if (typeof id !== 'string') return;
+                        const info = personalizacionInfo.get(id);
+                        if (info?.nombre) {
+                            personalizaciones.push(info.nombre);
+                            personalizacionIds.push(id);
+                        }
+                    };
+                    if (typeof val === 'string') pushId(val);
+                    else if (Array.isArray(val)) val.forEach(pushId);
+                });
+            }
+
+            return {
+                producto_id: processed.producto_id,
+                nombre: productoNombre,
+                categoria: categoriaById.get(processed.producto_id) || null,
+                cantidad,
+                observaciones: inputItem?.observaciones || null,
+                personalizaciones,
+                personalizacion_ids: personalizacionIds
+            };
+        };
 
         const printableItems = itemsProcessed
             .map((processed, index) => {
-                const inputItem = items[index];
-
                 const cantidad = onlyDeltas
                     ? (deltasByIndex?.get(index) || 0)
                     : Number(processed.cantidad);
 
                 if (onlyDeltas && cantidad <= 0) return null;
-
-                // Nombre producto
-                const productoNombre =
-                    inputItem?.producto?.nombre ||
-                    inputItem?.producto_nombre ||
-                    productoNombreById.get(processed.producto_id) ||
-                    'Producto';
-
-                // Personalizaciones: flatten de IDs a nombres
-                const personalizaciones: string[] = [];
-                const personalizacion = inputItem?.personalizacion;
-                if (personalizacion && typeof personalizacion === 'object') {
-                    Object.entries(personalizacion).forEach(([key, val]) => {
-                        if (key === 'precio_adicional') return;
-                        const pushId = (id: any) => {
-                            if (typeof id !== 'string') return;
-                            const info = personalizacionInfo.get(id);
-                            if (info?.nombre) personalizaciones.push(info.nombre);
-                        };
-                        if (typeof val === 'string') pushId(val);
-                        else if (Array.isArray(val)) val.forEach(pushId);
-                    });
-                }
-
-                return {
-                    producto_id: processed.producto_id,
-                    nombre: productoNombre,
-                    cantidad,
-                    observaciones: inputItem?.observaciones || null,
-                    personalizaciones
-                };
+                return toPrintable(processed, index, cantidad);
             })
             .filter(Boolean);
 
+        // Estado completo de la comanda: el agente lo guarda y, en ediciones, imprime solo la
+        // diferencia (agregados, cancelados y cambios de cantidad) contra lo ya impreso.
+        const snapshotItems = itemsProcessed.map((processed, index) =>
+            toPrintable(processed, index, Number(processed.cantidad))
+        );
+
         return {
             version: 1,
             comandaId,
@@ -192,6 +211,8 @@ export class ComandaService {
             usuario: { id: usuarioId, nombre: usuarioNombre },
             observaciones_generales: observaciones,
             items: printableItems,
+            modo: onlyDeltas ? 'adicionales' : 'completa',
+            snapshot_items: snapshotItems,
             generado_en: new Date().toISOString()
         };
     }
@@ -261,6 +282,7 @@ export class ComandaService {
             );
 
             // 5. Encolar impresión remota (best-effort, no bloquea creación de comanda)
+            let impresionLocal: LocalPrintJob | null = null;
             try {
                 const printerId = await this.printService.getDefaultPrinterId(empresaId, trx as any);
                 if (printerId) {
@@ -278,7 +300,7 @@ export class ComandaService {
                         trx
                     });
 
-                    await this.printService.createPrintJob(
+                    const job = await this.printService.createPrintJob(
                         {
                             empresaId,
                             printerId,
@@ -288,12 +310,20 @@ export class ComandaService {
                         },
                         trx as any
                     );
+
+                    // Entrega directa por LAN (el agente reconcilia por external_id)
+                    if (job.payload) {
+                        impresionLocal = await this.printService.signLocalPrintJob(
+                            { printerId, externalId: comandaId, type: 'kitchen_ticket', payload: job.payload },
+                            trx as any
+                        );
+                    }
                 }
             } catch (printErr) {
                 console.warn('[PRINT] No se pudo encolar impresión para comanda', printErr);
             }
 
-            return { id: comandaId, total: subtotal };
+            return { id: comandaId, total: subtotal, impresionLocal };
         });
     }
 
@@ -445,6 +475,7 @@ export class ComandaService {
             const imprimirAdicionales = Boolean(datos?.imprimir);
             const imprimirCompleta = Boolean(datos?.imprimirCompleta);
 
+            let impresionLocal: LocalPrintJob | null = null;
             if (imprimirAdicionales || imprimirCompleta) {
                 try {
                     const printerId = await this.printService.getDefaultPrinterId(empresaId, trx as any);
@@ -485,23 +516,31 @@ export class ComandaService {
                             deltasByIndex
                         });
 
-                        await this.printService.createPrintJob(
+                        const externalId = `${comandaId}:${imprimirCompleta ? 'full' : 'delta'}:${Date.now()}`;
+                        const job = await this.printService.createPrintJob(
                             {
                                 empresaId,
                                 printerId,
-                                externalId: `${comandaId}:${imprimirCompleta ? 'full' : 'delta'}:${Date.now()}`,
+                                externalId,
                                 type: 'kitchen_ticket',
                                 payload
                             },
                             trx as any
                         );
+
+                        if (job.payload) {
+                            impresionLocal = await this.printService.signLocalPrintJob(
+                                { printerId, externalId, type: 'kitchen_ticket', payload: job.payload },
+                                trx as any
+                            );
+                        }
                     }
                 } catch (printErr) {
                     console.warn('[PRINT] No se pudo encolar impresión por edición', printErr);
                 }
             }
 
-            return { success: true, total: subtotal };
+            return { success: true, total: subtotal, impresionLocal };
         });
     }
 
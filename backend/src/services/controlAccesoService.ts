@@ -45,6 +45,12 @@ export interface EstadoControlAcceso {
   feature_disponible: boolean;
 }
 
+/**
+ * Cache de servicioAbierto por empresa (la consultan los agentes de impresión en cada poll)
+ */
+const SERVICIO_CACHE_MS = 30_000;
+const servicioAbiertoCache = new Map<string, { abierto: boolean; expira: number }>();
+
 /**
  * Servicio de Control de Acceso
  * Gestiona el cierre de servicio y restricción de horarios
@@ -307,6 +313,48 @@ export class ControlAccesoService {
     return null;
   }
 
+  /**
+   * Indica si la empresa está en servicio (no cerrada manualmente y dentro del horario de acceso).
+   * Lo consulta el agente de impresión en cada poll para espaciar la consulta cuando el local está
+   * cerrado: se cachea SERVICIO_CACHE_MS por empresa y no registra auditoría.
+   */
+  async servicioAbierto(empresaId: string): Promise<boolean> {
+    const cached = servicioAbiertoCache.get(empresaId);
+    if (cached && cached.expira > Date.now()) return cached.abierto;
+
+    let abierto = true;
+    try {
+      const empresa = await db
+        .selectFrom('empresas')
+        .select([
+          'plan_actual',
+          'servicio_cerrado',
+          'horario_acceso_activo',
+          'horario_acceso_inicio',
+          'horario_acceso_fin'
+        ])
+        .where('id', '=', empresaId)
+        .executeTakeFirst();
+
+      if (empresa && this.planesPermitidos.includes(empresa.plan_actual)) {
+        if (empresa.servicio_cerrado) {
+          abierto = false;
+        } else if (empresa.horario_acceso_activo && empresa.horario_acceso_inicio && empresa.horario_acceso_fin) {
+          abierto = this.estaDentroDeHorario(
+            empresa.horario_acceso_inicio as string,
+            empresa.horario_acceso_fin as string
+          );
+        }
+      }
+    } catch (error) {
+      // Ante la duda se informa abierto: el agente sigue con el poll normal
+      console.error('[CONTROL_ACCESO] Error al verificar servicio abierto:', error);
+    }
+
+    servicioAbiertoCache.set(empresaId, { abierto, expira: Date.now() + SERVICIO_CACHE_MS });
+    return abierto;
+  }
+
   /**
    * Obtiene el historial de auditoría de acceso
    */
@@ -2,9 +2,60 @@ import { db } from '../database/database'
 import { Kysely, sql } from 'kysely'
 import { generateApiKey, hashApiKey } from '../utils/authApiKey'
 import type { Database } from '../database/types'
+import { ConfigFacturacionRepository } from '../repositories/configFacturacionRepository'
+import { ReporteRepository } from '../repositories/reporteRepository'
 import crypto from 'crypto'
 
-export type PrintJobStatus = 'pending' | 'processing' | 'done' | 'failed'
+// expired: el agente no lo imprimió por viejo o reemplazado al vaciar una cola atrasada
+export type PrintJobStatus = 'pending' | 'processing' | 'done' | 'failed' | 'expired'
+
+export const DEFAULT_LEASE_SECONDS = 60
+// Un agente de respaldo cubre a la impresora principal si su heartbeat (cada 30 s) tiene
+// más de FAILOVER_STALE_SECONDS, si tiene jobs pendientes con más de FAILOVER_LATENCY_SECONDS
+// o si su agente reporta la impresora fuera de servicio (circuit breaker abierto).
+export const FAILOVER_STALE_SECONDS = 90
+export const FAILOVER_LATENCY_SECONDS = 30
+
+// Catálogo en el agente (nombres por id). Un job se entrega con solo los ids de lo que el agente
+// ya tiene: lo modificado en los últimos CATALOG_OVERLAP_MS antes de su versión viaja con nombre,
+// lo que cubre transacciones que confirman tarde con un updated_at anterior.
+export const CATALOG_OVERLAP_MS = 5 * 60_000
+
+// Documentos de caja que el agente renderiza con su propio layout (recibo, factura, cierre de caja)
+export const DOCUMENT_JOB_TYPES = ['receipt', 'invoice', 'cash_close'] as const
+export type DocumentJobType = (typeof DOCUMENT_JOB_TYPES)[number]
+
+export function isDocumentJobType(value: unknown): value is DocumentJobType {
+  return typeof value === 'string' && (DOCUMENT_JOB_TYPES as readonly string[]).includes(value)
+}
+
+// JSON canónico del payload firmado para la entrega por LAN: claves ordenadas, sin espacios.
+// El agente lo recalcula igual (json.dumps sort_keys, separators=(",", ":"), ensure_ascii=False).
+export function canonicalJson(value: unknown): string {
+  const normalize = (node: any): any => {
+    if (Array.isArray(node)) return node.map(normalize)
+    if (node && typeof node === 'object') {
+      return Object.keys(node)
+        .sort()
+        .reduce((acc: Record<string, any>, key) => {
+          acc[key] = normalize(node[key])
+          return acc
+        }, {})
+    }
+    return node
+  }
+  // El round-trip aplica toJSON (fechas) y quita undefined, como lo recibe el agente
+  return JSON.stringify(normalize(JSON.parse(JSON.stringify(value ?? {}))))
+}
+
+export interface PrintCatalog {
+  version: string | null
+  full: boolean
+  productos: Array<{ id: string; nombre: string; categoria_id: string | null }>
+  categorias: Array<{ id: string; nombre: string }>
+  personalizaciones: Array<{ id: string; nombre: string }>
+  usuarios: Array<{ id: string; nombre: string }>
+}
 
 export interface RegisterPrinterInput {
   empresaId: string
@@ -21,6 +72,16 @@ export interface CreatePrintJobInput {
   payload: Record<string, any>
 }
 
+export interface LocalPrintJob {
+  printerId: string
+  externalId: string
+  type: string
+  payload: Record<string, any>
+  token: string
+  exp: number
+  agentUrl: string | null
+}
+
 export interface GeneratePairingTokenInput {
   empresaId: string
   createdByUsuarioId?: string | null
@@ -37,6 +98,9 @@ export interface PairPrinterInput {
 }
 
 export class PrintService {
+  private configFacturacionRepo = new ConfigFacturacionRepository()
+  private reporteRepo = new ReporteRepository()
+
   private normalizePairingCode(input: string): string {
     return (input || '').toUpperCase().replace(/[^A-Z0-9]/g, '')
   }
@@ -242,12 +306,16 @@ export class PrintService {
     printerId: string
     paperWidth?: '58mm' | '80mm'
     fontSize?: 'small' | 'normal' | 'large'
+    copies?: number
+    orderCode?: 'qr' | 'code128' | 'none'
   }): Promise<boolean> {
-    const { empresaId, printerId, paperWidth, fontSize } = input
+    const { empresaId, printerId, paperWidth, fontSize, copies, orderCode } = input
 
     const patch: Record<string, any> = {}
     if (paperWidth) patch.paperWidth = paperWidth
     if (fontSize) patch.fontSize = fontSize
+    if (copies) patch.copies = Math.min(Math.max(Math.floor(copies), 1), 5)
+    if (orderCode) patch.orderCode = orderCode
 
     if (Object.keys(patch).length === 0) return false
 
@@ -303,7 +371,10 @@ export class PrintService {
     return anyActive?.id ? (anyActive.id as string) : null
   }
 
-  async createPrintJob(input: CreatePrintJobInput, trx?: Kysely<Database>): Promise<{ jobId: string; alreadyExisted?: boolean }> {
+  async createPrintJob(
+    input: CreatePrintJobInput,
+    trx?: Kysely<Database>
+  ): Promise<{ jobId: string; alreadyExisted?: boolean; payload?: Record<string, any> }> {
     const { empresaId, printerId, externalId, type, payload } = input
     const dbOrTrx = trx ?? db
 
@@ -329,7 +400,11 @@ export class PrintService {
           ? existingFormat
           : {
               paperWidth: printerMeta?.paperWidth || '80mm',
-              fontSize: printerMeta?.fontSize || 'normal'
+              fontSize: printerMeta?.fontSize || 'normal',
+              // El agente renderiza una vez e imprime N copias en un solo trabajo (un ack)
+              copies: printerMeta?.copies || 1,
+              // QR / Code128 de la comanda al pie, con los comandos nativos de la impresora
+              orderCode: printerMeta?.orderCode === 'none' ? undefined : printerMeta?.orderCode
             }
     }
 
@@ -339,7 +414,7 @@ export class PrintService {
       .where('printer_id', '=', printerId)
       .where('external_id', '=', externalId)
       .where('type', '=', type)
-      .where('status', '!=', 'failed')
+      .where('status', 'not in', ['failed', 'expired'])
       .executeTakeFirst()
 
     if (existing?.id) {
@@ -359,27 +434,152 @@ export class PrintService {
         last_error: null,
         info: null,
         printed_at: null,
+        lease_expires_at: null,
+        claimed_by_printer_id: null,
         created_at: sql`now()`,
         updated_at: sql`now()`
       })
       .returning(['id'])
       .executeTakeFirstOrThrow()
 
-    return { jobId: inserted.id as string }
+    return { jobId: inserted.id as string, payload: mergedPayload }
+  }
+
+  /**
+   * Firma un job para entrega directa por LAN al agente (sin esperar su poll).
+   * El token es HMAC(api_key_hash, `${externalId}.${exp}.${type}.${sha256(canonicalJson(payload))}`):
+   * el agente conoce su apiKey, así que puede verificarlo sin que el secreto salga del backend.
+   */
+  async signLocalPrintJob(
+    input: { printerId: string; externalId: string; type: string; payload: Record<string, any>; ttlSeconds?: number },
+    trx?: Kysely<Database>
+  ): Promise<LocalPrintJob | null> {
+    const dbOrTrx = trx ?? db
+    const printer = await dbOrTrx
+      .selectFrom('printers')
+      .select(['api_key_hash', 'meta'])
+      .where('id', '=', input.printerId)
+      .where('activo', '=', true)
+      .executeTakeFirst()
+
+    if (!printer?.api_key_hash) return null
+
+    const exp = Math.floor(Date.now() / 1000) + (input.ttlSeconds ?? 120)
+    // La firma cubre el contenido: un token capturado no sirve para imprimir otro payload
+    const payloadHash = crypto.createHash('sha256').update(canonicalJson(input.payload), 'utf8').digest('hex')
+    const token = crypto
+      .createHmac('sha256', printer.api_key_hash as string)
+      .update(`${input.externalId}.${exp}.${input.type}.${payloadHash}`, 'utf8')
+      .digest('hex')
+    const meta = (printer as any).meta as any
+
+    return {
+      printerId: input.printerId,
+      externalId: input.externalId,
+      type: input.type,
+      payload: input.payload,
+      token,
+      exp,
+      agentUrl: typeof meta?.lan_url === 'string' ? meta.lan_url : null
+    }
+  }
+
+  /**
+   * Encola un documento de caja en la impresora indicada (o la por defecto) y lo firma para
+   * entrega por LAN. El encabezado del negocio y el IVA salen de config_facturacion; el cierre
+   * de caja se arma aquí con las ventas del día por método de pago. null = sin impresora activa.
+   */
+  async createDocumentJob(input: {
+    empresaId: string
+    type: DocumentJobType
+    payload: Record<string, any>
+    usuarioNombre: string
+    printerId?: string | null
+  }): Promise<{ jobId: string; impresionLocal: LocalPrintJob | null } | null> {
+    const { empresaId, type } = input
+    const printerId = input.printerId || (await this.getDefaultPrinterId(empresaId))
+    if (!printerId) return null
+
+    const payload: Record<string, any> = { ...input.payload, version: 1 }
+    if (!payload.usuario) payload.usuario = { nombre: input.usuarioNombre }
+
+    const config = await this.configFacturacionRepo.findByEmpresaId(empresaId)
+    if (config && !payload.empresa && !payload.encabezado) {
+      payload.empresa = {
+        nombre: config.nombre_empresa,
+        nit: config.nit,
+        responsable_iva: config.responsable_iva,
+        direccion: config.direccion,
+        departamento: config.departamento,
+        ciudad: config.ciudad,
+        ubicacion_geografica: config.ubicacion_geografica,
+        telefonos: config.telefonos,
+        telefono2: config.telefono2
+      }
+    }
+    if (
+      type !== 'cash_close' &&
+      config?.responsable_iva &&
+      config.porcentaje_iva &&
+      payload.porcentaje_iva === undefined &&
+      !payload.impuestos
+    ) {
+      // IVA incluido en el total, igual que en la caja: el agente lo discrimina
+      payload.porcentaje_iva = Number(config.porcentaje_iva)
+    }
+
+    if (type === 'cash_close') {
+      // Día del cierre (YYYY-MM-DD); por defecto hoy en Colombia, no en UTC
+      const fecha =
+        typeof payload.fecha_cierre === 'string' && /^\d{4}-\d{2}-\d{2}$/.test(payload.fecha_cierre)
+          ? payload.fecha_cierre
+          : new Date().toLocaleDateString('en-CA', { timeZone: 'America/Bogota' })
+      const [totales, metodos] = await Promise.all([
+        this.reporteRepo.getTotalesVentas(empresaId, fecha),
+        this.reporteRepo.getVentasPorMetodoPago(empresaId, fecha)
+      ])
+      payload.datos = [
+        { etiqueta: 'Día', valor: fecha },
+        { etiqueta: 'Comandas', valor: String(Number(totales?.cantidad_comandas || 0)) },
+        ...(Array.isArray(payload.datos) ? payload.datos : [])
+      ]
+      payload.resumen_titulo = 'VENTAS POR METODO DE PAGO'
+      payload.resumen = metodos.map((m) => ({
+        metodo: m.metodo_pago || 'otro',
+        cantidad: Number(m.cantidad),
+        total: Number(m.total)
+      }))
+      payload.total = Number(totales?.total_ventas || 0)
+    }
+
+    // Cada impresión es un job nuevo: una reimpresión del mismo recibo no se deduplica
+    const externalId = `${type}:${crypto.randomUUID()}`
+    const job = await this.createPrintJob({ empresaId, printerId, externalId, type, payload })
+    const impresionLocal = job.payload
+      ? await this.signLocalPrintJob({ printerId, externalId, type, payload: job.payload })
+      : null
+    return { jobId: job.jobId, impresionLocal }
   }
 
   /**
    * Reclama jobs (pending -> processing) de manera atómica para evitar duplicados.
-   * Incrementa attempts al reclamar.
+   * Incrementa attempts al reclamar y asigna un lease: los jobs en processing cuyo lease
+   * venció (agente caído entre fetch y ack) vuelven a ser reclamables.
    */
-  async claimPendingJobs(printerId: string, limit: number = 10) {
+  async claimPendingJobs(printerId: string, limit: number = 10, leaseSeconds: number = DEFAULT_LEASE_SECONDS) {
     return await db.transaction().execute(async (trx) => {
       const result = await sql`
         with cte as (
           select id
           from print_jobs
           where printer_id = ${printerId}::uuid
-            and status = 'pending'
+            and (
+              status = 'pending'
+              or (
+                status = 'processing'
+                and coalesce(lease_expires_at, updated_at + interval '10 minutes') < now()
+              )
+            )
           order by created_at asc
           for update skip locked
           limit ${limit}
@@ -387,26 +587,157 @@ export class PrintService {
         update print_jobs
         set status = 'processing',
             attempts = attempts + 1,
+            lease_expires_at = now() + make_interval(secs => ${leaseSeconds}),
+            claimed_by_printer_id = null,
             updated_at = now()
         where id in (select id from cte)
-        returning id, printer_id, empresa_id, external_id, type, payload, status, attempts, last_error, info, printed_at, created_at, updated_at
+        returning id, printer_id, empresa_id, external_id, type, payload, status, attempts, last_error, info, printed_at, lease_expires_at, created_at, updated_at
       `.execute(trx)
 
       return result.rows
     })
   }
 
+  /**
+   * Reclamo de un agente de respaldo: primero su propia cola y, con el cupo restante, los jobs
+   * de impresoras principales de la empresa cuyo heartbeat está vencido o cuya cola está atrasada.
+   * En cuanto la principal vuelve a reportarse al día deja de cubrirla (los jobs ya reclamados
+   * los termina el respaldo).
+   */
+  async claimFailoverJobs(input: {
+    printerId: string
+    empresaId: string
+    limit?: number
+    leaseSeconds?: number
+    staleSeconds?: number
+    latencySeconds?: number
+  }): Promise<{ jobs: any[]; covering: string[] }> {
+    const { printerId, empresaId } = input
+    const limit = input.limit ?? 10
+    const leaseSeconds = input.leaseSeconds ?? DEFAULT_LEASE_SECONDS
+    const staleSeconds = input.staleSeconds ?? FAILOVER_STALE_SECONDS
+    const latencySeconds = input.latencySeconds ?? FAILOVER_LATENCY_SECONDS
+
+    const own = await this.claimPendingJobs(printerId, limit, leaseSeconds)
+    const remaining = limit - own.length
+
+    return await db.transaction().execute(async (trx) => {
+      const primaries = await sql<{ id: string }>`
+        select p.id
+        from printers p
+        where p.empresa_id = ${empresaId}::uuid
+          and p.activo = true
+          and p.id <> ${printerId}::uuid
+          and coalesce(p.meta->>'failover_role', 'primary') <> 'standby'
+          and (
+            p.last_seen_at is null
+            or p.last_seen_at < now() - make_interval(secs => ${staleSeconds})
+            or p.meta->>'circuit_open' = 'true'
+            or exists (
+              select 1 from print_jobs j
+              where j.printer_id = p.id
+                and j.status = 'pending'
+                and j.created_at < now() - make_interval(secs => ${latencySeconds})
+            )
+          )
+      `.execute(trx)
+
+      const covering = primaries.rows.map((row) => row.id)
+      if (covering.length === 0 || remaining <= 0) {
+        return { jobs: own, covering }
+      }
+
+      const result = await sql`
+        with cte as (
+          select id
+          from print_jobs
+          where printer_id = any(${covering}::uuid[])
+            and (
+              status = 'pending'
+              or (
+                status = 'processing'
+                and coalesce(lease_expires_at, updated_at + interval '10 minutes') < now()
+              )
+            )
+          order by created_at asc
+          for update skip locked
+          limit ${remaining}
+        )
+        update print_jobs
+        set status = 'processing',
+            attempts = attempts + 1,
+            lease_expires_at = now() + make_interval(secs => ${leaseSeconds}),
+            claimed_by_printer_id = ${printerId}::uuid,
+            updated_at = now()
+        where id in (select id from cte)
+        returning id, printer_id, empresa_id, external_id, type, payload, status, attempts, last_error, info, printed_at, lease_expires_at, created_at, updated_at
+      `.execute(trx)
+
+      return { jobs: [...own, ...result.rows], covering }
+    })
+  }
+
+  /**
+   * Extiende el lease de jobs que el agente sigue procesando.
+   */
+  async renewLeases(input: { printerId: string; jobIds: string[]; leaseSeconds?: number }): Promise<string[]> {
+    const { printerId, jobIds } = input
+    const leaseSeconds = input.leaseSeconds ?? DEFAULT_LEASE_SECONDS
+    if (jobIds.length === 0) return []
+
+    const rows = await db
+      .updateTable('print_jobs')
+      .set({
+        lease_expires_at: sql`now() + make_interval(secs => ${leaseSeconds})`,
+        updated_at: sql`now()`
+      })
+      .where(sql`coalesce(claimed_by_printer_id, printer_id)`, '=', printerId)
+      .where('status', '=', 'processing')
+      .where('id', 'in', jobIds)
+      .returning(['id'])
+      .execute()
+
+    return rows.map((row) => row.id as string)
+  }
+
+  /**
+   * Devuelve un job reclamado a la cola (processing -> pending) sin contarlo como fallido.
+   */
+  async releaseJob(input: { printerId: string; jobId: string; reason?: string }): Promise<boolean> {
+    const { printerId, jobId, reason } = input
+
+    const update = await db
+      .updateTable('print_jobs')
+      .set({
+        status: 'pending',
+        lease_expires_at: null,
+        claimed_by_printer_id: null,
+        info: reason ?? null,
+        updated_at: sql`now()`
+      })
+      .where('id', '=', jobId)
+      .where(sql`coalesce(claimed_by_printer_id, printer_id)`, '=', printerId)
+      .where('status', '=', 'processing')
+      .returning(['id'])
+      .executeTakeFirst()
+
+    return Boolean(update?.id)
+  }
+
   async listJobs(params: {
     empresaId?: string
     printerId?: string
+    claimedBy?: string
     status?: PrintJobStatus
     limit?: number
   }) {
-    const { empresaId, printerId, status, limit = 50 } = params
+    const { empresaId, printerId, claimedBy, status, limit = 50 } = params
     let q = db.selectFrom('print_jobs').selectAll().orderBy('created_at', 'desc').limit(limit)
 
     if (empresaId) q = q.where('empresa_id', '=', empresaId)
     if (printerId) q = q.where('printer_id', '=', printerId)
+    // Jobs que procesa un agente: los propios no cubiertos por otro + los que cubre por failover
+    if (claimedBy) q = q.where(sql`coalesce(claimed_by_printer_id, printer_id)`, '=', claimedBy)
     if (status) q = q.where('status', '=', status)
 
     return await q.execute()
@@ -429,18 +760,159 @@ export class PrintService {
       .set({
         status,
         info: info ?? null,
-        last_error: status === 'failed' ? (reason ?? 'failed') : null,
+        last_error: status === 'done' ? null : (reason ?? status),
         printed_at: status === 'done' ? (printedAtValue ?? sql`now()`) : null,
+        lease_expires_at: null,
         updated_at: sql`now()`
       })
       .where('id', '=', jobId)
-      .where('printer_id', '=', printerId)
+      .where(sql`coalesce(claimed_by_printer_id, printer_id)`, '=', printerId)
       .returning(['id'])
       .executeTakeFirst()
 
     return Boolean(update?.id)
   }
 
+  /**
+   * Catálogo para el caché del agente. Con `since` (versión que el agente ya tiene) solo devuelve
+   * lo modificado desde entonces, con CATALOG_OVERLAP_MS de margen. Las filas borradas no se
+   * informan: un id que ya no se usa en jobs nuevos no molesta en el caché.
+   */
+  async getCatalog(empresaId: string, since?: Date | null): Promise<PrintCatalog> {
+    const desde = since ? new Date(since.getTime() - CATALOG_OVERLAP_MS) : null
+
+    const [productos, categorias, personalizaciones, usuarios] = await Promise.all([
+      db
+        .selectFrom('productos')
+        .select(['id', 'nombre', 'categoria_id', 'updated_at'])
+        .where('empresa_id', '=', empresaId)
+        .$if(Boolean(desde), (qb) => qb.where('updated_at', '>', desde!))
+        .execute(),
+      db
+        .selectFrom('categorias_productos')
+        .select(['id', 'nombre', 'updated_at'])
+        .where('empresa_id', '=', empresaId)
+        .$if(Boolean(desde), (qb) => qb.where('updated_at', '>', desde!))
+        .execute(),
+      db
+        .selectFrom('items_personalizacion')
+        .select(['id', 'nombre', 'updated_at'])
+        .where('empresa_id', '=', empresaId)
+        .$if(Boolean(desde), (qb) => qb.where('updated_at', '>', desde!))
+        .execute(),
+      db
+        .selectFrom('usuarios')
+        .select(['id', 'nombre', 'updated_at'])
+        .where('empresa_id', '=', empresaId)
+        .$if(Boolean(desde), (qb) => qb.where('updated_at', '>', desde!))
+        .execute()
+    ])
+
+    // Versión = updated_at más reciente; sin cambios se mantiene la que ya tenía el agente
+    let version = since ? since.getTime() : 0
+    for (const row of [...productos, ...categorias, ...personalizaciones, ...usuarios] as any[]) {
+      const updatedAt = row.updated_at ? new Date(row.updated_at).getTime() : 0
+      if (updatedAt > version) version = updatedAt
+    }
+
+    return {
+      version: version ? new Date(version).toISOString() : null,
+      full: !since,
+      productos: productos.map((p: any) => ({ id: p.id, nombre: p.nombre, categoria_id: p.categoria_id || null })),
+      categorias: categorias.map((c: any) => ({ id: c.id, nombre: c.nombre })),
+      personalizaciones: personalizaciones.map((p: any) => ({ id: p.id, nombre: p.nombre })),
+      usuarios: usuarios.map((u: any) => ({ id: u.id, nombre: u.nombre }))
+    }
+  }
+
+  /**
+   * Quita de los payloads de comanda los nombres que el agente puede resolver con su catálogo
+   * (versión `catalogVersion`): productos y su categoría, personalizaciones y usuario viajan
+   * solo como ids. Lo que no se pueda resolver con seguridad queda con nombre, igual que antes.
+   */
+  async compactJobPayloads(empresaId: string, jobs: any[], catalogVersion: Date): Promise<any[]> {
+    const compactables = jobs.filter(
+      (job) => job.type === 'kitchen_ticket' && job.payload && job.payload.version === 1 && Array.isArray(job.payload.items)
+    )
+    if (!compactables.length) return jobs
+
+    const productIds = new Set<string>()
+    const personalizacionIds = new Set<string>()
+    const usuarioIds = new Set<string>()
+    for (const job of compactables) {
+      for (const item of [...job.payload.items, ...(job.payload.snapshot_items || [])]) {
+        if (item?.producto_id) productIds.add(item.producto_id)
+        for (const id of item?.personalizacion_ids || []) personalizacionIds.add(id)
+      }
+      if (job.payload.usuario?.id) usuarioIds.add(job.payload.usuario.id)
+    }
+
+    const cutoff = new Date(catalogVersion.getTime() - CATALOG_OVERLAP_MS)
+    const [productos, personalizaciones, usuarios] = await Promise.all([
+      productIds.size
+        ? db
+            .selectFrom('productos')
+            .leftJoin('categorias_productos', 'categorias_productos.id', 'productos.categoria_id')
+            .select(['productos.id as id'])
+            .where('productos.empresa_id', '=', empresaId)
+            .where('productos.id', 'in', Array.from(productIds))
+            .where('productos.updated_at', '<=', cutoff)
+            .where((eb) =>
+              eb.or([eb('categorias_productos.id', 'is', null), eb('categorias_productos.updated_at', '<=', cutoff)])
+            )
+            .execute()
+        : [],
+      personalizacionIds.size
+        ? db
+            .selectFrom('items_personalizacion')
+            .select(['id'])
+            .where('empresa_id', '=', empresaId)
+            .where('id', 'in', Array.from(personalizacionIds))
+            .where('updated_at', '<=', cutoff)
+            .execute()
+        : [],
+      usuarioIds.size
+        ? db
+            .selectFrom('usuarios')
+            .select(['id'])
+            .where('empresa_id', '=', empresaId)
+            .where('id', 'in', Array.from(usuarioIds))
+            .where('updated_at', '<=', cutoff)
+            .execute()
+        : []
+    ])
+    const knownProductos = new Set(productos.map((p: any) => p.id))
+    const knownPersonalizaciones = new Set(personalizaciones.map((p: any) => p.id))
+    const knownUsuarios = new Set(usuarios.map((u: any) => u.id))
+
+    const compactItem = (item: any) => {
+      if (!item) return item
+      if (!knownProductos.has(item.producto_id)) {
+        const { personalizacion_ids, ...rest } = item
+        return rest
+      }
+      const { nombre, categoria, ...rest } = item
+      const ids: string[] = Array.isArray(item.personalizacion_ids) ? item.personalizacion_ids : []
+      const namesMatch = ids.length === (item.personalizaciones || []).length
+      if (namesMatch && ids.every((id) => knownPersonalizaciones.has(id))) {
+        delete rest.personalizaciones
+      } else {
+        delete rest.personalizacion_ids
+      }
+      return rest
+    }
+
+    const version = catalogVersion.toISOString()
+    return jobs.map((job) => {
+      if (!compactables.includes(job)) return job
+      const payload = { ...job.payload, catalogo: version }
+      payload.items = payload.items.map(compactItem)
+      if (Array.isArray(payload.snapshot_items)) payload.snapshot_items = payload.snapshot_items.map(compactItem)
+      if (payload.usuario?.id && knownUsuarios.has(payload.usuario.id)) payload.usuario = { id: payload.usuario.id }
+      return { ...job, payload }
+    })
+  }
+
   async heartbeat(input: { printerId: string; empresaId: string; status?: string; uptime?: number; meta?: any }) {
     const { printerId, empresaId, status, uptime, meta } = input
 
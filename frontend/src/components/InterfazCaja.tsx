@@ -349,11 +349,34 @@ export default function InterfazCaja({ onMesaLiberada }: InterfazCajaProps) {
     return ' '.repeat(espacios) + texto;
   };
 
-  const generarFactura = () => {
+  // Payload de recibo / factura para el agente: el encabezado del negocio y el IVA los agrega el backend
+  const payloadDocumentoCaja = (comanda: Comanda) => ({
+    tipo_pedido: comanda.tipo_pedido,
+    mesas: (comanda.mesas || []).map(m => ({ salon: m.salon, numero: m.numero })),
+    cliente: comanda.tipo_pedido === 'domicilio' ? comanda.datos_cliente : undefined,
+    usuario: { nombre: comanda.usuario_nombre || comanda.mesero },
+    items: (comanda.items || []).map(item => ({
+      nombre: item.producto.nombre,
+      cantidad: item.cantidad,
+      precio_unitario: item.precio_unitario,
+      subtotal: item.subtotal,
+      personalizaciones: item.personalizacion && Object.keys(item.personalizacion).length > 0
+        ? getPersonalizacionesParaImpresion(item.personalizacion, categoriasPersonalizacion, itemsPersonalizacion)
+        : [],
+      observaciones: item.observaciones
+    })),
+    observaciones_generales: comanda.observaciones_generales,
+    total: comanda.total
+  });
+
+  const generarFactura = async () => {
     if (!comandaSeleccionada || !configFacturacion) return;
     
     // Marcar como impresa
     marcarFacturaImpresa(comandaSeleccionada.id);
+
+    // Impresión nativa en el agente; sin impresora remota se usa el diálogo del navegador
+    if (await apiService.imprimirDocumento('invoice', payloadDocumentoCaja(comandaSeleccionada))) return;
     
     // Información de mesa o cliente según tipo
     let mesaInfo = '';
@@ -484,11 +507,21 @@ IVA (${configFacturacion.porcentaje_iva}%)              ${iva.toLocaleString('es
   };
 
   // RECIBO DE PAGO
-  const generarRecibo = (factura: any) => {
+  const generarRecibo = async (factura: any) => {
     if (!configFacturacion) return;
 
     const fechaActual = new Date();
     const numeroFactura = Math.floor(Math.random() * 9999) + 1000;
+
+    const impresoEnAgente = await apiService.imprimirDocumento('receipt', {
+      ...payloadDocumentoCaja(factura.comanda),
+      numero: String(numeroFactura),
+      caja: '01',
+      metodo_pago: factura.metodo_pago,
+      monto_pagado: factura.monto_pagado,
+      cambio: factura.cambio
+    });
+    if (impresoEnAgente) return;
     
     // Información de mesa o cliente según tipo
     let mesaInfo = '';
@@ -618,6 +651,16 @@ CAMBIO                 ${factura.cambio.toLocaleString('es-CO').padStart(7, ' ')
     window.open(`/recibo?data=${reciboData}`, '_blank');
   };
 
+  // CIERRE DE CAJA: ventas del día por método de pago, calculadas e impresas vía agente
+  const imprimirCierreCaja = async () => {
+    const hoy = new Date();
+    const fecha = `${hoy.getFullYear()}-${String(hoy.getMonth() + 1).padStart(2, '0')}-${String(hoy.getDate()).padStart(2, '0')}`;
+    const impreso = await apiService.imprimirDocumento('cash_close', { fecha_cierre: fecha });
+    if (!impreso) {
+      alert('No hay una impresora remota activa para imprimir el cierre de caja');
+    }
+  };
+
   const actualizarEstadoComanda = async (comandaId: string, nuevoEstado: EstadoComanda) => {
     try {
       await apiService.actualizarEstadoComanda(comandaId, nuevoEstado);
@@ -690,12 +733,20 @@ CAMBIO                 ${factura.cambio.toLocaleString('es-CO').padStart(7, ' ')
     <div className="space-y-6">
       <div className="flex justify-between items-center">
         <h1 className="text-2xl font-bold text-secondary-800">Interfaz de Caja</h1>
-        <button
-          onClick={cargarComandasActivas}
-          className="btn-secondary"
-        >
-          Actualizar
-        </button>
+        <div className="flex space-x-2">
+          <button
+            onClick={imprimirCierreCaja}
+            className="btn-secondary"
+          >
+            Imprimir cierre de caja
+          </button>
+          <button
+            onClick={cargarComandasActivas}
+            className="btn-secondary"
+          >
+            Actualizar
+          </button>
+        </div>
       </div>
 
       <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
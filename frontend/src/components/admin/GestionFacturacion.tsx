@@ -23,6 +23,8 @@ export default function GestionFacturacion() {
   
   const [paperWidth, setPaperWidth] = useState<'58mm' | '80mm'>('80mm');
   const [fontSize, setFontSize] = useState<'small' | 'normal' | 'large'>('normal');
+  const [copies, setCopies] = useState<number>(1);
+  const [orderCode, setOrderCode] = useState<'qr' | 'code128' | 'none'>('none');
 
   useEffect(() => {
     cargarConfiguracion();
@@ -155,6 +157,8 @@ export default function GestionFacturacion() {
       const meta = selected?.meta || {};
       if (meta?.paperWidth) setPaperWidth(meta.paperWidth);
       if (meta?.fontSize) setFontSize(meta.fontSize);
+      setCopies(Number(meta?.copies) || 1);
+      setOrderCode(meta?.orderCode || 'none');
     } catch (e) {
       // Silencioso: si no hay permiso o no existe feature, no bloqueamos la vista
       console.error('Error cargando impresoras remotas:', e);
@@ -233,6 +237,30 @@ export default function GestionFacturacion() {
     }
   };
 
+  const handleRemoteCopiesChange = async (e: React.ChangeEvent<HTMLSelectElement>) => {
+    const value = Number(e.target.value) || 1;
+    setCopies(value);
+    if (!selectedRemotePrinterId) return;
+    try {
+      await apiService.updateRemotePrinterConfig(selectedRemotePrinterId, { copies: value });
+      await cargarImpresorasRemotas();
+    } catch (err) {
+      console.error('Error actualizando copias remotas:', err);
+    }
+  };
+
+  const handleRemoteOrderCodeChange = async (e: React.ChangeEvent<HTMLSelectElement>) => {
+    const value = e.target.value as 'qr' | 'code128' | 'none';
+    setOrderCode(value);
+    if (!selectedRemotePrinterId) return;
+    try {
+      await apiService.updateRemotePrinterConfig(selectedRemotePrinterId, { orderCode: value });
+      await cargarImpresorasRemotas();
+    } catch (err) {
+      console.error('Error actualizando código de pedido remoto:', err);
+    }
+  };
+
   const testRemotePrinter = async () => {
     if (!selectedRemotePrinterId) return;
     setRemoteTesting(true);
@@ -399,7 +427,7 @@ ${separador}
                     </div>
                   </div>
 
-                  <div className="grid grid-cols-1 md:grid-cols-3 gap-4 mt-2">
+                  <div className="grid grid-cols-1 md:grid-cols-5 gap-4 mt-2">
                     <div>
                       <label className="block text-sm font-medium text-secondary-700 mb-1">Ancho de Papel</label>
                       <select
@@ -420,11 +448,37 @@ ${separador}
                         disabled={!selectedRemotePrinterId}
                         className="block w-full rounded-lg border-secondary-300 shadow-sm focus:border-primary-500 focus:ring-primary-500 disabled:bg-gray-100"
                       >
-                        <option value="small">Pequeña (más líneas)</option>
+                        <option value="small">Pequeña (Font B, más columnas)</option>
                         <option value="normal">Normal (recomendado)</option>
                         <option value="large">Grande (más legible)</option>
                       </select>
                     </div>
+                    <div>
+                      <label className="block text-sm font-medium text-secondary-700 mb-1">Copias por Comanda</label>
+                      <select
+                        value={copies}
+                        onChange={handleRemoteCopiesChange}
+                        disabled={!selectedRemotePrinterId}
+                        className="block w-full rounded-lg border-secondary-300 shadow-sm focus:border-primary-500 focus:ring-primary-500 disabled:bg-gray-100"
+                      >
+                        <option value={1}>1 copia</option>
+                        <option value={2}>2 copias (línea + expo)</option>
+                        <option value={3}>3 copias</option>
+                      </select>
+                    </div>
+                    <div>
+                      <label className="block text-sm font-medium text-secondary-700 mb-1">Código del Pedido</label>
+                      <select
+                        value={orderCode}
+                        onChange={handleRemoteOrderCodeChange}
+                        disabled={!selectedRemotePrinterId}
+                        className="block w-full rounded-lg border-secondary-300 shadow-sm focus:border-primary-500 focus:ring-primary-500 disabled:bg-gray-100"
+                      >
+                        <option value="none">Sin código</option>
+                        <option value="qr">QR (expo lo escanea)</option>
+                        <option value="code128">Código de barras</option>
+                      </select>
+                    </div>
                     <div className="flex items-end">
                       <div className="text-xs text-secondary-500">
                         {(() => {
@@ -7,6 +7,7 @@ import {
   Insumo, RecetaProductoInsumo, RecetaProductoResumen, AjustePersonalizacionInsumo, ConfiguracionSistema, InsumoHistorial,
   Proveedor, InsumoCategoria
 } from '@/types';
+import { printingService } from './printingService';
 
 const API_BASE_URL = '/api';
 
@@ -377,6 +378,7 @@ export const apiService = {
   // Comandas
   async createComanda(comanda: Partial<Comanda>): Promise<Comanda> {
     const response = await api.post('/comandas', comanda);
+    void printingService.pushToAgent(response.data?.impresionLocal);
     return response.data;
   },
 
@@ -410,6 +412,7 @@ export const apiService = {
       imprimir: imprimir_adicionales,
       imprimirCompleta: imprimir_completa
     });
+    void printingService.pushToAgent(response.data?.impresionLocal);
     return response.data;
   },
 
@@ -626,7 +629,7 @@ export const apiService = {
       await api.delete(`/print/printers/${printerId}`);
     },
 
-    async updateRemotePrinterConfig(printerId: string, config: { paperWidth?: '58mm' | '80mm'; fontSize?: 'small' | 'normal' | 'large' }): Promise<void> {
+    async updateRemotePrinterConfig(printerId: string, config: { paperWidth?: '58mm' | '80mm'; fontSize?: 'small' | 'normal' | 'large'; copies?: number; orderCode?: 'qr' | 'code128' | 'none' }): Promise<void> {
       await api.patch(`/print/printers/${printerId}/config`, config);
     },
 
@@ -639,6 +642,20 @@ export const apiService = {
       });
     },
 
+    /**
+     * Recibo, factura o cierre de caja impreso por el agente con su layout ESC/POS nativo.
+     * false si no hay impresora remota activa: la caja usa el diálogo de impresión del navegador.
+     */
+    async imprimirDocumento(type: 'receipt' | 'invoice' | 'cash_close', payload: Record<string, any>): Promise<boolean> {
+      try {
+        const response = await api.post('/print/documents', { type, payload });
+        void printingService.pushToAgent(response.data?.impresionLocal);
+        return true;
+      } catch (error) {
+        return false;
+      }
+    },
+
   async updateConfiguracionNomina(config: Partial<ConfiguracionNomina>): Promise<ConfiguracionNomina> {
     const response = await api.put('/nomina/configuracion', config);
     return response.data;
@@ -10,6 +10,49 @@ export interface PrinterStatus {
   error?: string;
 }
 
+export interface BatchPrintDocument {
+  /** Texto ya formateado; se ignora si viene payload */
+  text?: string;
+  /** Payload estructurado de la comanda: el plugin lo renderiza igual que el agente */
+  payload?: Record<string, any>;
+  printerName: string;
+  /** Perfil de impresora del agente (epson-tm, xprinter, ...) para obtener los mismos bytes */
+  profile?: string;
+  cut?: boolean;
+  encoding?: string;
+  copies?: number;
+}
+
+export interface BatchPrintResult {
+  indice: number;
+  impresora?: string;
+  success: boolean;
+  copias?: number;
+  error?: string;
+}
+
+export interface BatchPrintResponse {
+  success: boolean;
+  total?: number;
+  impresos?: number;
+  resultados?: BatchPrintResult[];
+  error?: string;
+}
+
+/**
+ * Job firmado por el backend para entregarlo directo al agente por la red local.
+ * El agente imprime al instante y luego reconcilia con la cola en la nube por externalId.
+ */
+export interface LocalPrintJob {
+  printerId: string;
+  externalId: string;
+  type: string;
+  payload: Record<string, any>;
+  token: string;
+  exp: number;
+  agentUrl: string | null;
+}
+
 export const printingService = {
   /**
    * Verifica si el plugin de impresión está activo
@@ -68,6 +111,95 @@ export const printingService = {
         })
       });
       
+      const data = await res.json();
+      return data;
+    } catch (error: any) {
+      return { success: false, error: error.message };
+    }
+  },
+
+  /**
+   * Envía el payload estructurado de una comanda; el plugin lo formatea con el mismo render que
+   * el agente remoto (menos datos por petición que el texto ya formateado).
+   */
+  async printTicket(
+    payload: Record<string, any>,
+    printerName: string,
+    profile?: string
+  ): Promise<{ success: boolean; message?: string; error?: string }> {
+    try {
+      const res = await fetch(`${PLUGIN_URL}/imprimir`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          payload,
+          impresora: printerName,
+          perfil: profile
+        })
+      });
+
+      const data = await res.json();
+      return data;
+    } catch (error: any) {
+      return { success: false, error: error.message };
+    }
+  },
+
+  /**
+   * Envía varios documentos en una sola petición.
+   * Los documentos de una misma impresora salen como un solo trabajo con cortes entre ellos.
+   */
+  async pushToAgent(job: LocalPrintJob | null | undefined): Promise<boolean> {
+    if (!job?.agentUrl) return false;
+    try {
+      const controller = new AbortController();
+      const timeoutId = setTimeout(() => controller.abort(), 1500);
+
+      const res = await fetch(`${job.agentUrl}/jobs`, {
+        method: 'POST',
+        signal: controller.signal,
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          externalId: job.externalId,
+          type: job.type,
+          payload: job.payload,
+          token: job.token,
+          exp: job.exp
+        })
+      });
+      clearTimeout(timeoutId);
+      return res.ok;
+    } catch (error) {
+      // Sin agente en la LAN: la cola en la nube imprime igual
+      return false;
+    }
+  },
+
+  async printBatch(documents: BatchPrintDocument[]): Promise<BatchPrintResponse> {
+    try {
+      const res = await fetch(`${PLUGIN_URL}/imprimir/lote`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          documentos: documents.map((doc) =>
+            doc.payload
+              ? {
+                  payload: doc.payload,
+                  impresora: doc.printerName,
+                  perfil: doc.profile,
+                  copias: doc.copies
+                }
+              : {
+                  texto: doc.text,
+                  impresora: doc.printerName,
+                  cortar: doc.cut ?? true,
+                  encoding: doc.encoding ?? 'cp850',
+                  copias: doc.copies ?? 1
+                }
+          )
+        })
+      });
+
       const data = await res.json();
       return data;
     } catch (error: any) {
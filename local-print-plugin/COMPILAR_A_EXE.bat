@@ -13,13 +13,18 @@ echo Seleccione el modo de compilacion:
 echo.
 echo [1] PRODUCCION - Sin consola (recomendado para cliente)
 echo [2] DEBUG - Con consola (para desarrollo/debugging)
+echo [3] RAPIDO - Carpeta onedir, arranque rapido al iniciar Windows
 echo.
-set /p modo="Ingrese opcion (1 o 2): "
+set /p modo="Ingrese opcion (1, 2 o 3): "
 
 if "%modo%"=="2" (
     set "argumento=debug"
     echo.
     echo Compilando en modo DEBUG (con consola)...
+) else if "%modo%"=="3" (
+    set "argumento=rapido"
+    echo.
+    echo Compilando en modo RAPIDO (carpeta onedir, sin consola)...
 ) else (
     set "argumento="
     echo.
@@ -59,6 +64,8 @@ echo     COMPILACION COMPLETADA
 echo ========================================================
 echo.
 echo El ejecutable esta en: dist\montis-printer-agent.exe
+echo (modo RAPIDO: dist\montis-printer-agent\montis-printer-agent.exe,
+echo  comparta la carpeta completa)
 echo.
 echo IMPORTANTE: Comparta este .exe con el cliente.
 echo Solo necesita hacer doble clic para ejecutarlo.
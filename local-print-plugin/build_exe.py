@@ -1,6 +1,11 @@
 """
 Script para compilar el agente de impresión remota a ejecutable .exe
 Genera un archivo standalone que no requiere Python instalado
+
+Perfiles:
+  python build_exe.py          -> onefile, sin consola (producción)
+  python build_exe.py debug    -> onefile, con consola
+  python build_exe.py rapido   -> onedir (arranque rápido), sin consola
 """
 
 import PyInstaller.__main__
@@ -15,7 +20,7 @@ def validar_version_python() -> None:
         print("Use Python 3.10, 3.11 o 3.12 para compilar montis-printer-agent.exe")
         raise SystemExit(1)
 
-def compilar(con_consola=False):
+def compilar(con_consola=False, onedir=False):
     """Compila printer_agent.py a ejecutable .exe usando PyInstaller"""
 
     validar_version_python()
@@ -26,18 +31,23 @@ def compilar(con_consola=False):
     
     # Elegir modo de ventana
     modo_ventana = '--console' if con_consola else '--noconsole'
+
+    # onefile descomprime todo (~13 MB, incluido Tcl/Tk) en %TEMP% en cada arranque.
+    # onedir deja los archivos ya extraídos junto al .exe: el autoinicio de Windows
+    # llega al primer poll sin ese costo.
+    modo_empaquetado = '--onedir' if onedir else '--onefile'
     
     # Configuración de PyInstaller
     PyInstaller.__main__.run([
         'printer_agent.py',                  # Archivo principal
         '--name=montis-printer-agent',       # Nombre del ejecutable
-        '--onefile',                         # Un solo archivo .exe
+        modo_empaquetado,                    # Un solo archivo .exe o carpeta
         modo_ventana,                        # Modo de ventana
         '--icon=NONE',                       # Agregar ícono si existe
         '--clean',                           # Limpiar archivos temporales
         '--distpath=dist',                   # Carpeta de salida
         '--workpath=build',                  # Carpeta temporal
-        '--hidden-import=requests',          # Asegurar imports
+        '--hidden-import=requests',          # Asegurar imports (se cargan bajo demanda)
         '--hidden-import=urllib3',
         '--hidden-import=charset_normalizer',
         '--hidden-import=idna',
@@ -46,8 +56,6 @@ def compilar(con_consola=False):
         '--hidden-import=tkinter',
         '--hidden-import=tkinter.ttk',
         '--hidden-import=tkinter.messagebox',
-        '--hidden-import=win32api',
-        '--hidden-import=win32con',
         '--hidden-import=win32crypt',
         '--hidden-import=win32print',
         '--collect-submodules=requests',
@@ -55,25 +63,39 @@ def compilar(con_consola=False):
         '--collect-data=certifi',
         '--collect-data=tkinter',
         '--collect-binaries=tkinter',
+        '--exclude-module=unittest',         # No usados por el agente
+        '--exclude-module=pydoc',
+        '--exclude-module=doctest',
         '--noupx',                           # No comprimir con UPX (más compatible)
         '--noconfirm',                       # No pedir confirmación
     ])
     
+    if onedir:
+        salida = "dist\\montis-printer-agent\\montis-printer-agent.exe"
+    else:
+        salida = "dist\\montis-printer-agent.exe"
+
     print("\n" + "=" * 60)
     print("✅ Compilación completada")
     print("=" * 60)
-    print(f"Ejecutable generado en: dist\\montis-printer-agent.exe")
+    print(f"Ejecutable generado en: {salida}")
     print(f"Modo: {'Con consola (debug)' if con_consola else 'Sin consola (producción)'}")
+    print(f"Empaquetado: {'Carpeta (arranque rápido)' if onedir else 'Un solo archivo'}")
     print("=" * 60)
     print("\nPróximos pasos:")
     print("1. Probar el .exe localmente")
-    print("2. Compartir con el cliente")
+    if onedir:
+        print("2. Compartir la CARPETA completa dist\\montis-printer-agent con el cliente")
+    else:
+        print("2. Compartir con el cliente")
     print("3. Activar con código y seleccionar impresora")
+    print("4. Medir arranque: montis-printer-agent.exe --startup-profile")
     print("=" * 60)
 
 
 if __name__ == '__main__':
-    # Si se pasa argumento "debug", compilar con consola
-    con_consola = 'debug' in [arg.lower() for arg in sys.argv]
-    compilar(con_consola=con_consola)
-
+    # "debug" compila con consola; "rapido"/"onedir" genera el perfil de arranque rápido
+    argumentos = [arg.lower() for arg in sys.argv[1:]]
+    con_consola = 'debug' in argumentos
+    onedir = 'rapido' in argumentos or 'onedir' in argumentos
+    compilar(con_consola=con_consola, onedir=onedir)
@@ -0,0 +1,141 @@
+"""
+Fixtures compartidas de las pruebas del agente (sin Windows ni impresora):
+
+    python -m pytest test_*.py -q
+"""
+
+import logging
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import printer_agent
+import spooler
+from fake_backend import FakeBackend, FakeBackendHandler
+from fake_spooler import FakeSpooler
+
+PRINTER_NAME = "EPSON TM-T20"
+
+
+class StopAgent(BaseException):
+    """Sale de Agent.run_forever (que atrapa Exception) al terminar la prueba."""
+
+
+@pytest.fixture
+def fake_spool(tmp_path, monkeypatch):
+    """spooler.py contra un FakeSpooler propio de la prueba (un trabajo impreso cada 0,1 s)."""
+    spool = FakeSpooler(str(tmp_path / "spool"), seconds_per_job=0.1)
+    monkeypatch.setattr(spooler, "FAKE_SPOOLER_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(spooler, "_fake_spooler", spool)
+    return spool
+
+
+@pytest.fixture
+def backend():
+    """FakeBackend escuchando en un puerto libre de 127.0.0.1; su URL queda en backend.api_base."""
+    fake = FakeBackend()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBackendHandler)
+    server.backend = fake  # type: ignore[attr-defined]
+    threading.Thread(target=server.serve_forever, name="fake-backend", daemon=True).start()
+    fake.api_base = f"http://127.0.0.1:{server.server_address[1]}"  # type: ignore[attr-defined]
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def agent_threads(monkeypatch, backend, fake_spool):
+    """Agentes en marcha de la prueba (agente -> hilo); se detienen antes de deshacer los parches."""
+    threads: dict[printer_agent.Agent, threading.Thread] = {}
+    yield threads
+    for agent in threads:
+        halt(agent)
+    for thread in threads.values():
+        thread.join(timeout=10)
+
+
+def halt(agent: printer_agent.Agent) -> None:
+    def stop() -> None:
+        raise StopAgent
+
+    agent.reload_runtime_state = stop  # type: ignore[method-assign]
+    agent.wake.set()
+
+
+@pytest.fixture
+def make_agent(tmp_path, monkeypatch, backend, fake_spool):
+    """
+    Crea un Agent contra el backend de la prueba, con sus archivos en tmp_path/<impresora> y
+    esperas cortas, sin arrancar su loop.
+    """
+    monkeypatch.setattr(printer_agent, "STATE_PATH", str(tmp_path / "agent_state.dat"))
+    monkeypatch.setattr(printer_agent, "CATALOG_ENABLED", False)
+    for name in ("POLL_SECONDS", "POLL_BUSY_SECONDS"):
+        monkeypatch.setattr(printer_agent, name, 0.05)
+    monkeypatch.setattr(spooler, "SPOOL_POLL_SECONDS", 0.05)
+
+    def make(printer, printer_name=PRINTER_NAME, failover_role=""):
+        app_dir = tmp_path / printer["name"]
+        app_dir.mkdir()
+        for name, filename in (
+            ("PRINTED_JOURNAL_PATH", "printed_jobs.log"),
+            ("ROUTING_PATH", "routing.json"),
+            ("COMANDA_HISTORY_PATH", "printed_comandas.db"),
+            ("TICKET_HISTORY_PATH", "ticket_history.db"),
+        ):
+            monkeypatch.setattr(printer_agent, name, str(app_dir / filename))
+        state = printer_agent.AgentState(
+            api_base=backend.api_base,
+            printer_id=printer["id"],
+            api_key=printer["api_key"],
+            fingerprint=f"test-{printer['name']}",
+            printer_name=printer_name,
+        )
+        agent = printer_agent.Agent(state, logging.getLogger(f"test-agent-{printer['name']}"))
+        agent.failover_role = failover_role
+        return agent
+
+    return make
+
+
+@pytest.fixture
+def start_agent(make_agent, agent_threads):
+    """Como make_agent, y arranca Agent.run_forever en un hilo que se detiene al terminar la prueba."""
+
+    def start(printer, printer_name=PRINTER_NAME, failover_role=""):
+        agent = make_agent(printer, printer_name, failover_role)
+
+        def run() -> None:
+            try:
+                agent.run_forever()
+            except StopAgent:
+                pass
+
+        thread = threading.Thread(target=run, name=f"agent-{printer['name']}", daemon=True)
+        agent_threads[agent] = thread
+        thread.start()
+        return agent
+
+    return start
+
+
+@pytest.fixture
+def stop_agent(agent_threads):
+    """Detiene un agente en medio de la prueba (como cerrar el programa) y espera a que salga."""
+
+    def stop(agent: printer_agent.Agent) -> None:
+        halt(agent)
+        agent_threads.pop(agent).join(timeout=10)
+
+    return stop
+
+
+def wait_for(condition, timeout=5.0):
+    """Espera a que condition() sea verdadera; falla la prueba si no ocurre a tiempo."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("la condición no se cumplió a tiempo")
+        time.sleep(0.02)
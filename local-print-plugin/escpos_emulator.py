@@ -0,0 +1,827 @@
+"""
+Impresora térmica ESC/POS emulada para probar de punta a punta sin hardware (solo desarrollo).
+
+Interpreta el flujo de comandos (inicialización, página de códigos, fuente y tamaños, alineación,
+avances, cortes, imágenes raster, códigos QR/de barras y consultas de estado), arma los tickets
+cortados como texto (y PNG si Pillow está instalado) y simula el tiempo físico de impresión:
+milímetros de papel a MONTIS_ESCPOS_SPEED mm/s (150 por defecto, como una TM-T20) más el corte.
+Las fallas "sin papel" y "tapa abierta" detienen la impresión hasta que se resuelven; "fuera de
+línea" hace fallar OpenPrinter, como una impresora USB desconectada.
+
+Dos formas de conectarla:
+
+    # 1) En lugar de win32print: el agente real imprime y consulta la cola contra el emulador
+    MONTIS_ESCPOS_EMULATOR=/tmp/emu python printer_agent.py
+
+    # 2) Impresora de red (RAW, puerto 9100)
+    python escpos_emulator.py serve /tmp/emu --port 9100 --name "EPSON TM-T20"
+
+Cada ticket cortado queda en el directorio como <hora>-<impresora>.txt (y .png). Fallas desde
+otra consola:
+
+    python escpos_emulator.py fault /tmp/emu "EPSON TM-T20" paperout   # paperout | coveropen | offline | ok
+    python escpos_emulator.py status /tmp/emu
+    python escpos_emulator.py render ticket.bin --png ticket.png       # .bin de MONTIS_PRINT_TO_DIR
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, Optional
+
+# Pillow es opcional: solo hace falta para exportar los tickets como PNG.
+try:
+    from PIL import Image, ImageDraw, ImageFont  # type: ignore
+except ImportError:
+    Image = ImageDraw = ImageFont = None  # type: ignore[assignment]
+
+DOTS_PER_MM = 8  # 203 dpi
+PAPER_DOTS = 576  # 80 mm (72 mm imprimibles)
+DEFAULT_LINE_SPACING = 30  # ESC 2
+# Celda de carácter en puntos: Font A 12x24, Font B 9x17
+FONT_CELLS = {0: (12, 24), 1: (9, 17)}
+DEFAULT_SPEED_MM_S = float(os.getenv("MONTIS_ESCPOS_SPEED", "150") or 150)
+CUT_SECONDS = 0.3
+TICK_SECONDS = 0.05
+RECEIPTS_KEPT = 200
+DEFAULT_PRINTER_NAME = "EMULADOR ESC/POS"
+
+# ESC t n -> codificación de Python
+CODEPAGES = {0: "cp437", 2: "cp850", 3: "cp860", 4: "cp863", 5: "cp865", 16: "cp1252", 17: "cp866", 19: "cp858"}
+
+# JOB_STATUS_* (winspool.h) que devuelve EnumJobs del shim
+JOB_STATUS_PRINTING = 0x10
+JOB_STATUS_PAPEROUT = 0x40
+JOB_STATUS_USER_INTERVENTION = 0x400
+
+ESC, GS, DLE, FS = 0x1B, 0x1D, 0x10, 0x1C
+
+
+@dataclass(frozen=True)
+class TextStyle:
+    font: int = 0
+    bold: bool = False
+    underline: bool = False
+    reverse: bool = False
+    width: int = 1
+    height: int = 1
+
+
+@dataclass
+class PrintedLine:
+    segments: list[tuple[str, TextStyle]] = field(default_factory=list)
+    align: int = 0  # 0 izquierda, 1 centro, 2 derecha
+    dots: int = DEFAULT_LINE_SPACING
+    # Imagen raster (GS v 0): ancho en bytes, alto en puntos y datos, fila por fila
+    raster: Optional[tuple[int, int, bytes]] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(text for text, _ in self.segments)
+
+    def width_dots(self) -> int:
+        return sum(len(text) * FONT_CELLS[style.font][0] * style.width for text, style in self.segments)
+
+
+@dataclass
+class Receipt:
+    """Lo impreso entre dos cortes."""
+
+    lines: list[PrintedLine] = field(default_factory=list)
+    cut: Optional[str] = None  # "total" | "parcial"; None = sin cortar todavía
+    codepage: int = 0
+    # Códigos 2D y de barras impresos (tipo, contenido)
+    codes: list[tuple[str, str]] = field(default_factory=list)
+    drawer_kicks: int = 0
+
+    @property
+    def length_dots(self) -> int:
+        return sum(line.dots for line in self.lines)
+
+    @property
+    def length_mm(self) -> float:
+        return self.length_dots / DOTS_PER_MM
+
+    def print_seconds(self, speed_mm_s: float = DEFAULT_SPEED_MM_S) -> float:
+        return self.length_mm / speed_mm_s + (CUT_SECONDS if self.cut else 0.0)
+
+    def text(self, columns: int = PAPER_DOTS // FONT_CELLS[0][0]) -> str:
+        """El ticket como texto, con la alineación aplicada sobre el ancho del papel en Font A."""
+        cell = PAPER_DOTS / columns
+        rendered = []
+        for line in self.lines:
+            if line.raster is not None:
+                width_bytes, height, _ = line.raster
+                rendered.append(f"[imagen {width_bytes * 8}x{height}]")
+                continue
+            text = line.text.rstrip()
+            spare = max(int((PAPER_DOTS - line.width_dots()) / cell), 0)
+            if line.align == 1:
+                text = " " * (spare // 2) + text
+            elif line.align == 2:
+                text = " " * spare + text
+            rendered.append(text.rstrip())
+        return "\n".join(rendered)
+
+    def to_png(self, path: str) -> None:
+        if Image is None:
+            raise RuntimeError("Pillow no está instalado: pip install pillow")
+        height = max(self.length_dots, 1)
+        image = Image.new("1", (PAPER_DOTS, height), 1)
+        draw = ImageDraw.Draw(image)
+        fonts = {}
+        for font_id, (_, cell_h) in FONT_CELLS.items():
+            try:
+                fonts[font_id] = ImageFont.load_default(size=cell_h - 4)
+            except TypeError:  # Pillow < 10.1: solo la fuente bitmap
+                fonts[font_id] = ImageFont.load_default()
+        y = 0
+        for line in self.lines:
+            if line.raster is not None:
+                width_bytes, rows, data = line.raster
+                raster = Image.frombytes("1", (width_bytes * 8, rows), data)
+                image.paste(Image.eval(raster.convert("L"), lambda v: 255 - v).convert("1"), (0, y))
+            elif line.segments:
+                x = {1: (PAPER_DOTS - line.width_dots()) // 2, 2: PAPER_DOTS - line.width_dots()}.get(line.align, 0)
+                for text, style in line.segments:
+                    cell_w, cell_h = FONT_CELLS[style.font]
+                    w, h = len(text) * cell_w, cell_h
+                    glyphs = Image.new("1", (max(w, 1), h), 1)
+                    pen = ImageDraw.Draw(glyphs)
+                    for column, char in enumerate(text):
+                        # Monoespaciado como en la impresora: un carácter por celda (negrita = doble pasada)
+                        for offset in (0, 1) if style.bold else (0,):
+                            center = (column * cell_w + cell_w // 2 + offset, h // 2)
+                            pen.text(center, char, font=fonts[style.font], fill=0, anchor="mm")
+                    glyphs = glyphs.resize((max(w * style.width, 1), h * style.height))
+                    image.paste(glyphs, (x, y))
+                    if style.underline:
+                        draw.line((x, y + h * style.height - 1, x + w * style.width, y + h * style.height - 1), fill=0)
+                    x += w * style.width
+            y += line.dots
+        image.save(path)
+
+
+class EscPosEmulator:
+    """
+    Intérprete incremental de ESC/POS: feed() acepta el flujo en pedazos (un comando puede
+    quedar partido entre dos lecturas del socket) y devuelve las respuestas de estado.
+    """
+
+    def __init__(self, paper_out: Callable[[], bool] = lambda: False, cover_open: Callable[[], bool] = lambda: False):
+        self.paper_out = paper_out
+        self.cover_open = cover_open
+        self.receipts: list[Receipt] = []
+        self.unknown_commands = 0
+        self.buffer = b""
+        self.current = Receipt()
+        self.reset()
+
+    def reset(self) -> None:
+        """ESC @: vuelve a los valores de fábrica (no borra lo ya impreso)."""
+        self.style = TextStyle()
+        self.align = 0
+        self.line_spacing = DEFAULT_LINE_SPACING
+        self.codepage = 0
+        self.line = PrintedLine()
+        self.pending_code: Optional[str] = None
+        self.current.codepage = self.codepage
+
+    # --- Estado ---
+
+    def status_byte(self, n: int) -> int:
+        """Respuesta a DLE EOT n (bits fijos 1 y 4 encendidos, como en el manual de Epson)."""
+        paper_out, cover_open = self.paper_out(), self.cover_open()
+        if n == 1:
+            return 0x12 | (0x08 if paper_out or cover_open else 0)
+        if n == 2:
+            return 0x12 | (0x04 if cover_open else 0) | (0x20 if paper_out else 0) | (0x40 if paper_out or cover_open else 0)
+        if n == 4:
+            return 0x12 | (0x6C if paper_out else 0)
+        return 0x12
+
+    # --- Intérprete ---
+
+    def feed(self, data: bytes) -> bytes:
+        self.buffer += data
+        replies = bytearray()
+        position = 0
+        while position < len(self.buffer):
+            consumed = self.step(self.buffer, position, replies)
+            if consumed == 0:
+                break  # comando incompleto: esperar más bytes
+            position += consumed
+        self.buffer = self.buffer[position:]
+        return bytes(replies)
+
+    def finish(self) -> list[Receipt]:
+        """Fin del trabajo: cierra la línea abierta. Devuelve los tickets cortados hasta ahora."""
+        if self.line.segments:
+            self.newline()
+        return self.receipts
+
+    def step(self, data: bytes, i: int, replies: bytearray) -> int:
+        """Procesa un comando en data[i:]; devuelve los bytes consumidos (0 = incompleto)."""
+        available = len(data) - i
+        byte = data[i]
+
+        if byte == 0x0A:
+            self.newline()
+            return 1
+        if byte == 0x0D:
+            return 1
+        if byte == 0x09:
+            self.add_text(" " * 8)
+            return 1
+        if byte == DLE:
+            if available < 3:
+                return 0
+            if data[i + 1] == 0x04:
+                replies.append(self.status_byte(data[i + 2]))
+                return 3
+            if data[i + 1] == 0x14:  # DLE DC4 fn m t (pulso de gaveta en tiempo real)
+                if available < 5:
+                    return 0
+                self.current.drawer_kicks += 1
+                return 5
+            return 1
+        if byte == ESC:
+            return self.esc(data, i, available, replies)
+        if byte == GS:
+            return self.gs(data, i, available, replies)
+        if byte == FS:
+            if available < 2:
+                return 0
+            # FS . / FS & (modo kanji): sin parámetros; el resto de FS se ignora con su parámetro
+            return 2 if data[i + 1] in (0x2E, 0x26) else min(3, available)
+        if byte < 0x20 or byte == 0x7F:
+            return 1
+
+        end = i
+        while end < len(data) and data[end] >= 0x20 and data[end] != 0x7F:
+            end += 1
+        self.add_text(data[i:end].decode(CODEPAGES.get(self.codepage, "cp437"), errors="replace"))
+        return end - i
+
+    def esc(self, data: bytes, i: int, available: int, replies: bytearray) -> int:
+        if available < 2:
+            return 0
+        command = data[i + 1]
+        if command == 0x40:  # ESC @
+            if self.line.segments:
+                self.newline()
+            self.reset()
+            return 2
+        if command == 0x32:  # ESC 2
+            self.line_spacing = DEFAULT_LINE_SPACING
+            return 2
+        if command == 0x70:  # ESC p m t1 t2: pulso de gaveta
+            if available < 5:
+                return 0
+            self.current.drawer_kicks += 1
+            return 5
+        if command == 0x2A:  # ESC * m nL nH d...: imagen por columnas (se cuenta como 24 puntos de alto)
+            if available < 5:
+                return 0
+            columns = data[i + 3] | (data[i + 4] << 8)
+            size = 5 + columns * (3 if data[i + 2] in (32, 33) else 1)
+            if available < size:
+                return 0
+            self.feed_dots(24 if data[i + 2] in (32, 33) else 8)
+            return size
+        if available < 3:
+            return 0
+        n = data[i + 2]
+        if command == 0x74:  # ESC t n
+            self.codepage = n
+            self.current.codepage = n
+        elif command == 0x4D:  # ESC M n
+            self.style = replace(self.style, font=1 if n in (1, 49) else 0)
+        elif command == 0x21:  # ESC ! n
+            self.style = replace(
+                self.style,
+                font=n & 0x01,
+                bold=bool(n & 0x08),
+                height=2 if n & 0x10 else 1,
+                width=2 if n & 0x20 else 1,
+                underline=bool(n & 0x80),
+            )
+        elif command == 0x45:  # ESC E n
+            self.style = replace(self.style, bold=bool(n & 1))
+        elif command == 0x2D:  # ESC - n
+            self.style = replace(self.style, underline=n in (1, 2, 49, 50))
+        elif command == 0x61:  # ESC a n
+            self.align = n % 48 if n >= 48 else n
+        elif command == 0x33:  # ESC 3 n
+            self.line_spacing = n
+        elif command == 0x64:  # ESC d n
+            if self.line.segments:
+                self.newline()
+            for _ in range(n):
+                self.newline()
+        elif command == 0x4A:  # ESC J n
+            self.feed_dots(n)
+        elif command in (0x47, 0x52, 0x7B, 0x56, 0x20, 0x55, 0x63):
+            # ESC G / R / { / V / SP / U / c: sin efecto en el texto emulado
+            if command == 0x63:  # ESC c x n
+                return 4 if available >= 4 else 0
+        else:
+            self.unknown_commands += 1
+        return 3
+
+    def gs(self, data: bytes, i: int, available: int, replies: bytearray) -> int:
+        if available < 2:
+            return 0
+        command = data[i + 1]
+        if command == 0x56:  # GS V m [n]
+            if available < 3:
+                return 0
+            m = data[i + 2]
+            size = 4 if m in (65, 66, 97, 98, 103, 104) else 3
+            if available < size:
+                return 0
+            if m in (65, 66) and size == 4:
+                self.feed_dots(data[i + 3])
+            self.cut("parcial" if m in (1, 49, 66) else "total")
+            return size
+        if command == 0x76:  # GS v 0 m xL xH yL yH d...
+            if available < 8:
+                return 0
+            width_bytes = data[i + 4] | (data[i + 5] << 8)
+            height = data[i + 6] | (data[i + 7] << 8)
+            size = 8 + width_bytes * height
+            if available < size:
+                return 0
+            if self.line.segments:
+                self.newline()
+            self.current.lines.append(
+                PrintedLine(align=self.align, dots=height, raster=(width_bytes, height, bytes(data[i + 8 : i + size])))
+            )
+            return size
+        if command == 0x28:  # GS ( fn pL pH ...
+            if available < 5:
+                return 0
+            size = 5 + (data[i + 3] | (data[i + 4] << 8))
+            if available < size:
+                return 0
+            if data[i + 2] == 0x6B:  # GS ( k: códigos 2D
+                self.symbol(data[i + 5 : i + size])
+            return size
+        if command == 0x6B:  # GS k m ...: código de barras
+            if available < 3:
+                return 0
+            m = data[i + 2]
+            if m <= 6:
+                end = data.find(b"\x00", i + 3)
+                if end < 0:
+                    return 0
+                content, size = data[i + 3 : end], end + 1 - i
+            else:
+                if available < 4:
+                    return 0
+                size = 4 + data[i + 3]
+                if available < size:
+                    return 0
+                content = data[i + 4 : i + size]
+                if m == 73 and content[:1] == b"{":  # CODE128 con selector de juego de caracteres
+                    content = content[2:]
+            self.print_code("barras", content.decode("ascii", errors="replace"), 162)
+            return size
+        if command == 0x72:  # GS r n: estado del sensor de papel (1) o de la gaveta (2)
+            if available < 3:
+                return 0
+            n = data[i + 2]
+            replies.append((0x0C if self.paper_out() else 0x00) if n in (1, 49) else 0x00)
+            return 3
+        if available < 3:
+            return 0
+        n = data[i + 2]
+        if command == 0x21:  # GS ! n
+            self.style = replace(self.style, width=((n >> 4) & 0x07) + 1, height=(n & 0x07) + 1)
+        elif command == 0x42:  # GS B n
+            self.style = replace(self.style, reverse=bool(n & 1))
+        elif command in (0x4C, 0x57):  # GS L / GS W nL nH
+            return 4 if available >= 4 else 0
+        elif command in (0x48, 0x66, 0x68, 0x77, 0x61):
+            pass  # GS H / f / h / w / a: parámetros de barras y estado automático
+        else:
+            self.unknown_commands += 1
+        return 3
+
+    def symbol(self, body: bytes) -> None:
+        """GS ( k: se guarda el dato (fn 80) y se imprime con fn 81."""
+        if len(body) < 2:
+            return
+        cn, fn = body[0], body[1]
+        kind = {49: "qr", 48: "pdf417", 51: "maxicode"}.get(cn, "2d")
+        if fn == 80:
+            self.pending_code = body[3:].decode("utf-8", errors="replace")
+        elif fn == 81 and self.pending_code is not None:
+            # Alto aproximado: QR de 25 módulos a 6 puntos por módulo
+            self.print_code(kind, self.pending_code, 150)
+
+    # --- Resultado ---
+
+    def add_text(self, text: str) -> None:
+        segments = self.line.segments
+        if segments and segments[-1][1] == self.style:
+            segments[-1] = (segments[-1][0] + text, self.style)
+        else:
+            segments.append((text, self.style))
+
+    def newline(self) -> None:
+        line = self.line
+        line.align = self.align
+        tallest = max((FONT_CELLS[style.font][1] * style.height for _, style in line.segments), default=0)
+        line.dots = max(self.line_spacing, tallest + (self.line_spacing - FONT_CELLS[0][1] if tallest else 0))
+        self.current.lines.append(line)
+        self.line = PrintedLine()
+
+    def feed_dots(self, dots: int) -> None:
+        if self.line.segments:
+            self.newline()
+        self.current.lines.append(PrintedLine(align=self.align, dots=dots))
+
+    def print_code(self, kind: str, content: str, dots: int) -> None:
+        if self.line.segments:
+            self.newline()
+        self.current.codes.append((kind, content))
+        self.current.lines.append(
+            PrintedLine(segments=[(f"[{kind}: {content}]", TextStyle())], align=self.align, dots=dots)
+        )
+
+    def cut(self, kind: str) -> None:
+        if self.line.segments:
+            self.newline()
+        self.current.cut = kind
+        self.receipts.append(self.current)
+        self.current = Receipt(codepage=self.codepage)
+
+
+def render_bytes(data: bytes) -> list[Receipt]:
+    """Interpreta un flujo completo (por ejemplo un .bin de MONTIS_PRINT_TO_DIR) y devuelve los tickets."""
+    emulator = EscPosEmulator()
+    emulator.feed(data)
+    receipts = list(emulator.finish())
+    if emulator.current.lines:
+        receipts.append(emulator.current)
+    return receipts
+
+
+def print_seconds(data: bytes, speed_mm_s: float = DEFAULT_SPEED_MM_S) -> float:
+    """Tiempo físico de impresión de un flujo ESC/POS (papel a speed_mm_s + cortes)."""
+    return sum(receipt.print_seconds(speed_mm_s) for receipt in render_bytes(data))
+
+
+FAULT_FLAGS = ("paperout", "coveropen", "offline")
+# PRINTER_STATUS_* de GetPrinter nivel 2
+PRINTER_STATUS_PAPER_OUT = 0x10
+PRINTER_STATUS_OFFLINE = 0x80
+PRINTER_STATUS_DOOR_OPEN = 0x400000
+JOB_CONTROL_DELETE = 5
+
+
+def safe_name(printer_name: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in printer_name)
+
+
+def set_fault(directory: str, printer_name: str, fault: str) -> None:
+    """fault: "paperout" | "coveropen" | "offline" | "ok" (limpia todas)."""
+    for flag in FAULT_FLAGS:
+        path = os.path.join(directory, f"{safe_name(printer_name)}.{flag}")
+        if flag == fault:
+            open(path, "w").close()
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+class VirtualPrinter:
+    """
+    Una impresora emulada: cola de trabajos, un hilo que los imprime a velocidad física y fallas
+    controladas con archivos <impresora>.paperout / .coveropen / .offline en el directorio.
+    """
+
+    def __init__(self, name: str, directory: str, speed_mm_s: float = DEFAULT_SPEED_MM_S, save_png: bool = True):
+        self.name = name
+        self.directory = directory
+        self.speed_mm_s = speed_mm_s
+        self.save_png = save_png and Image is not None
+        self.emulator = EscPosEmulator(self.paper_out, self.cover_open)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        # [id, bytes, callback de respuestas]
+        self.queue: list[list[Any]] = []
+        self.receipts: list[Receipt] = []
+        self.busy_seconds = 0.0
+        self.printing_id: Optional[int] = None
+        os.makedirs(directory, exist_ok=True)
+        threading.Thread(target=self.run, name=f"escpos-{safe_name(name)}", daemon=True).start()
+
+    def flag_path(self, flag: str) -> str:
+        return os.path.join(self.directory, f"{safe_name(self.name)}.{flag}")
+
+    def paper_out(self) -> bool:
+        return os.path.exists(self.flag_path("paperout"))
+
+    def cover_open(self) -> bool:
+        return os.path.exists(self.flag_path("coveropen"))
+
+    def offline(self) -> bool:
+        return os.path.exists(self.flag_path("offline"))
+
+    def faulted(self) -> bool:
+        return self.paper_out() or self.cover_open()
+
+    def printer_status(self) -> int:
+        """Bits PRINTER_STATUS_* como los reporta GetPrinter."""
+        status = PRINTER_STATUS_OFFLINE if self.offline() else 0
+        if self.paper_out():
+            status |= PRINTER_STATUS_PAPER_OUT
+        if self.cover_open():
+            status |= PRINTER_STATUS_DOOR_OPEN
+        return status
+
+    def set_fault(self, fault: str) -> None:
+        set_fault(self.directory, self.name, fault)
+
+    def submit(self, job_id: int, data: bytes, on_reply: Optional[Callable[[bytes], None]] = None) -> None:
+        with self.lock:
+            self.queue.append([job_id, data, on_reply])
+
+    def jobs(self) -> list[tuple[int, int]]:
+        """(id, JOB_STATUS_*) de los trabajos en cola, como EnumJobs."""
+        fault = 0
+        if self.paper_out():
+            fault = JOB_STATUS_PAPEROUT
+        elif self.cover_open():
+            fault = JOB_STATUS_USER_INTERVENTION
+        with self.lock:
+            return [
+                (job[0], (fault or JOB_STATUS_PRINTING) if index == 0 else 0) for index, job in enumerate(self.queue)
+            ]
+
+    def cancel(self, job_id: int) -> bool:
+        """Borra un trabajo de la cola (SetJob JOB_CONTROL_DELETE); si se estaba imprimiendo no se guarda."""
+        with self.lock:
+            for job in self.queue:
+                if job[0] == job_id:
+                    self.queue.remove(job)
+                    self.idle.notify_all()
+                    return True
+        return False
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.queue, timeout)
+
+    def run(self) -> None:
+        while True:
+            with self.lock:
+                job = self.queue[0] if self.queue else None
+            if job is None or self.faulted():
+                time.sleep(TICK_SECONDS)
+                continue
+            job_id, data, on_reply = job
+            replies = self.emulator.feed(data)
+            if replies and on_reply:
+                try:
+                    on_reply(replies)
+                except OSError:
+                    pass
+            receipts = list(self.emulator.receipts)
+            self.emulator.receipts.clear()
+            # Papel de lo cortado en este trabajo más lo que quedó impreso sin cortar
+            seconds = sum(receipt.print_seconds(self.speed_mm_s) for receipt in receipts)
+            self.sleep_printing(seconds)
+            with self.lock:
+                cancelled = job not in self.queue
+                if not cancelled:
+                    self.receipts.extend(receipts)
+                    del self.receipts[:-RECEIPTS_KEPT]
+                    self.busy_seconds += seconds
+                    self.queue.remove(job)
+                    self.idle.notify_all()
+            if not cancelled:
+                for receipt in receipts:
+                    self.save(receipt)
+
+    def sleep_printing(self, seconds: float) -> None:
+        """Duerme el tiempo de impresión; una falla a mitad de ticket lo detiene hasta resolverse."""
+        while seconds > 0:
+            if self.faulted():
+                time.sleep(TICK_SECONDS)
+                continue
+            step = min(seconds, TICK_SECONDS)
+            time.sleep(step)
+            seconds -= step
+
+    def save(self, receipt: Receipt) -> None:
+        base = os.path.join(self.directory, f"{time.time_ns()}-{safe_name(self.name)}")
+        try:
+            with open(f"{base}.txt", "w", encoding="utf-8") as f:
+                f.write(receipt.text() + "\n")
+            if self.save_png:
+                receipt.to_png(f"{base}.png")
+        except OSError:
+            pass
+
+
+class Win32PrintShim:
+    """
+    Reemplazo de win32print con las llamadas que usa el agente: cada impresora abierta es una
+    VirtualPrinter y EnumJobs devuelve su cola con los mismos JOB_STATUS_* que Windows. Con la falla
+    "offline" OpenPrinter falla y GetPrinter reporta PRINTER_STATUS_OFFLINE.
+    """
+
+    PRINTER_ENUM_LOCAL = 2
+    PRINTER_ENUM_CONNECTIONS = 4
+
+    def __init__(self, directory: str, speed_mm_s: float = DEFAULT_SPEED_MM_S, default_printer: str = DEFAULT_PRINTER_NAME):
+        self.directory = directory
+        self.speed_mm_s = speed_mm_s
+        self.default_printer = default_printer
+        self.printers: Dict[str, VirtualPrinter] = {}
+        self.lock = threading.Lock()
+        self.next_job_id = 1
+        self.next_handle = 1
+        # handle -> [impresora, id del trabajo abierto, bytes]
+        self.handles: Dict[int, list[Any]] = {}
+
+    def printer(self, name: str) -> VirtualPrinter:
+        with self.lock:
+            if name not in self.printers:
+                self.printers[name] = VirtualPrinter(name, self.directory, self.speed_mm_s)
+            return self.printers[name]
+
+    def GetDefaultPrinter(self) -> str:
+        return self.default_printer
+
+    def EnumPrinters(self, flags: int, name: Any = None, level: int = 1) -> list[tuple[int, str, str, str]]:
+        names = sorted({self.default_printer, *self.printers})
+        return [(0, f"{name},Emulador ESC/POS,", name, "") for name in names]
+
+    def OpenPrinter(self, name: str, defaults: Any = None) -> int:
+        if self.printer(name).offline():
+            raise OSError(f"OpenPrinter: la impresora {name} no responde (fuera de línea)")
+        with self.lock:
+            handle = self.next_handle
+            self.next_handle += 1
+            self.handles[handle] = [name, None, bytearray()]
+        return handle
+
+    def ClosePrinter(self, handle: int) -> None:
+        with self.lock:
+            self.handles.pop(handle, None)
+
+    def StartDocPrinter(self, handle: int, level: int, info: Any) -> int:
+        with self.lock:
+            job_id = self.next_job_id
+            self.next_job_id += 1
+            self.handles[handle][1:] = [job_id, bytearray()]
+        return job_id
+
+    def StartPagePrinter(self, handle: int) -> None:
+        pass
+
+    def WritePrinter(self, handle: int, data: bytes) -> int:
+        with self.lock:
+            self.handles[handle][2] += data
+        return len(data)
+
+    def EndPagePrinter(self, handle: int) -> None:
+        pass
+
+    def EndDocPrinter(self, handle: int) -> None:
+        with self.lock:
+            name, job_id, data = self.handles[handle]
+        self.printer(name).submit(job_id, bytes(data))
+
+    def GetPrinter(self, handle: int, level: int = 2) -> Dict[str, Any]:
+        with self.lock:
+            name = self.handles[handle][0]
+        return {"pPrinterName": name, "Status": self.printer(name).printer_status(), "Attributes": 0}
+
+    def SetJob(self, handle: int, job_id: int, level: int, info: Any, command: int) -> None:
+        with self.lock:
+            name = self.handles[handle][0]
+        if command == JOB_CONTROL_DELETE and not self.printer(name).cancel(job_id):
+            raise OSError(f"SetJob: el trabajo {job_id} no está en la cola de {name}")
+
+    def EnumJobs(self, handle: int, first: int, count: int, level: int = 1) -> list[Dict[str, int]]:
+        with self.lock:
+            name = self.handles[handle][0]
+        return [{"JobId": job_id, "Status": status} for job_id, status in self.printer(name).jobs()[first : first + count]]
+
+
+class RawPrintHandler(socketserver.BaseRequestHandler):
+    """Puerto 9100: cada conexión es un trabajo; las consultas DLE EOT se responden al instante."""
+
+    def handle(self) -> None:
+        printer: VirtualPrinter = self.server.printer  # type: ignore[attr-defined]
+        realtime = EscPosEmulator(printer.paper_out, printer.cover_open)
+        data = bytearray()
+        self.request.settimeout(30)
+        while True:
+            try:
+                chunk = self.request.recv(65536)
+            except (socket.timeout, OSError):
+                break
+            if not chunk:
+                break
+            data += chunk
+            # Estado en tiempo real aunque la impresora esté detenida por una falla
+            for index in range(len(chunk) - 2):
+                if chunk[index] == DLE and chunk[index + 1] == 0x04:
+                    self.request.sendall(bytes([realtime.status_byte(chunk[index + 2])]))
+        if data:
+            with self.server.lock:  # type: ignore[attr-defined]
+                self.server.next_job_id += 1  # type: ignore[attr-defined]
+                job_id = self.server.next_job_id  # type: ignore[attr-defined]
+            # Las respuestas en orden (GS r) ya no tienen a quién volver: la conexión terminó
+            printer.submit(job_id, bytes(data))
+
+
+class RawPrintServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], printer: VirtualPrinter):
+        super().__init__(address, RawPrintHandler)
+        self.printer = printer
+        self.lock = threading.Lock()
+        self.next_job_id = 0
+
+
+def install_win32print(directory: str) -> Win32PrintShim:
+    """El módulo win32print emulado que usa printer_agent.py con MONTIS_ESCPOS_EMULATOR."""
+    return Win32PrintShim(directory, default_printer=os.getenv("MONTIS_ESCPOS_PRINTER") or DEFAULT_PRINTER_NAME)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Impresora ESC/POS emulada")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Impresora de red RAW (puerto 9100)")
+    serve.add_argument("directory")
+    serve.add_argument("--port", type=int, default=9100)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--name", default=DEFAULT_PRINTER_NAME)
+    serve.add_argument("--speed", type=float, default=DEFAULT_SPEED_MM_S, help="Velocidad de impresión en mm/s")
+
+    fault = commands.add_parser("fault", help="Simula una falla o la resuelve")
+    fault.add_argument("directory")
+    fault.add_argument("printer")
+    fault.add_argument("fault", choices=[*FAULT_FLAGS, "ok"])
+
+    status = commands.add_parser("status", help="Fallas activas y tickets impresos")
+    status.add_argument("directory")
+
+    render = commands.add_parser("render", help="Interpreta un archivo de bytes ESC/POS")
+    render.add_argument("file")
+    render.add_argument("--png", default=None, help="Guarda el primer ticket como PNG")
+    render.add_argument("--speed", type=float, default=DEFAULT_SPEED_MM_S)
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        printer = VirtualPrinter(args.name, args.directory, args.speed)
+        server = RawPrintServer((args.host, args.port), printer)
+        print(f"{args.name}: escuchando en {args.host}:{args.port} ({args.speed:g} mm/s), tickets en {args.directory}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.command == "fault":
+        os.makedirs(args.directory, exist_ok=True)
+        set_fault(args.directory, args.printer, args.fault)
+        print(f"{args.printer}: {args.fault}")
+        return
+
+    if args.command == "status":
+        files = sorted(os.listdir(args.directory)) if os.path.isdir(args.directory) else []
+        faults = [name for name in files if name.endswith(tuple(f".{flag}" for flag in FAULT_FLAGS))]
+        tickets = [name for name in files if name.endswith(".txt")]
+        print(json.dumps({"fallas": faults, "tickets": len(tickets), "ultimo": tickets[-1] if tickets else None}, indent=2))
+        return
+
+    with open(args.file, "rb") as f:
+        receipts = render_bytes(f.read())
+    for index, receipt in enumerate(receipts, 1):
+        print(f"--- ticket {index}: {receipt.length_mm:.0f} mm, corte {receipt.cut or 'ninguno'}, "
+              f"{receipt.print_seconds(args.speed):.2f} s a {args.speed:g} mm/s")
+        print(receipt.text())
+    if args.png and receipts:
+        receipts[0].to_png(args.png)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+"""
+Backend de pruebas para el agente de impresión (solo desarrollo).
+
+Implementa en memoria los endpoints /api/print/* que usa printer_agent.py, incluida la
+lógica de failover (claimFailoverJobs), para probar varios agentes contra un mismo backend
+sin Postgres ni impresoras reales.
+
+Ejemplo (dos agentes, principal y respaldo):
+
+    python fake_backend.py --port 8900 --agent principal=C:\\tmp\\a1 --agent respaldo=C:\\tmp\\a2
+
+    set APPDATA=C:\\tmp\\a1 & set MONTIS_INSTANCE_PORT=51331 & set MONTIS_LAN_PORT=0
+    set MONTIS_PRINT_TO_DIR=C:\\tmp\\a1\\out & python printer_agent.py --background
+
+    set APPDATA=C:\\tmp\\a2 & set MONTIS_INSTANCE_PORT=51332 & set MONTIS_LAN_PORT=0
+    set MONTIS_PRINT_TO_DIR=C:\\tmp\\a2\\out & set MONTIS_FAILOVER_ROLE=standby
+    python printer_agent.py --background
+
+    curl -X POST http://127.0.0.1:8900/_fake/jobs -d "{\\"count\\": 3}"
+    curl -X POST http://127.0.0.1:8900/_fake/jobs -d "{\\"count\\": 40, \\"ageSeconds\\": 1800}"
+    curl http://127.0.0.1:8900/_fake/jobs
+    curl -X POST http://127.0.0.1:8900/_fake/service -d "{\\"open\\": false}"
+    curl -X POST http://127.0.0.1:8900/_fake/catalog -d "{\\"productos\\": [{\\"id\\": \\"p1\\", \\"nombre\\": \\"Limonada\\"}]}"
+
+Al cerrar el agente principal, el respaldo toma la cola tras --stale segundos sin heartbeat
+(o en cuanto haya jobs pendientes con más de --latency segundos).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import secrets
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+import printer_agent
+
+DEFAULT_LEASE_SECONDS = 60
+FAILOVER_STALE_SECONDS = 90
+FAILOVER_LATENCY_SECONDS = 30
+# Igual que CATALOG_OVERLAP_MS del backend: lo modificado hace menos que esto viaja con nombre
+CATALOG_OVERLAP_SECONDS = 300
+CATALOG_SECTIONS = ("productos", "categorias", "personalizaciones", "usuarios")
+
+
+def iso(ts: Optional[float]) -> Optional[str]:
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+class FakeBackend:
+    def __init__(self, stale_seconds: float = FAILOVER_STALE_SECONDS, latency_seconds: float = FAILOVER_LATENCY_SECONDS):
+        self.lock = threading.Lock()
+        self.printers: Dict[str, Dict[str, Any]] = {}
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.stale_seconds = stale_seconds
+        self.latency_seconds = latency_seconds
+        # Servicio abierto/cerrado (control de acceso) y polls recibidos, para medir la carga
+        self.service_open = True
+        self.claims = 0
+        # Catálogo para el caché del agente: sección -> id -> fila (con updated_at)
+        self.catalog: Dict[str, Dict[str, Dict[str, Any]]] = {section: {} for section in CATALOG_SECTIONS}
+        self.catalog_overlap = CATALOG_OVERLAP_SECONDS
+
+    # --- Administración ---
+
+    def add_printer(self, name: str, is_default: bool = False) -> Dict[str, Any]:
+        printer = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "api_key": secrets.token_hex(16),
+            "meta": {},
+            "is_default": is_default,
+            "last_seen_at": None,
+        }
+        with self.lock:
+            self.printers[printer["id"]] = printer
+        return printer
+
+    def printer_by_key(self, api_key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return next((p for p in self.printers.values() if p["api_key"] == api_key), None)
+
+    def enqueue(
+        self,
+        count: int = 1,
+        printer_id: Optional[str] = None,
+        payload: Optional[Dict[str, Any]] = None,
+        job_type: str = "kitchen_ticket",
+        age_seconds: float = 0.0,
+    ) -> list[str]:
+        with self.lock:
+            if not printer_id:
+                printer_id = next((p["id"] for p in self.printers.values() if p["is_default"]), None)
+            if not printer_id:
+                return []
+            ids = []
+            for _ in range(count):
+                job_id = str(uuid.uuid4())
+                # age_seconds simula jobs que quedaron en cola durante una caída
+                now = time.time() - age_seconds
+                self.jobs[job_id] = {
+                    "id": job_id,
+                    "printer_id": printer_id,
+                    "external_id": f"fake:{job_id[:8]}",
+                    "type": job_type,
+                    "payload": payload if payload is not None else {
+                        "items": [{"nombre": "Producto de prueba", "cantidad": 1}],
+                        "generado_en": iso(now),
+                    },
+                    "status": "pending",
+                    "attempts": 0,
+                    "info": None,
+                    "last_error": None,
+                    "lease_expires_at": None,
+                    "claimed_by_printer_id": None,
+                    "printed_by": None,
+                    "acked_at": None,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                ids.append(job_id)
+            return ids
+
+    def set_catalog(self, data: Dict[str, Any]) -> int:
+        """Alta o cambio de entradas del catálogo ({"productos": [{"id", "nombre", "categoria_id"}], ...})."""
+        changed = 0
+        with self.lock:
+            now = time.time()
+            for section in CATALOG_SECTIONS:
+                for row in data.get(section) or []:
+                    if isinstance(row, dict) and row.get("id"):
+                        self.catalog[section][str(row["id"])] = {**row, "updated_at": now}
+                        changed += 1
+        return changed
+
+    # --- API del agente ---
+
+    def catalog_since(self, since: Optional[float]) -> Dict[str, Any]:
+        with self.lock:
+            start = since - self.catalog_overlap if since is not None else None
+            version = since or 0.0
+            body: Dict[str, Any] = {"success": True, "full": since is None}
+            for section in CATALOG_SECTIONS:
+                rows = [row for row in self.catalog[section].values() if start is None or row["updated_at"] > start]
+                version = max([version, *(row["updated_at"] for row in rows)])
+                body[section] = [{k: v for k, v in row.items() if k != "updated_at"} for row in rows]
+            body["version"] = iso(version) if version else None
+            return body
+
+    def compact(self, jobs: list[Dict[str, Any]], version: float) -> list[Dict[str, Any]]:
+        """Misma regla que compactJobPayloads: solo se quitan nombres que el agente ya tiene."""
+        cutoff = version - self.catalog_overlap
+
+        def known(section: str, entry_id: Any) -> bool:
+            row = self.catalog[section].get(str(entry_id or ""))
+            return row is not None and row["updated_at"] <= cutoff
+
+        def compact_item(item: Any) -> Any:
+            if not isinstance(item, dict):
+                return item
+            rest = dict(item)
+            ids = rest.pop("personalizacion_ids", None) or []
+            producto = self.catalog["productos"].get(str(item.get("producto_id") or ""))
+            if not known("productos", item.get("producto_id")) or (
+                producto.get("categoria_id") and not known("categorias", producto["categoria_id"])
+            ):
+                return rest
+            rest.pop("nombre", None)
+            rest.pop("categoria", None)
+            if len(ids) == len(item.get("personalizaciones") or []) and all(known("personalizaciones", i) for i in ids):
+                rest.pop("personalizaciones", None)
+                rest["personalizacion_ids"] = ids
+            return rest
+
+        compacted = []
+        with self.lock:
+            for job in jobs:
+                payload = job.get("payload")
+                if job.get("type") != "kitchen_ticket" or not isinstance(payload, dict) or not isinstance(payload.get("items"), list):
+                    compacted.append(job)
+                    continue
+                payload = {**payload, "catalogo": iso(version)}
+                payload["items"] = [compact_item(item) for item in payload["items"]]
+                if isinstance(payload.get("snapshot_items"), list):
+                    payload["snapshot_items"] = [compact_item(item) for item in payload["snapshot_items"]]
+                usuario = payload.get("usuario")
+                if isinstance(usuario, dict) and known("usuarios", usuario.get("id")):
+                    payload["usuario"] = {"id": usuario["id"]}
+                compacted.append({**job, "payload": payload})
+        return compacted
+
+    def _claimable(self, job: Dict[str, Any], now: float) -> bool:
+        if job["status"] == "pending":
+            return True
+        if job["status"] != "processing":
+            return False
+        expires = job["lease_expires_at"] or job["updated_at"] + 600
+        return expires < now
+
+    def _claim(self, candidates: list[str], limit: int, lease: float, claimed_by: Optional[str]) -> list[Dict[str, Any]]:
+        now = time.time()
+        jobs = sorted(
+            (j for j in self.jobs.values() if j["printer_id"] in candidates and self._claimable(j, now)),
+            key=lambda j: j["created_at"],
+        )[:max(limit, 0)]
+        for job in jobs:
+            job.update(
+                status="processing",
+                attempts=job["attempts"] + 1,
+                lease_expires_at=now + lease,
+                claimed_by_printer_id=claimed_by,
+                updated_at=now,
+            )
+        return [self.public_job(job) for job in jobs]
+
+    def claim(self, printer: Dict[str, Any], limit: int, lease: float, failover: bool) -> Dict[str, Any]:
+        with self.lock:
+            self.claims += 1
+            jobs = self._claim([printer["id"]], limit, lease, None)
+            if not failover:
+                return {"success": True, "jobs": jobs, "server_time": iso(time.time()), "service_open": self.service_open}
+
+            now = time.time()
+            covering = []
+            for other in self.printers.values():
+                if other["id"] == printer["id"] or other["meta"].get("failover_role") == "standby":
+                    continue
+                stale = (
+                    other["last_seen_at"] is None
+                    or other["last_seen_at"] < now - self.stale_seconds
+                    or other["meta"].get("circuit_open") is True
+                )
+                late = any(
+                    j["printer_id"] == other["id"] and j["status"] == "pending" and j["created_at"] < now - self.latency_seconds
+                    for j in self.jobs.values()
+                )
+                if stale or late:
+                    covering.append(other["id"])
+            if covering and len(jobs) < limit:
+                jobs += self._claim(covering, limit - len(jobs), lease, printer["id"])
+            return {
+                "success": True,
+                "jobs": jobs,
+                "failover": {"covering": covering},
+                "server_time": iso(time.time()),
+                "service_open": self.service_open,
+            }
+
+    def _owned(self, job_id: str, printer: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        if not job or (job["claimed_by_printer_id"] or job["printer_id"]) != printer["id"]:
+            return None
+        return job
+
+    def ack(self, printer: Dict[str, Any], job_id: str, body: Dict[str, Any]) -> bool:
+        with self.lock:
+            job = self._owned(job_id, printer)
+            if not job:
+                return False
+            status = body.get("status")
+            job.update(
+                status=status,
+                info=body.get("info"),
+                last_error=None if status == "done" else body.get("reason") or status,
+                lease_expires_at=None,
+                printed_by=printer["name"] if status == "done" else None,
+                acked_at=time.time(),
+                updated_at=time.time(),
+            )
+            return True
+
+    def renew(self, printer: Dict[str, Any], job_ids: list[str], lease: float) -> list[str]:
+        with self.lock:
+            renewed = []
+            for job_id in job_ids:
+                job = self._owned(str(job_id), printer)
+                if job and job["status"] == "processing":
+                    job["lease_expires_at"] = time.time() + lease
+                    renewed.append(job["id"])
+            return renewed
+
+    def release(self, printer: Dict[str, Any], job_id: str, reason: Optional[str]) -> bool:
+        with self.lock:
+            job = self._owned(job_id, printer)
+            if not job or job["status"] != "processing":
+                return False
+            job.update(status="pending", lease_expires_at=None, claimed_by_printer_id=None, info=reason)
+            return True
+
+    def list_jobs(self, printer: Dict[str, Any], status: str, limit: int) -> list[Dict[str, Any]]:
+        with self.lock:
+            jobs = [
+                j for j in self.jobs.values()
+                if (j["claimed_by_printer_id"] or j["printer_id"]) == printer["id"] and j["status"] == status
+            ]
+            jobs.sort(key=lambda j: j["created_at"], reverse=True)
+            return [self.public_job(j) for j in jobs[:limit]]
+
+    def heartbeat(self, printer: Dict[str, Any], body: Dict[str, Any]) -> None:
+        with self.lock:
+            meta = body.get("meta") if isinstance(body.get("meta"), dict) else {}
+            printer["meta"].update(meta, status=body.get("status") or "ready", uptime=body.get("uptime"))
+            printer["last_seen_at"] = time.time()
+
+    @staticmethod
+    def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+        data = dict(job)
+        for key in ("lease_expires_at", "acked_at", "created_at", "updated_at"):
+            data[key] = iso(job[key])
+        return data
+
+
+class FakeBackendHandler(BaseHTTPRequestHandler):
+    server_version = "MontisFakeBackend/1.0"
+
+    @property
+    def backend(self) -> FakeBackend:
+        return self.server.backend  # type: ignore[attr-defined]
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: Any) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length).decode("utf-8"))
+        except Exception:
+            return {}
+        return body if isinstance(body, dict) else {}
+
+    def _printer(self) -> Optional[Dict[str, Any]]:
+        printer = self.backend.printer_by_key(self.headers.get("x-api-key") or "")
+        if not printer:
+            self._send(401, {"success": False, "error": "API key inválida"})
+        return printer
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path == "/_fake/jobs":
+            with self.backend.lock:
+                jobs = [self.backend.public_job(j) for j in self.backend.jobs.values()]
+                printers = list(self.backend.printers.values())
+                claims = self.backend.claims
+            self._send(200, {"jobs": jobs, "printers": printers, "claims": claims})
+            return
+
+        if url.path == "/api/print/jobs":
+            printer = self._printer()
+            if not printer:
+                return
+            limit = min(int(query.get("limit") or 10), 50)
+            status = query.get("status") or "pending"
+            if status == "pending":
+                lease = min(max(int(query.get("leaseSeconds") or DEFAULT_LEASE_SECONDS), 15), 600)
+                claimed = self.backend.claim(printer, limit, lease, query.get("failover") == "1")
+                version = printer_agent.parse_timestamp(query.get("catalogVersion"))
+                if version is not None and claimed["jobs"]:
+                    claimed["jobs"] = self.backend.compact(claimed["jobs"], version)
+                self._send(200, claimed)
+            else:
+                self._send(200, {"success": True, "jobs": self.backend.list_jobs(printer, status, limit)})
+            return
+
+        if url.path == "/api/print/catalog":
+            printer = self._printer()
+            if not printer:
+                return
+            self._send(200, self.backend.catalog_since(printer_agent.parse_timestamp(query.get("since"))))
+            return
+
+        self._send(404, {"success": False, "error": "No encontrado"})
+
+    def do_POST(self) -> None:
+        path = urlparse(self.path).path
+        body = self._body()
+        parts = path.strip("/").split("/")
+
+        if path == "/_fake/jobs":
+            ids = self.backend.enqueue(
+                int(body.get("count") or 1),
+                body.get("printerId"),
+                body.get("payload") if isinstance(body.get("payload"), dict) else None,
+                str(body.get("type") or "kitchen_ticket"),
+                float(body.get("ageSeconds") or 0),
+            )
+            self._send(200, {"success": True, "jobIds": ids})
+            return
+        if path == "/_fake/catalog":
+            self._send(200, {"success": True, "changed": self.backend.set_catalog(body)})
+            return
+        if path == "/_fake/service":
+            self.backend.service_open = bool(body.get("open", True))
+            self._send(200, {"success": True, "service_open": self.backend.service_open})
+            return
+
+        printer = self._printer()
+        if not printer:
+            return
+
+        if path == "/api/print/jobs/lease":
+            lease = min(max(int(body.get("leaseSeconds") or DEFAULT_LEASE_SECONDS), 15), 600)
+            self._send(200, {"success": True, "renewed": self.backend.renew(printer, body.get("jobIds") or [], lease)})
+        elif len(parts) == 5 and parts[:3] == ["api", "print", "jobs"] and parts[4] == "ack":
+            ok = self.backend.ack(printer, parts[3], body)
+            self._send(200 if ok else 404, {"success": ok})
+        elif len(parts) == 5 and parts[:3] == ["api", "print", "jobs"] and parts[4] == "release":
+            ok = self.backend.release(printer, parts[3], body.get("reason"))
+            self._send(200 if ok else 404, {"success": ok})
+        elif len(parts) == 5 and parts[:3] == ["api", "print", "printers"] and parts[4] == "heartbeat":
+            self.backend.heartbeat(printer, body)
+            self._send(200, {"success": True})
+        else:
+            self._send(404, {"success": False, "error": "No encontrado"})
+
+
+def write_agent_state(app_data: str, api_base: str, printer: Dict[str, Any]) -> str:
+    """Deja el estado de activación del agente en <app_data>/MontisPrinterAgent (sin emparejar)."""
+    state = printer_agent.AgentState(
+        api_base=api_base,
+        printer_id=printer["id"],
+        api_key=printer["api_key"],
+        fingerprint=f"fake-{printer['name']}",
+        printer_name=f"FAKE-{printer['name']}",
+    )
+    app_dir = os.path.join(app_data, "MontisPrinterAgent")
+    os.makedirs(app_dir, exist_ok=True)
+    path = os.path.join(app_dir, "agent_state.dat")
+    payload = json.dumps(state.__dict__, ensure_ascii=False).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(printer_agent.protect_bytes(payload))
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backend de pruebas para el agente de impresión")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument(
+        "--agent",
+        action="append",
+        default=[],
+        metavar="NOMBRE=APPDATA",
+        help="Crea una impresora y escribe el estado del agente en APPDATA (la primera es la principal)",
+    )
+    parser.add_argument("--stale", type=float, default=FAILOVER_STALE_SECONDS, help="Segundos sin heartbeat para cubrir")
+    parser.add_argument("--latency", type=float, default=FAILOVER_LATENCY_SECONDS, help="Antigüedad máxima de un pendiente")
+    args = parser.parse_args()
+
+    backend = FakeBackend(stale_seconds=args.stale, latency_seconds=args.latency)
+    api_base = f"http://127.0.0.1:{args.port}"
+    for index, spec in enumerate(args.agent):
+        name, _, app_data = spec.partition("=")
+        printer = backend.add_printer(name, is_default=index == 0)
+        if app_data:
+            path = write_agent_state(app_data, api_base, printer)
+            print(f"Impresora {name} ({printer['id']}) -> {path}")
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeBackendHandler)
+    server.backend = backend  # type: ignore[attr-defined]
+    print(f"Backend de pruebas escuchando en {api_base}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
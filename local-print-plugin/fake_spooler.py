@@ -0,0 +1,180 @@
+"""
+Spooler de Windows simulado para probar el agente en Linux (solo desarrollo).
+
+Con MONTIS_FAKE_SPOOLER=<directorio> el agente envía cada impresión a esta cola en lugar de
+win32print y la consulta igual que con EnumJobs: (id de trabajo, estado JOB_STATUS_*). Cada
+impresora imprime un trabajo cada MONTIS_FAKE_SPOOLER_SECONDS (0.5 por defecto); un trabajo
+impreso sale de la cola y, si MONTIS_PRINT_TO_DIR está definido, se escribe ahí como .bin.
+
+Control desde otra consola (mismo directorio):
+
+    python fake_spooler.py C:\\tmp\\spool pause "EPSON TM-T20"     # impresora en pausa / sin papel
+    python fake_spooler.py C:\\tmp\\spool resume "EPSON TM-T20"
+    python fake_spooler.py C:\\tmp\\spool cancel "EPSON TM-T20"    # borra el primer trabajo en cola
+    python fake_spooler.py C:\\tmp\\spool status
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+# Subconjunto de JOB_STATUS_* (winspool.h) que usa el agente
+JOB_STATUS_PAUSED = 0x1
+JOB_STATUS_DELETING = 0x4
+JOB_STATUS_PRINTING = 0x10
+JOB_STATUS_PAPEROUT = 0x40
+
+TICK_SECONDS = 0.05
+# Un trabajo cancelado sigue visible como DELETING un momento, como en Windows
+DELETE_SECONDS = 1.5
+
+
+def safe_name(printer_name: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in printer_name)
+
+
+class FakeSpooler:
+    def __init__(self, directory: str, seconds_per_job: Optional[float] = None, output_dir: Optional[str] = None):
+        self.directory = directory
+        self.seconds_per_job = (
+            seconds_per_job
+            if seconds_per_job is not None
+            else float(os.getenv("MONTIS_FAKE_SPOOLER_SECONDS", "0.5") or 0.5)
+        )
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        # impresora -> [[job_id, estado, bytes, inicio de impresión]]
+        self.queues: dict[str, list[list]] = {}
+        self.next_id = 1
+        self.printed = 0
+        os.makedirs(directory, exist_ok=True)
+        threading.Thread(target=self.run, name="fake-spooler", daemon=True).start()
+
+    def flag_path(self, printer_name: str, flag: str) -> str:
+        return os.path.join(self.directory, f"{safe_name(printer_name)}.{flag}")
+
+    def paused(self, printer_name: str) -> bool:
+        return os.path.exists(self.flag_path(printer_name, "paused"))
+
+    def pause(self, printer_name: str) -> None:
+        open(self.flag_path(printer_name, "paused"), "w").close()
+
+    def resume(self, printer_name: str) -> None:
+        try:
+            os.remove(self.flag_path(printer_name, "paused"))
+        except OSError:
+            pass
+
+    def submit(self, printer_name: str, data: bytes) -> int:
+        with self.lock:
+            job_id = self.next_id
+            self.next_id += 1
+            self.queues.setdefault(printer_name, []).append([job_id, 0, data, None])
+        self.dump()
+        return job_id
+
+    def enum_jobs(self, printer_name: str) -> list[tuple[int, int]]:
+        with self.lock:
+            return [(job[0], job[1]) for job in self.queues.get(printer_name, [])]
+
+    def cancel(self, printer_name: str, job_id: Optional[int] = None) -> bool:
+        with self.lock:
+            for job in self.queues.get(printer_name, []):
+                if job_id is None or job[0] == job_id:
+                    if not job[1] & JOB_STATUS_DELETING:
+                        job[1] |= JOB_STATUS_DELETING
+                        job[3] = time.monotonic()
+                    return True
+        return False
+
+    def run(self) -> None:
+        while True:
+            time.sleep(TICK_SECONDS)
+            changed = False
+            for printer_name in list(self.queues):
+                cancel_flag = self.flag_path(printer_name, "cancel")
+                if os.path.exists(cancel_flag):
+                    os.remove(cancel_flag)
+                    self.cancel(printer_name)
+                paused = self.paused(printer_name)
+                with self.lock:
+                    queue = self.queues[printer_name]
+                    if not queue:
+                        continue
+                    job = queue[0]
+                    if job[1] & JOB_STATUS_DELETING:
+                        if time.monotonic() - job[3] >= DELETE_SECONDS:
+                            queue.pop(0)
+                            changed = True
+                        continue
+                    if paused:
+                        # Como una impresora sin papel: el trabajo activo queda trabado
+                        if job[1] != JOB_STATUS_PAPEROUT:
+                            job[1] = JOB_STATUS_PAPEROUT
+                            job[3] = None
+                            changed = True
+                        continue
+                    if job[3] is None:
+                        job[1] = JOB_STATUS_PRINTING
+                        job[3] = time.monotonic()
+                        changed = True
+                        continue
+                    if time.monotonic() - job[3] < self.seconds_per_job:
+                        continue
+                    queue.pop(0)
+                    self.printed += 1
+                    changed = True
+                if self.output_dir:
+                    os.makedirs(self.output_dir, exist_ok=True)
+                    with open(os.path.join(self.output_dir, f"{time.time_ns()}-{safe_name(printer_name)}.bin"), "wb") as f:
+                        f.write(job[2])
+            if changed:
+                self.dump()
+
+    def dump(self) -> None:
+        with self.lock:
+            state = {name: [[job[0], job[1]] for job in queue] for name, queue in self.queues.items()}
+        try:
+            with open(os.path.join(self.directory, "queue.json"), "w", encoding="utf-8") as f:
+                json.dump(state, f)
+        except OSError:
+            pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Control del spooler simulado del agente")
+    parser.add_argument("directory", help="Directorio de MONTIS_FAKE_SPOOLER")
+    parser.add_argument("command", choices=["pause", "resume", "cancel", "status"])
+    parser.add_argument("printer", nargs="?", default="")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        try:
+            with open(os.path.join(args.directory, "queue.json"), "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except OSError:
+            state = {}
+        for name, jobs in state.items():
+            paused = os.path.exists(os.path.join(args.directory, f"{safe_name(name)}.paused"))
+            print(f"{name}: {len(jobs)} en cola{' (pausada)' if paused else ''} {jobs}")
+        return
+
+    if not args.printer:
+        parser.error("falta el nombre de la impresora")
+    flag = {"pause": "paused", "cancel": "cancel"}.get(args.command)
+    path = os.path.join(args.directory, f"{safe_name(args.printer)}.{flag or 'paused'}")
+    if args.command == "resume":
+        if os.path.exists(path):
+            os.remove(path)
+    else:
+        open(path, "w").close()
+    print(f"{args.printer}: {args.command}")
+
+
+if __name__ == "__main__":
+    main()
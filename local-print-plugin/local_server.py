@@ -0,0 +1,206 @@
+"""
+Endpoint HTTP del agente en la red local: el frontend entrega por LAN jobs firmados por el backend
+(POST /jobs) para imprimirlos sin esperar el poll a la nube, y desde el propio PC se consultan el
+perfilado y el historial de tickets (/profile, /historial, /reimprimir).
+
+Lo usa printer_agent.py (MONTIS_LAN_PORT).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Dict, Optional
+from urllib.parse import parse_qs
+
+from ticket_history import TICKET_HISTORY_LIMIT, parse_history_time
+
+if TYPE_CHECKING:
+    from printer_agent import Agent
+
+LAN_MAX_BODY = 256 * 1024
+# Header obligatorio en /profile, /historial y /reimprimir (solo clientes locales que no son navegador)
+LOCAL_HEADER = "X-Montis-Agent"
+
+
+def canonical_payload_hash(payload: Any) -> str:
+    """SHA-256 del JSON canónico del payload (claves ordenadas, sin espacios), como canonicalJson del backend."""
+    text = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def verify_local_token(api_key: str, external_id: str, exp: Any, token: str, job_type: str, payload: Any) -> bool:
+    """
+    Valida el token de un job entregado por LAN. El backend firma
+    HMAC-SHA256(sha256(apiKey), "<externalId>.<exp>.<type>.<sha256 del payload canónico>") con exp
+    en segundos epoch: el token solo sirve para ese contenido.
+    """
+    try:
+        exp_value = int(exp)
+    except (TypeError, ValueError):
+        return False
+    if exp_value < int(time.time()):
+        return False
+    key = hashlib.sha256(api_key.encode("utf-8")).hexdigest().encode("utf-8")
+    message = f"{external_id}.{exp_value}.{job_type}.{canonical_payload_hash(payload)}"
+    expected = hmac.new(key, message.encode("utf-8"), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, str(token or ""))
+
+
+class LocalJobHandler(BaseHTTPRequestHandler):
+    """
+    Endpoint LAN del agente: el frontend entrega jobs firmados por el backend
+    (POST /jobs) para imprimirlos sin esperar el poll a la nube. /profile, /historial
+    y /reimprimir solo responden desde el propio PC, sin CORS, a clientes que no son un navegador:
+    exigen el header LOCAL_HEADER y rechazan cualquier Origin (una página abierta en el POS no
+    puede leerlos ni dispararlos).
+    """
+
+    server_version = "MontisPrinterAgent"
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+    def _send_json(self, code: int, body: Dict[str, Any], cors: bool = True) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        if cors:
+            self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_OPTIONS(self) -> None:
+        # Preflight solo para /jobs (el frontend); las rutas locales no aceptan navegadores
+        if self.path.split("?")[0] != "/jobs":
+            self._send_json(403, {"success": False, "error": "Solo disponible desde este equipo"}, cors=False)
+            return
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        # Chrome Private Network Access (página pública -> IP privada)
+        self.send_header("Access-Control-Allow-Private-Network", "true")
+        self.send_header("Access-Control-Max-Age", "600")
+        self.end_headers()
+
+    def _is_loopback(self) -> bool:
+        return self.client_address[0] in ("127.0.0.1", "::1", "::ffff:127.0.0.1")
+
+    def _local_only(self) -> bool:
+        """
+        Rutas de administración: desde el propio PC, con LOCAL_HEADER y sin Origin. Un navegador
+        no puede enviar el header sin preflight (que se rechaza) y siempre manda Origin en un POST.
+        Responde el error y devuelve False si la petición no cumple.
+        """
+        if (
+            not self._is_loopback()
+            or self.headers.get("Origin") is not None
+            or self.headers.get(LOCAL_HEADER) != "1"
+        ):
+            self._send_json(403, {"success": False, "error": "Solo disponible desde este equipo"}, cors=False)
+            return False
+        return True
+
+    def _read_json(self, cors: bool) -> Optional[Dict[str, Any]]:
+        """Cuerpo JSON de la petición; None (con la respuesta de error ya enviada) si no es válido."""
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            self._send_json(415, {"success": False, "error": "Se espera Content-Type application/json"}, cors=cors)
+            return None
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = 0
+        if length <= 0 or length > LAN_MAX_BODY:
+            self._send_json(413 if length > LAN_MAX_BODY else 400, {"success": False, "error": "Cuerpo inválido"}, cors=cors)
+            return None
+        try:
+            body = json.loads(self.rfile.read(length).decode("utf-8"))
+        except Exception:
+            body = None
+        if not isinstance(body, dict):
+            self._send_json(400, {"success": False, "error": "JSON inválido"}, cors=cors)
+            return None
+        return body
+
+    def _profile_status(self, agent: Agent) -> Dict[str, Any]:
+        profile_dir = self.server.profile_dir  # type: ignore[attr-defined]
+        return {"success": True, "activo": agent.profiler.active, "directorio": profile_dir}
+
+    def do_GET(self) -> None:
+        agent: Agent = self.server.agent  # type: ignore[attr-defined]
+        path = self.path.split("?")[0]
+        if path == "/status":
+            self._send_json(200, {"success": True, "servicio": self.server.service_name})  # type: ignore[attr-defined]
+            return
+        if path in ("/profile", "/historial") and not self._local_only():
+            return
+        if path == "/profile":
+            self._send_json(200, self._profile_status(agent), cors=False)
+            return
+        if path == "/historial":
+            if agent.tickets is None:
+                self._send_json(404, {"success": False, "error": "Historial de tickets desactivado"}, cors=False)
+                return
+            query = {key: values[-1] for key, values in parse_qs(self.path.partition("?")[2]).items()}
+            try:
+                tickets = agent.tickets.search(
+                    mesa=query.get("mesa", ""),
+                    external_id=query.get("external_id", ""),
+                    usuario=query.get("usuario", ""),
+                    desde=parse_history_time(query.get("desde")),
+                    hasta=parse_history_time(query.get("hasta")),
+                    limit=int(query.get("limite") or TICKET_HISTORY_LIMIT),
+                )
+            except ValueError as error:
+                self._send_json(400, {"success": False, "error": str(error)}, cors=False)
+                return
+            self._send_json(200, {"success": True, "tickets": tickets}, cors=False)
+            return
+        self._send_json(404, {"success": False, "error": "Ruta no encontrada"})
+
+    def do_POST(self) -> None:
+        agent: Agent = self.server.agent  # type: ignore[attr-defined]
+        path = self.path.split("?")[0]
+        if path in ("/profile", "/reimprimir") and not self._local_only():
+            return
+        if path == "/profile":
+            query = self.path.partition("?")[2]
+            if "activo=1" in query:
+                agent.profiler.start()
+            elif "activo=0" in query:
+                agent.profiler.stop()
+            else:
+                agent.profiler.toggle()
+            self._send_json(200, self._profile_status(agent), cors=False)
+            return
+        if path not in ("/jobs", "/reimprimir"):
+            self._send_json(404, {"success": False, "error": "Ruta no encontrada"})
+            return
+
+        cors = path == "/jobs"
+        body = self._read_json(cors)
+        if body is None:
+            return
+        if path == "/reimprimir":
+            code, response = agent.reprint_tickets(body)
+        else:
+            code, response = agent.print_local_job(body)
+        self._send_json(code, response, cors=cors)
+
+
+def start_local_server(agent: Agent, port: int, service_name: str, profile_dir: str) -> ThreadingHTTPServer:
+    """Atiende LocalJobHandler en 0.0.0.0:port en un hilo propio. OSError si el puerto no se puede abrir."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), LocalJobHandler)
+    server.daemon_threads = True
+    server.agent = agent  # type: ignore[attr-defined]
+    server.service_name = service_name  # type: ignore[attr-defined]
+    server.profile_dir = profile_dir  # type: ignore[attr-defined]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,34 +1,85 @@
 from __future__ import annotations
 
+import time
+
+# Referencia para --startup-profile: medir el costo de los imports del módulo.
+_IMPORT_STARTED = time.perf_counter()
+
 import base64
 import hashlib
 import json
 import logging
 import os
+import random
 import socket
 import subprocess
 import sys
 import threading
-import time
-from dataclasses import dataclass
-from datetime import datetime
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
 from logging.handlers import RotatingFileHandler
-from typing import Any, Dict, Optional
-
-import requests
+from typing import TYPE_CHECKING, Any, Dict, Optional
 
+# requests, certifi y tkinter se cargan bajo demanda (ver load_requests y
+# load_tk_modules) para que el arranque en segundo plano llegue rápido al
+# primer poll. win32crypt/win32print son DLL livianas y se usan desde el inicio
+# (win32print, o su emulación, viene de spooler.py).
 try:
-    import win32api  # type: ignore
-    import win32con  # type: ignore
     import win32crypt  # type: ignore
-    import win32print  # type: ignore
-    import winreg  # type: ignore
 except Exception:
-    win32api = None
-    win32con = None
     win32crypt = None
-    win32print = None
+
+try:
     import winreg  # type: ignore
+except ImportError:
+    winreg = None  # type: ignore[assignment]
+
+# Render compartido con server.py (mismo payload -> mismos bytes ESC/POS)
+from ticket_render import (
+    DOCUMENT_TYPES,
+    PROFILES_BY_NAME,
+    DocumentPayload,
+    JobDecodeError,
+    PrinterProfile,
+    RenderCache,
+    TicketFormat,
+    TicketPayload,
+    clamp_copies,
+    decode_document,
+    decode_ticket,
+    format_stale_summary,
+    json_loads,
+    match_profile,
+    render_document,
+    render_ticket,
+)
+from local_server import start_local_server, verify_local_token
+from spooler import (
+    PRINT_TO_DIR,
+    SPOOL_MAX_DEPTH,
+    PrinterBreaker,
+    SpoolerTimeoutError,
+    SpoolTracker,
+    hung_spooler_calls,
+    spool_queue,
+    win32print,
+)
+from station_routing import PrinterPool, StationRouter
+from ticket_history import (
+    TICKET_HISTORY_LIMIT,
+    TICKET_HISTORY_MAX_MB,
+    ComandaHistory,
+    PrintedJournal,
+    TicketHistory,
+    diff_items,
+    parse_history_time,
+)
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+_IMPORT_FINISHED = time.perf_counter()
 
 APP_NAME = "Montis Printer Agent"
 APP_DIR = os.path.join(os.getenv("APPDATA") or os.getcwd(), "MontisPrinterAgent")
@@ -36,8 +87,68 @@ STATE_PATH = os.path.join(APP_DIR, "agent_state.dat")
 LOG_PATH = os.path.join(APP_DIR, "agent.log")
 DEFAULT_API_BASE = os.getenv("MONTIS_API_BASE", "https://montis-cloud-backend.onrender.com").rstrip("/")
 POLL_SECONDS = 3
+# Poll adaptativo: rápido con pedidos recientes, más espaciado sin tráfico y con el servicio cerrado
+# (service_open del backend). Cada espera lleva ±POLL_JITTER para que los agentes no se sincronicen.
+POLL_BUSY_SECONDS = 1.0
+POLL_BUSY_WINDOW_SECONDS = 120
+POLL_IDLE_SECONDS = float(os.getenv("MONTIS_POLL_IDLE", "10") or 10)
+POLL_IDLE_AFTER_SECONDS = 600
+POLL_CLOSED_SECONDS = float(os.getenv("MONTIS_POLL_CLOSED", "120") or 120)
+POLL_JITTER = 0.2
+# Reintentos ante errores con decorrelated jitter: al azar entre BACKOFF_BASE y 3x la espera anterior
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
 JOB_LIMIT = 5
-SINGLE_INSTANCE_PORT = 51321
+SINGLE_INSTANCE_PORT = int(os.getenv("MONTIS_INSTANCE_PORT", "51321") or 51321)
+STARTUP_PROFILE_PATH = os.path.join(APP_DIR, "startup_profile.json")
+# Entrega directa por LAN desde el frontend; escucha en todas las interfaces, así que se activa
+# solo con MONTIS_LAN_PORT (p. ej. 8002). Vacío o 0 = desactivada.
+LAN_PORT = int(os.getenv("MONTIS_LAN_PORT", "") or 0)
+RECENT_EXTERNAL_IDS = 1000
+# Lease (visibility timeout) de jobs reclamados; se renueva mientras están en proceso.
+LEASE_SECONDS = 60
+RECOVER_LIMIT = 20
+PRINTED_JOURNAL_PATH = os.path.join(APP_DIR, "printed_jobs.log")
+# Ventana de agrupación (ms) para ráfagas de jobs. 0 = desactivada.
+COALESCE_MS = int(os.getenv("MONTIS_COALESCE_MS", "0") or 0)
+COALESCE_MAX_JOBS = 20
+COALESCE_MAX_BYTES = 64 * 1024
+
+# Modo drenado tras una caída: se activa con un job más viejo que DRAIN_BACKLOG_SECONDS; pide lotes grandes, colapsa versiones de una misma comanda,
+# imprime primero lo más nuevo y no imprime uno por uno lo vencido (DRAIN_TTL_SECONDS).
+DRAIN_JOB_LIMIT = 50
+DRAIN_BACKLOG_SECONDS = 60
+DRAIN_TTL_SECONDS = int(float(os.getenv("MONTIS_DRAIN_TTL_MIN", "15") or 0) * 60)
+# "resumen": un ticket con todos los vencidos; "expirar": solo ack expired sin imprimir
+DRAIN_STALE_MODE = (os.getenv("MONTIS_DRAIN_STALE") or "resumen").strip().lower()
+
+# "standby": el agente solo reclama jobs de la impresora principal cuando esta no reporta
+# heartbeat o su cola está atrasada (ver claimFailoverJobs en el backend).
+FAILOVER_ROLE = (os.getenv("MONTIS_FAILOVER_ROLE") or "").strip().lower()
+
+ROUTING_PATH = os.path.join(APP_DIR, "routing.json")
+COMANDA_HISTORY_PATH = os.path.join(APP_DIR, "printed_comandas.db")
+# Historial local de tickets impresos para reimprimir sin la nube (ticket_history.py)
+TICKET_HISTORY_PATH = os.path.join(APP_DIR, "ticket_history.db")
+# Catálogo local de la empresa (productos, categorías, personalizaciones y usuarios por id): con él el
+# backend entrega los jobs sin repetir nombres y el agente los completa al decodificar. 0 = desactivado.
+CATALOG_PATH = os.path.join(APP_DIR, "catalog.json")
+CATALOG_ENABLED = os.getenv("MONTIS_CATALOG", "1") != "0"
+CATALOG_SYNC_SECONDS = 300
+
+# Captura de tráfico real para replay_capture.py: "1" usa APP_DIR/captures, o una ruta .jsonl.gz.
+CAPTURE_PATH = os.getenv("MONTIS_CAPTURE") or ""
+CAPTURE_ANONYMIZE = os.getenv("MONTIS_CAPTURE_ANONYMIZE", "1") != "0"
+
+# Perfilado en caliente (--profile, POST /profile desde el propio PC o SIGUSR2/SIGBREAK).
+PROFILE_DIR = os.path.join(APP_DIR, "profiles")
+PROFILE_INTERVAL_SECONDS = float(os.getenv("MONTIS_PROFILE_INTERVAL", "300") or 300)
+PROFILE_SAMPLE_HZ = 50
+PROFILE_TRACE_FRAMES = 8
+PROFILE_KEEP = 24
+# Muestras consecutivas en aumento para reportar una posible fuga
+PROFILE_LEAK_WINDOW = 4
+
 
 
 @dataclass
@@ -105,6 +216,18 @@ def hostname() -> str:
         return "unknown-host"
 
 
+def lan_address() -> Optional[str]:
+    # IP de la interfaz con ruta por defecto (no envía tráfico: UDP connect solo elige la ruta)
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect(("8.8.8.8", 80))
+        return probe.getsockname()[0]
+    except Exception:
+        return None
+    finally:
+        probe.close()
+
+
 def os_name() -> str:
     return f"{sys.platform}-{sys.getwindowsversion().major}.{sys.getwindowsversion().minor}" if hasattr(sys, "getwindowsversion") else sys.platform
 
@@ -117,6 +240,11 @@ def show_windows_message(title: str, message: str) -> None:
         pass
 
 
+def load_requests() -> Any:
+    import requests  # type: ignore
+    return requests
+
+
 def load_tk_modules() -> tuple[Any, Any, Any]:
     try:
         import tkinter as tk  # type: ignore
@@ -189,19 +317,24 @@ def get_default_printer_name() -> Optional[str]:
         return None
 
 
-def get_installed_printers() -> list[str]:
+def get_installed_printer_descriptions() -> Dict[str, str]:
+    """Nombre -> descripción de cada impresora instalada ("nombre,driver,ubicación" en Windows)."""
     if win32print is None:
-        return []
+        return {}
     try:
         flags = win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
         rows = win32print.EnumPrinters(flags)
-        names: list[str] = []
+        printers: Dict[str, str] = {}
         for row in rows:
             if len(row) >= 3 and row[2]:
-                names.append(str(row[2]))
-        return sorted(list(set(names)))
+                printers[str(row[2])] = str(row[1] or "")
+        return printers
     except Exception:
-        return []
+        return {}
+
+
+def get_installed_printers() -> list[str]:
+    return sorted(get_installed_printer_descriptions())
 
 
 def autodetect_printer() -> Optional[str]:
@@ -227,149 +360,187 @@ def autodetect_printer() -> Optional[str]:
     return default_name or names[0]
 
 
-def escpos_font_cmd(font_size: str) -> bytes:
-    # GS ! n
-    if (font_size or '').lower() == 'large':
-        return bytes([0x1D, 0x21, 0x11])
-    return bytes([0x1D, 0x21, 0x00])
+_profile_cache: Dict[str, PrinterProfile] = {}
 
 
-def escpos_wrap(text: str, encoding: str = "cp850", cut: bool = True, font_size: str = 'normal') -> bytes:
-    esc_init = bytes([0x1B, 0x40])
-    esc_codepage = bytes([0x1B, 0x74, 0x02])
-    gs_cut = bytes([0x1D, 0x56, 0x00])
-    payload = text.encode(encoding, errors="replace")
-    data = esc_init + esc_codepage + escpos_font_cmd(font_size) + payload + b"\n\n\n"
-    if cut:
-        data += gs_cut
-    return data
+def resolve_profile(printer_name: Optional[str]) -> PrinterProfile:
+    """
+    Perfil de capacidades para la impresora: MONTIS_PRINTER_PROFILE si está definido, si no
+    el primero cuyo patrón aparezca en el nombre o driver instalado; genérico si ninguno coincide.
+    """
+    forced = PROFILES_BY_NAME.get((os.getenv("MONTIS_PRINTER_PROFILE") or "").strip().lower())
+    if forced:
+        return forced
+    name = printer_name or ""
+    cached = _profile_cache.get(name)
+    if cached:
+        return cached
+    profile = match_profile(name, get_installed_printer_descriptions().get(name, ""))
+    _profile_cache[name] = profile
+    return profile
 
 
-def print_bytes(printer_name: str, data: bytes) -> None:
-    if win32print is None:
-        raise RuntimeError("pywin32 no disponible")
+class CatalogMissError(RuntimeError):
+    """El payload compacto referencia un id que el catálogo local no tiene."""
 
-    handle = win32print.OpenPrinter(printer_name)
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """Epoch de un timestamp ISO 8601 del backend ("2026-01-02T03:04:05.000Z"); None si no se puede leer."""
+    if not isinstance(value, str) or not value:
+        return None
     try:
-        win32print.StartDocPrinter(handle, 1, ("Montis Kitchen Ticket", None, "RAW"))
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def decode_job(job: Dict[str, Any]) -> TicketPayload:
+    """
+    Decodifica el payload del job una sola vez y lo deja en job["ticket"].
+    El dict original se descarta para no retener dos copias del pedido en memoria.
+    Los documentos de caja (recibo, factura, cierre) quedan en job["document"]; su ticket solo
+    lleva lo que usan el routing (estación "caja") y el historial.
+    """
+    ticket = job.get("ticket")
+    if isinstance(ticket, TicketPayload):
+        return ticket
+    if job.get("type") in DOCUMENT_TYPES:
+        document = decode_document(job["type"], job.get("payload"))
+        job.pop("payload", None)
+        if job.get("copies") is not None:
+            document = replace(document, format=replace(document.format, copies=clamp_copies(job["copies"])))
+        job["document"] = document
+        job["ticket"] = ticket = TicketPayload(
+            format=document.format, usuario=document.usuario, mesas=document.mesas, estacion=document.estacion
+        )
+        return ticket
+    payload = job.pop("payload", None)
+    if isinstance(payload, dict) and payload.get("catalogo"):
         try:
-            win32print.StartPagePrinter(handle)
-            win32print.WritePrinter(handle, data)
-            win32print.EndPagePrinter(handle)
-        finally:
-            win32print.EndDocPrinter(handle)
-    finally:
-        win32print.ClosePrinter(handle)
-
-
-def dividir_texto(texto: str, max_len: int) -> list[str]:
-    if len(texto) <= max_len:
-        return [texto]
-    palabras = texto.split(" ")
-    lineas: list[str] = []
-    actual = ""
-    for palabra in palabras:
-        candidate = (actual + " " + palabra).strip()
-        if len(candidate) <= max_len:
-            actual = candidate
-        else:
-            if actual:
-                lineas.append(actual)
-            actual = palabra
-    if actual:
-        lineas.append(actual)
-    return lineas
-
-
-def resolve_format(payload: Dict[str, Any]) -> tuple[int, str, str]:
-    fmt = payload.get('__format') if isinstance(payload, dict) else None
-    if not isinstance(fmt, dict):
-        fmt = {}
-    paper_width = fmt.get('paperWidth') or fmt.get('paper_width') or '80mm'
-    font_size = fmt.get('fontSize') or fmt.get('font_size') or 'normal'
-    base = 32 if paper_width == '58mm' else 48
-    width = base // 2 if str(font_size).lower() == 'large' else base
-    return width, str(paper_width), str(font_size)
-
-
-def format_ticket(payload: Dict[str, Any], width: int = 48) -> str:
-    sep = "=" * width
-    sep2 = "-" * width
-
-    lineas = [
-        f"Fecha: {datetime.now().strftime('%Y-%m-%d')}",
-        f"Hora:  {datetime.now().strftime('%H:%M')}",
-    ]
-
-    usuario = payload.get("usuario") or {}
-    nombre_usuario = str(usuario.get("nombre") or "Usuario")
-    encabezado = f"Atendido por: {nombre_usuario}"
-    if len(encabezado) <= width:
-        lineas.append(encabezado)
-    else:
-        lineas.append("Atendido por:")
-        lineas.extend(["  " + parte for parte in dividir_texto(nombre_usuario, width - 2)])
-
-    tipo = payload.get("tipo_pedido") or payload.get("tipoPedido") or "mesa"
-    cliente = payload.get("cliente") or {}
-    mesas = payload.get("mesas") or []
-
-    lineas.append("")
-    if tipo == "domicilio" and isinstance(cliente, dict):
-        es_para_llevar = bool(cliente.get("es_para_llevar") or cliente.get("esParaLlevar"))
-        lineas.append("*** PARA LLEVAR ***" if es_para_llevar else "*** DOMICILIO ***")
-        lineas.append(f"Cliente: {cliente.get('nombre') or 'Cliente'}")
-        telefono = cliente.get("telefono")
-        if telefono:
-            lineas.append(f"Tel: {telefono}")
-        direccion = cliente.get("direccion")
-        if direccion and not es_para_llevar:
-            lineas.append("Direccion:")
-            lineas.extend(["  " + parte for parte in dividir_texto(str(direccion), width - 2)])
-    else:
-        mesa_txt = ", ".join([str(m.get("numero") or "") for m in mesas if isinstance(m, dict)])
-        if mesa_txt:
-            if len(mesa_txt) <= (width - 8):
-                lineas.append(f"Mesa(s): {mesa_txt}")
-            else:
-                lineas.append("Mesa(s):")
-                lineas.extend(["  " + parte for parte in dividir_texto(mesa_txt, width - 2)])
-
-    lineas.extend(["", sep, "     COMANDA DE COCINA", sep, ""])
-
-    items = payload.get("items") or []
-    if not items:
-        lineas.append("(Sin items)")
-    else:
-        for idx, item in enumerate(items):
-            if idx > 0:
-                lineas.append(sep2)
-            cantidad = item.get("cantidad")
-            nombre = item.get("nombre") or "Producto"
-            titulo = f"{cantidad}x {nombre}" if cantidad is not None else str(nombre)
-            if len(titulo) <= width:
-                lineas.append(titulo)
-            else:
-                lineas.append(f"{cantidad}x")
-                lineas.extend(["  " + parte for parte in dividir_texto(str(nombre), width - 2)])
-
-            personalizaciones = item.get("personalizaciones") or []
-            if isinstance(personalizaciones, list):
-                lineas.extend(["  " + str(p) for p in personalizaciones if p])
-
-            obs = str(item.get("observaciones") or "").strip()
-            if obs:
-                lineas.append("")
-                lineas.append("  OBSERVACIONES:")
-                lineas.extend(["    " + parte for parte in dividir_texto(obs, width - 4)])
-
-    obs_generales = str(payload.get("observaciones_generales") or "").strip()
-    if obs_generales:
-        lineas.extend(["", sep, "OBSERVACIONES GENERALES:"])
-        lineas.extend(dividir_texto(obs_generales, width))
-
-    lineas.extend(["", "     ENVIADO A COCINA", sep, sep])
-    return "\n".join(lineas)
+            payload = catalog_cache().expand(payload)
+        except CatalogMissError:
+            job["payload"] = payload
+            raise
+    ticket = decode_ticket(payload)
+    if job.get("copies") is not None:
+        ticket = replace(ticket, format=replace(ticket.format, copies=clamp_copies(job["copies"])))
+    if ticket.format.order_code and not ticket.order_code_value and job.get("external_id"):
+        ticket = replace(ticket, codigo=str(job["external_id"]))
+    job["ticket"] = ticket
+    return ticket
+
+
+class CatalogCache:
+    """
+    Copia local y versionada del catálogo de la empresa (GET /api/print/catalog), guardada en
+    catalog.json. La versión es el updated_at más reciente visto; cada sync pide solo lo cambiado
+    desde ella. Con la versión en el poll, el backend entrega los jobs con ids en vez de nombres
+    (payload con "catalogo") y expand() los completa antes de decodificar.
+    """
+
+    SECTIONS = ("productos", "categorias", "personalizaciones", "usuarios")
+
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.version = ""
+        self.entries: Dict[str, Dict[str, Any]] = {section: {} for section in self.SECTIONS}
+        self.synced_at = 0.0
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            entries = {section: dict(data.get(section) or {}) for section in self.SECTIONS}
+            version = str(data.get("version") or "")
+        except Exception:
+            return
+        with self.lock:
+            self.entries = entries
+            self.version = version
+
+    def save(self) -> None:
+        with self.lock:
+            data = {"version": self.version, **self.entries}
+        ensure_app_dir()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def apply(self, data: Dict[str, Any]) -> int:
+        """Aplica una respuesta del backend (completa o incremental). Devuelve las entradas recibidas."""
+        received = 0
+        with self.lock:
+            entries = {section: {} for section in self.SECTIONS} if data.get("full") else self.entries
+            for section in self.SECTIONS:
+                for row in data.get(section) or []:
+                    if not isinstance(row, dict) or not row.get("id"):
+                        continue
+                    value: Any = str(row.get("nombre") or "")
+                    if section == "productos":
+                        value = [value, str(row.get("categoria_id") or "")]
+                    entries[section][str(row["id"])] = value
+                    received += 1
+            self.entries = entries
+            self.version = str(data.get("version") or self.version)
+            self.synced_at = time.time()
+        return received
+
+    def reset(self) -> None:
+        """Descarta la versión: el próximo poll llega con nombres y el próximo sync es completo."""
+        with self.lock:
+            self.version = ""
+            self.synced_at = 0.0
+
+    def _item(self, item: Any) -> Any:
+        if not isinstance(item, dict) or item.get("nombre") is not None or not item.get("producto_id"):
+            return item
+        producto = self.entries["productos"].get(str(item["producto_id"]))
+        if producto is None:
+            raise CatalogMissError(f"producto {item['producto_id']}")
+        nombre, categoria_id = producto
+        expanded = {**item, "nombre": nombre, "categoria": self.entries["categorias"].get(categoria_id)}
+        if item.get("personalizaciones") is None:
+            names = []
+            for personalizacion_id in item.get("personalizacion_ids") or []:
+                name = self.entries["personalizaciones"].get(str(personalizacion_id))
+                if name is None:
+                    raise CatalogMissError(f"personalización {personalizacion_id}")
+                names.append(name)
+            expanded["personalizaciones"] = names
+        return expanded
+
+    def expand(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Payload compacto -> payload con nombres, igual al que envía el backend sin catálogo."""
+        with self.lock:
+            expanded = dict(payload)
+            for key in ("items", "snapshot_items"):
+                if isinstance(payload.get(key), list):
+                    expanded[key] = [self._item(item) for item in payload[key]]
+            usuario = payload.get("usuario")
+            if isinstance(usuario, dict) and usuario.get("id") and usuario.get("nombre") is None:
+                nombre = self.entries["usuarios"].get(str(usuario["id"]))
+                if nombre is None:
+                    raise CatalogMissError(f"usuario {usuario['id']}")
+                expanded["usuario"] = {**usuario, "nombre": nombre}
+        return expanded
+
+
+_catalog: Optional[CatalogCache] = None
+_catalog_lock = threading.Lock()
+
+
+def catalog_cache() -> CatalogCache:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = CatalogCache()
+        return _catalog
 
 
 def register_startup(logger: logging.Logger) -> None:
@@ -493,7 +664,7 @@ def pair_device(api_base: str, logger: logging.Logger, existing_state: Optional[
             return
 
         try:
-            response = requests.post(
+            response = load_requests().post(
                 f"{api_base}/api/print/pair",
                 json={
                     "pairingToken": token,
@@ -548,13 +719,472 @@ def pair_device(api_base: str, logger: logging.Logger, existing_state: Optional[
     return result.get("state")
 
 
+def anonymize_payload(payload: Any) -> Any:
+    """
+    Copia del payload sin datos personales (cliente, mesero, observaciones). Conserva la
+    longitud de los textos y los productos para que el render tenga el mismo tamaño.
+    """
+    if not isinstance(payload, dict):
+        return payload
+
+    def mask(value: Any) -> Any:
+        return "x" * len(str(value)) if value else value
+
+    data = dict(payload)
+    cliente = data.get("cliente")
+    if isinstance(cliente, dict):
+        data["cliente"] = {
+            **cliente,
+            "nombre": mask(cliente.get("nombre")),
+            "telefono": "0" * len(str(cliente.get("telefono") or "")),
+            "direccion": mask(cliente.get("direccion")),
+            "documento": mask(cliente.get("documento")),
+        }
+    usuario = data.get("usuario")
+    if isinstance(usuario, dict):
+        data["usuario"] = {**usuario, "nombre": mask(usuario.get("nombre"))}
+    data["observaciones_generales"] = mask(data.get("observaciones_generales"))
+    for key in ("items", "snapshot_items"):
+        if isinstance(data.get(key), list):
+            data[key] = [
+                {**item, "observaciones": mask(item.get("observaciones"))} if isinstance(item, dict) else item
+                for item in data[key]
+            ]
+    return data
+
+
+class JobRecorder:
+    """
+    Graba los jobs recibidos (hora de llegada, origen y payload) en un archivo JSON Lines
+    comprimido, para reproducirlos con replay_capture.py al dimensionar equipos.
+    """
+
+    def __init__(self, path: str, anonymize: bool = True):
+        if path == "1":
+            path = os.path.join(APP_DIR, "captures", f"capture-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+        self.path = path
+        self.anonymize = anonymize
+        self.lock = threading.Lock()
+        self.file: Any = None
+
+    def record(self, jobs: list[Dict[str, Any]], source: str) -> None:
+        if not jobs:
+            return
+        now = time.time()
+        lines = []
+        for job in jobs:
+            payload = job.get("payload")
+            lines.append(
+                json.dumps(
+                    {
+                        "t": round(now, 3),
+                        "src": source,
+                        "id": job.get("id"),
+                        "external_id": job.get("external_id"),
+                        "type": job.get("type"),
+                        "payload": anonymize_payload(payload) if self.anonymize else payload,
+                    },
+                    ensure_ascii=False,
+                    separators=(",", ":"),
+                )
+            )
+        with self.lock:
+            if self.file is None:
+                import gzip
+
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self.file = gzip.open(self.path, "at", encoding="utf-8")
+            self.file.write("\n".join(lines) + "\n")
+            # Sync flush: una caída del agente no pierde lo ya grabado
+            self.file.flush()
+
+
+def process_start_time() -> Optional[float]:
+    """Epoch de creación del proceso actual (solo Windows); None si no se puede obtener."""
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        creation = wintypes.FILETIME()
+        exit_time = wintypes.FILETIME()
+        kernel_time = wintypes.FILETIME()
+        user_time = wintypes.FILETIME()
+        kernel32 = ctypes.windll.kernel32  # type: ignore[attr-defined]
+        ok = kernel32.GetProcessTimes(
+            kernel32.GetCurrentProcess(),
+            ctypes.byref(creation),
+            ctypes.byref(exit_time),
+            ctypes.byref(kernel_time),
+            ctypes.byref(user_time),
+        )
+        if not ok:
+            return None
+        ticks = (creation.dwHighDateTime << 32) | creation.dwLowDateTime
+        # FILETIME: intervalos de 100 ns desde 1601-01-01
+        return ticks / 10_000_000 - 11644473600
+    except Exception:
+        return None
+
+
+def is_onefile_build() -> bool:
+    # onefile extrae en %TEMP%\_MEIxxxx; onedir usa la carpeta del .exe (o su _internal).
+    mei_path = getattr(sys, "_MEIPASS", None)
+    if not mei_path:
+        return False
+    exe_dir = os.path.dirname(os.path.abspath(sys.executable))
+    return os.path.abspath(mei_path) not in (exe_dir, os.path.join(exe_dir, "_internal"))
+
+
+class StartupProfile:
+    """
+    Tiempos de arranque para --startup-profile.
+    Las marcas se miden desde el inicio de los imports del módulo; si Windows
+    expone la hora de creación del proceso también se reporta el tiempo previo
+    (intérprete + bootloader de PyInstaller).
+    """
+
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+        started = process_start_time()
+        wall_offset = time.time() - (time.perf_counter() - _IMPORT_STARTED)
+        self.before_imports = (wall_offset - started) if started else None
+        self.marks: list[tuple[str, float]] = [("imports", _IMPORT_FINISHED - _IMPORT_STARTED)]
+
+    def mark(self, name: str) -> None:
+        self.marks.append((name, time.perf_counter() - _IMPORT_STARTED))
+
+    def report(self) -> Dict[str, Any]:
+        base = self.before_imports or 0.0
+        report: Dict[str, Any] = {
+            "frozen": bool(getattr(sys, "frozen", False)),
+            "onefile": is_onefile_build(),
+            "before_imports_ms": round(self.before_imports * 1000, 1) if self.before_imports is not None else None,
+            "marks_ms": {name: round((base + value) * 1000, 1) for name, value in self.marks},
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        summary = ", ".join(f"{name}={ms}ms" for name, ms in report["marks_ms"].items())
+        self.logger.info(f"Perfil de arranque: {summary}")
+        try:
+            ensure_app_dir()
+            with open(STARTUP_PROFILE_PATH, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        except Exception as error:
+            self.logger.warning(f"No se pudo guardar perfil de arranque: {error}")
+        if sys.stdout is not None:
+            print(json.dumps(report, ensure_ascii=False, indent=2), flush=True)
+        return report
+
+
+def process_handle_count() -> Optional[int]:
+    """Handles abiertos por el proceso (descriptores de archivo fuera de Windows)."""
+    if os.name == "nt":
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            count = wintypes.DWORD()
+            kernel32 = ctypes.windll.kernel32  # type: ignore[attr-defined]
+            if kernel32.GetProcessHandleCount(kernel32.GetCurrentProcess(), ctypes.byref(count)):
+                return int(count.value)
+        except Exception:
+            return None
+        return None
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def buffered_log_records() -> int:
+    """Registros retenidos en memoria por handlers con buffer (MemoryHandler y similares)."""
+    total = 0
+    loggers = [logging.getLogger()] + [
+        value for value in list(logging.Logger.manager.loggerDict.values()) if isinstance(value, logging.Logger)
+    ]
+    for item in loggers:
+        for handler in item.handlers:
+            buffer = getattr(handler, "buffer", None)
+            if isinstance(buffer, list):
+                total += len(buffer)
+    return total
+
+
+class RuntimeProfiler:
+    """
+    Perfil del agente en ejecución para PCs de caja que se vuelven lentos tras semanas encendidos.
+    Mientras está activo toma muestras del stack de cada hilo (PROFILE_SAMPLE_HZ) y cada
+    PROFILE_INTERVAL_SECONDS guarda en PROFILE_DIR:
+      - cpu-*.folded: stacks agregados en formato "collapsed" (flamegraph.pl, speedscope).
+      - profile-*.json: top de CPU, diferencia de tracemalloc contra la vuelta anterior,
+        delta de objetos vivos por tipo y recursos (sesiones HTTP, handles, hilos, logs).
+    Un recurso que crece PROFILE_LEAK_WINDOW vueltas seguidas se reporta como posible fuga.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = PROFILE_INTERVAL_SECONDS):
+        self.logger = logger
+        self.interval = max(interval, 1.0)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self.started_tracemalloc = False
+        self.last_snapshot: Any = None
+        self.last_objects: Dict[str, int] = {}
+        self.http_sessions = 0
+        self.history: Dict[str, list[float]] = {}
+
+    @property
+    def active(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self) -> bool:
+        import tracemalloc
+
+        with self.lock:
+            if self.active:
+                return False
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(PROFILE_TRACE_FRAMES)
+                self.started_tracemalloc = True
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.loop, name="montis-profiler", daemon=True)
+            self.thread.start()
+        self.logger.info(f"Perfilado activado: {PROFILE_DIR} cada {self.interval:g}s")
+        return True
+
+    def stop(self) -> bool:
+        with self.lock:
+            thread = self.thread
+            if thread is None or not thread.is_alive():
+                return False
+            self.stop_event.set()
+        thread.join(timeout=self.interval + 30)
+        self.logger.info("Perfilado desactivado")
+        return True
+
+    def toggle(self) -> bool:
+        if self.active:
+            self.stop()
+            return False
+        self.start()
+        return True
+
+    def loop(self) -> None:
+        period = 1.0 / PROFILE_SAMPLE_HZ
+        next_dump = time.monotonic() + self.interval
+        while not self.stop_event.wait(period):
+            self.sample()
+            if time.monotonic() >= next_dump:
+                self.dump()
+                next_dump = time.monotonic() + self.interval
+        self.dump()
+        if self.started_tracemalloc:
+            import tracemalloc
+
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+        self.last_snapshot = None
+
+    def sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                name = getattr(code, "co_qualname", code.co_name)
+                parts.append(f"{name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            parts.append(names.get(ident, str(ident)))
+            key = ";".join(reversed(parts))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def dump(self) -> None:
+        stacks, samples = self.stacks, self.samples
+        self.stacks, self.samples = {}, 0
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3]
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if stacks:
+                with open(os.path.join(PROFILE_DIR, f"cpu-{stamp}.folded"), "w", encoding="utf-8") as f:
+                    for key, count in sorted(stacks.items(), key=lambda entry: -entry[1]):
+                        f.write(f"{key} {count}\n")
+            report = {
+                "recorded_at": datetime.now().isoformat(timespec="seconds"),
+                "interval_s": self.interval,
+                "samples": samples,
+                "cpu_top": self.cpu_top(stacks, samples),
+                "memory": self.memory_report(),
+                "objects_delta": self.objects_delta(),
+                "resources": self.resources(),
+            }
+            report["leaks"] = self.detect_leaks(report["resources"], report["memory"].get("traced_kb"))
+            with open(os.path.join(PROFILE_DIR, f"profile-{stamp}.json"), "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.rotate()
+        except Exception as error:
+            self.logger.warning(f"No se pudo guardar perfil: {error}")
+
+    @staticmethod
+    def cpu_top(stacks: Dict[str, int], samples: int, limit: int = 15) -> list[Dict[str, Any]]:
+        # Tiempo "propio": la función en la punta del stack de cada muestra
+        own: Dict[str, int] = {}
+        for key, count in stacks.items():
+            leaf = key.rsplit(";", 1)[-1]
+            own[leaf] = own.get(leaf, 0) + count
+        total = sum(own.values()) or 1
+        top = sorted(own.items(), key=lambda entry: -entry[1])[:limit]
+        return [{"frame": frame, "samples": count, "pct": round(count * 100 / total, 1)} for frame, count in top]
+
+    def memory_report(self, limit: int = 15) -> Dict[str, Any]:
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            return {}
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+        if self.last_snapshot is not None:
+            stats = snapshot.compare_to(self.last_snapshot, "lineno")[:limit]
+            top = [
+                {"where": str(stat.traceback[0]), "kb": round(stat.size / 1024, 1), "delta_kb": round(stat.size_diff / 1024, 1)}
+                for stat in stats
+            ]
+        else:
+            top = [
+                {"where": str(stat.traceback[0]), "kb": round(stat.size / 1024, 1)}
+                for stat in snapshot.statistics("lineno")[:limit]
+            ]
+        self.last_snapshot = snapshot
+        return {"traced_kb": round(current / 1024, 1), "peak_kb": round(peak / 1024, 1), "top": top}
+
+    def count_objects(self) -> Dict[str, int]:
+        import gc
+
+        by_type: Dict[type, int] = {}
+        for obj in gc.get_objects():
+            kind = type(obj)
+            by_type[kind] = by_type.get(kind, 0) + 1
+        return {f"{kind.__module__}.{kind.__qualname__}": count for kind, count in by_type.items()}
+
+    def objects_delta(self, limit: int = 20) -> list[Dict[str, Any]]:
+        counts = self.count_objects()
+        previous, self.last_objects = self.last_objects, counts
+        self.http_sessions = counts.get("requests.sessions.Session", 0)
+        if not previous:
+            return []
+        deltas = [(name, count - previous.get(name, 0), count) for name, count in counts.items()]
+        deltas = [entry for entry in deltas if entry[1] > 0]
+        deltas.sort(key=lambda entry: -entry[1])
+        return [{"type": name, "delta": delta, "count": count} for name, delta, count in deltas[:limit]]
+
+    def resources(self) -> Dict[str, Any]:
+        log_size = None
+        try:
+            log_size = os.path.getsize(LOG_PATH)
+        except OSError:
+            pass
+        return {
+            "http_sessions": self.http_sessions,
+            "handles": process_handle_count(),
+            "threads": threading.active_count(),
+            "log_buffered_records": buffered_log_records(),
+            "log_handlers": len(logging.getLogger("montis_printer_agent").handlers),
+            "log_file_kb": round(log_size / 1024, 1) if log_size is not None else None,
+        }
+
+    def detect_leaks(self, resources: Dict[str, Any], traced_kb: Optional[float]) -> list[str]:
+        values = {
+            "http_sessions": resources.get("http_sessions"),
+            "handles": resources.get("handles"),
+            "threads": resources.get("threads"),
+            "log_buffered_records": resources.get("log_buffered_records"),
+            "log_handlers": resources.get("log_handlers"),
+            "traced_kb": traced_kb,
+        }
+        leaks = []
+        for name, value in values.items():
+            if value is None:
+                continue
+            series = self.history.setdefault(name, [])
+            series.append(float(value))
+            del series[: -(PROFILE_LEAK_WINDOW + 1)]
+            if len(series) > PROFILE_LEAK_WINDOW and all(b > a for a, b in zip(series, series[1:])):
+                leaks.append(name)
+                self.logger.warning(
+                    f"Posible fuga: {name} creció {PROFILE_LEAK_WINDOW} vueltas seguidas "
+                    f"({series[0]:g} -> {series[-1]:g})"
+                )
+        return leaks
+
+    @staticmethod
+    def rotate() -> None:
+        try:
+            names = sorted(os.listdir(PROFILE_DIR))
+        except OSError:
+            return
+        for prefix in ("cpu-", "profile-"):
+            files = [name for name in names if name.startswith(prefix)]
+            for name in files[:-PROFILE_KEEP]:
+                try:
+                    os.remove(os.path.join(PROFILE_DIR, name))
+                except OSError:
+                    pass
+
+
 class Agent:
     def __init__(self, state: AgentState, logger: logging.Logger):
         self.state = state
         self.logger = logger
         self.start_time = time.time()
         self.last_heartbeat = 0.0
-        self.session = requests.Session()
+        self.last_jobs_at = 0.0
+        # Último pedido recibido (nube o LAN) y estado del servicio, para el poll adaptativo
+        self.last_activity = time.monotonic() - POLL_BUSY_WINDOW_SECONDS
+        self.service_open = True
+        self.wake = threading.Event()
+        # external_id -> "printing" | "printed": evita imprimir dos veces un job que llega
+        # por LAN y por la cola en la nube.
+        self.recent_external_ids: OrderedDict[str, str] = OrderedDict()
+        self.external_ids_lock = threading.Lock()
+        # external_id -> exp de los tokens LAN ya usados (un token vale una sola vez)
+        self.used_local_ids: Dict[str, int] = {}
+        self.deferred_jobs: list[Dict[str, Any]] = []
+        self.local_server: Optional[ThreadingHTTPServer] = None
+        self.journal = PrintedJournal(PRINTED_JOURNAL_PATH)
+        self.render_cache = RenderCache()
+        self.router = StationRouter(ROUTING_PATH)
+        self.comandas = ComandaHistory(COMANDA_HISTORY_PATH)
+        self.tickets = TicketHistory(TICKET_HISTORY_PATH) if TICKET_HISTORY_MAX_MB > 0 else None
+        # "standby" (MONTIS_FAILOVER_ROLE) o "" para la principal; impresoras principales que cubre
+        self.failover_role = FAILOVER_ROLE
+        self.covering: set[str] = set()
+        self.recorder = JobRecorder(CAPTURE_PATH, CAPTURE_ANONYMIZE) if CAPTURE_PATH else None
+        self.profiler = RuntimeProfiler(logger)
+        # Drenado de cola atrasada; clock_offset = hora del backend - hora local
+        self.draining = False
+        self.drain_started = 0.0
+        self.drain_stats: Dict[str, int] = {}
+        self.clock_offset = 0.0
+        # job_id -> monotonic del reclamo; se renueva el lease mientras sigan aquí
+        self.leased_jobs: dict[str, float] = {}
+        self.leases_lock = threading.Lock()
+        self.breaker = PrinterBreaker(logger, on_change=self.force_heartbeat)
+        self.pool = PrinterPool(self.router, self.breaker, logger)
+        self.spool = SpoolTracker(self.on_spool_done, logger, on_stuck=self.pool.on_stuck)
+        self.spool_blocked = False
+        self.spool_empty = True
+        self.recovered = False
+        self.startup_profile: Optional[StartupProfile] = None
+        self.session = load_requests().Session()
         ca_bundle = resolve_ca_bundle_path()
         if ca_bundle:
             self.session.verify = ca_bundle
@@ -569,6 +1199,10 @@ class Agent:
             }
         )
 
+    def force_heartbeat(self) -> None:
+        """Reporta el cambio en el siguiente ciclo sin esperar los 30 s del heartbeat."""
+        self.last_heartbeat = 0.0
+
     def heartbeat(self) -> None:
         now = time.time()
         if now - self.last_heartbeat < 30:
@@ -576,7 +1210,38 @@ class Agent:
         self.last_heartbeat = now
         uptime = int(now - self.start_time)
         url = f"{self.state.api_base}/api/print/printers/{self.state.printer_id}/heartbeat"
-        self.session.post(url, json={"uptime": uptime, "status": "ready", "meta": {"printer_name": self.state.printer_name}}, timeout=10)
+        meta: Dict[str, Any] = {
+            "printer_name": self.state.printer_name,
+            "spooler_hung": hung_spooler_calls(),
+            "failover_role": self.failover_role or "primary",
+            "printer_profile": self.profile(self.state.printer_name).nombre,
+        }
+        if self.profiler.active:
+            meta["profiling"] = True
+        if self.draining:
+            meta["draining"] = True
+        if self.spool.depths:
+            meta["spool_depth"] = max(self.spool.depths.values())
+        if self.spool_blocked:
+            meta["spool_backpressure"] = True
+        # Siempre se envían: el backend fusiona meta y un circuito cerrado debe borrar el anterior
+        meta["circuit"] = self.breaker.snapshot()
+        meta["circuit_open"] = bool(self.down_printers())
+        meta["printer_pools"] = {
+            name: list(self.router.members(name)) for name in self.agent_targets() if name in self.router.pools
+        }
+        if not self.service_open:
+            meta["service_open"] = False
+        meta["poll_seconds"] = self.poll_base()
+        if CATALOG_ENABLED:
+            meta["catalog_version"] = catalog_cache().version or None
+        if self.covering:
+            meta["failover_covering"] = sorted(self.covering)
+        if self.local_server:
+            address = lan_address()
+            if address:
+                meta["lan_url"] = f"http://{address}:{self.local_server.server_address[1]}"
+        self.session.post(url, json={"uptime": uptime, "status": "ready", "meta": meta}, timeout=10)
 
     def reload_runtime_state(self) -> None:
         disk_state = load_state()
@@ -599,13 +1264,314 @@ class Agent:
                 self._apply_session_headers()
                 self.logger.info("Configuración del agente actualizada desde estado local.")
 
-    def fetch_jobs(self) -> list[Dict[str, Any]]:
+    def fetch_jobs(self, limit: int = JOB_LIMIT) -> list[Dict[str, Any]]:
         url = f"{self.state.api_base}/api/print/jobs"
-        response = self.session.get(url, params={"status": "pending", "limit": str(JOB_LIMIT)}, timeout=20)
+        params = {"status": "pending", "limit": str(limit), "leaseSeconds": str(LEASE_SECONDS)}
+        if self.failover_role == "standby":
+            params["failover"] = "1"
+        if CATALOG_ENABLED and catalog_cache().version:
+            params["catalogVersion"] = catalog_cache().version
+        response = self.session.get(url, params=params, timeout=20)
         response.raise_for_status()
-        payload = response.json()
-        jobs = payload.get("jobs") or []
-        return jobs if isinstance(jobs, list) else []
+        data = json_loads(response.content)
+        server_time = parse_timestamp(data.get("server_time"))
+        if server_time is not None:
+            self.clock_offset = server_time - time.time()
+        if self.failover_role == "standby":
+            self.update_failover((data.get("failover") or {}).get("covering") or [])
+        service_open = data.get("service_open")
+        if isinstance(service_open, bool) and service_open != self.service_open:
+            self.service_open = service_open
+            if service_open:
+                self.logger.info("Servicio abierto: poll normal")
+            else:
+                self.logger.info(f"Servicio cerrado: poll cada {POLL_CLOSED_SECONDS:g}s")
+        jobs = data.get("jobs") or []
+        if not isinstance(jobs, list):
+            return []
+        if jobs:
+            self.last_activity = time.monotonic()
+        self.track_leases(jobs)
+        if self.recorder:
+            self.record(jobs, "cloud")
+        return self.decode_jobs(jobs)
+
+    def poll_base(self) -> float:
+        """Segundos entre polls según el tráfico reciente y el estado del servicio (sin jitter)."""
+        idle = time.monotonic() - self.last_activity
+        if idle < POLL_BUSY_WINDOW_SECONDS:
+            return POLL_BUSY_SECONDS
+        if not self.service_open:
+            return POLL_CLOSED_SECONDS
+        if idle < POLL_IDLE_AFTER_SECONDS:
+            return float(POLL_SECONDS)
+        return POLL_IDLE_SECONDS
+
+    def wait_next_poll(self) -> None:
+        """Espera hasta el próximo poll; un job por LAN la corta (wake)."""
+        interval = self.poll_base()
+        self.wake.wait(interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER))
+        self.wake.clear()
+
+    def note_activity(self) -> None:
+        self.last_activity = time.monotonic()
+        self.wake.set()
+
+    def job_age(self, job: Dict[str, Any]) -> float:
+        """Segundos desde que el backend creó el job (0 si no trae created_at)."""
+        created = parse_timestamp(job.get("created_at"))
+        if created is None:
+            return 0.0
+        return max(time.time() + self.clock_offset - created, 0.0)
+
+    def update_drain(self, fetched: list[Dict[str, Any]], limit: int) -> bool:
+        """Entra o sale del modo drenado según el último poll. Devuelve True al entrar."""
+        oldest = max((self.job_age(job) for job in fetched), default=0.0)
+        # Se entra solo con jobs viejos (una ráfaga normal llena la página sin estar atrasada);
+        # se sigue drenando mientras lleguen páginas llenas.
+        backlog = oldest > DRAIN_BACKLOG_SECONDS or (self.draining and len(fetched) >= limit)
+        if backlog and not self.draining:
+            self.draining = True
+            self.drain_started = time.monotonic()
+            self.drain_stats = {"impresos": 0, "reemplazados": 0, "vencidos": 0}
+            self.logger.warning(
+                f"Cola atrasada ({len(fetched)} jobs, el más antiguo de {oldest / 60:.1f} min): modo drenado"
+            )
+            return True
+        if not backlog and self.draining:
+            self.draining = False
+            stats = self.drain_stats
+            self.logger.info(
+                f"Cola al día en {time.monotonic() - self.drain_started:.1f}s: {stats['impresos']} impresos, "
+                f"{stats['reemplazados']} reemplazados, {stats['vencidos']} vencidos"
+            )
+        return False
+
+    def expire_job(self, job: Dict[str, Any], reason: str, info: Optional[str] = None) -> None:
+        job_id = str(job.get("id") or "")
+        self.finish_external_id(str(job.get("external_id") or ""), printed=False)
+        try:
+            self.ack(job_id, "expired", info=info, reason=reason)
+        except Exception as error:
+            self.logger.error(f"No se pudo enviar ack expired de {job_id}: {error}")
+
+    def drain_jobs(self, jobs: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+        """
+        Ordena un lote atrasado: de cada comanda queda solo la versión más reciente, los jobs
+        más viejos que DRAIN_TTL_SECONDS van a un ticket resumen (o a ack expired) y el resto
+        se devuelve del más nuevo al más viejo.
+        """
+        ages = {id(job): self.job_age(job) for job in jobs}
+        latest: Dict[str, Dict[str, Any]] = {}
+        for job in jobs:
+            ticket = decode_job(job)
+            if ticket.comanda_id and ticket.snapshot:
+                current = latest.get(ticket.comanda_id)
+                if current is None or ages[id(job)] <= ages[id(current)]:
+                    latest[ticket.comanda_id] = job
+
+        remaining: list[Dict[str, Any]] = []
+        collapsed: set[str] = set()
+        for job in jobs:
+            ticket = decode_job(job)
+            newest = latest.get(ticket.comanda_id) if ticket.snapshot else None
+            if newest is not None and newest is not job:
+                collapsed.add(ticket.comanda_id)
+                self.expire_job(job, f"reemplazado por el job {newest.get('id')}", info="reemplazado")
+                self.drain_stats["reemplazados"] += 1
+            else:
+                remaining.append(job)
+
+        for comanda_id in collapsed:
+            # Si nunca se imprimió ninguna versión, la más reciente sale completa (su snapshot)
+            job = latest[comanda_id]
+            ticket = decode_job(job)
+            try:
+                printed_before = self.comandas.get(comanda_id) is not None
+            except Exception:
+                printed_before = False
+            if not printed_before and ticket.modo != "completa":
+                job["ticket"] = replace(ticket, items=ticket.snapshot, modo="completa")
+
+        # Los documentos de caja no vencen: un recibo o un cierre atrasado se imprime igual
+        expired = {
+            id(job) for job in remaining
+            if DRAIN_TTL_SECONDS and ages[id(job)] > DRAIN_TTL_SECONDS and "document" not in job
+        }
+        stale = [job for job in remaining if id(job) in expired]
+        fresh = [job for job in remaining if id(job) not in expired]
+        fresh.sort(key=lambda job: ages[id(job)])
+        if stale:
+            fresh += self.handle_stale(stale, ages)
+        self.drain_stats["impresos"] += len(fresh)
+        return fresh
+
+    def handle_stale(self, stale: list[Dict[str, Any]], ages: Dict[int, float]) -> list[Dict[str, Any]]:
+        """Resume (o expira) los jobs vencidos. Si el resumen no se puede imprimir se devuelven para imprimirlos normalmente."""
+        stale.sort(key=lambda job: -ages[id(job)])
+        ttl_minutes = DRAIN_TTL_SECONDS // 60
+        if DRAIN_STALE_MODE == "resumen":
+            now = time.time()
+            entries = [
+                (datetime.fromtimestamp(now - ages[id(job)]).strftime("%H:%M"), decode_job(job)) for job in stale
+            ]
+            printer_name = self.state.printer_name or get_default_printer_name() or ""
+            profile = self.profile(printer_name)
+            fmt = decode_job(stale[0]).format
+            text = format_stale_summary(entries, ttl_minutes, profile.columns(fmt.paper_width, "normal"))
+            summary = TicketPayload(format=TicketFormat(fmt.paper_width, "normal"), raw_text=text)
+            try:
+                self.spool_write(printer_name, render_ticket(summary, profile))
+            except Exception as error:
+                self.logger.error(f"No se pudo imprimir el resumen de atrasados: {error}")
+                return stale
+            info = "en resumen de atrasados"
+        else:
+            info = "vencido sin imprimir"
+        for job in stale:
+            self.expire_job(job, f"más de {ttl_minutes} min en cola", info=info)
+        self.drain_stats["vencidos"] += len(stale)
+        self.logger.warning(f"{len(stale)} jobs vencidos ({info})")
+        return []
+
+    def record(self, jobs: list[Dict[str, Any]], source: str) -> None:
+        try:
+            self.recorder.record(jobs, source)  # type: ignore[union-attr]
+        except Exception as error:
+            self.logger.warning(f"No se pudo grabar la captura de jobs: {error}")
+
+    def update_failover(self, covering: list[Any]) -> None:
+        current = {str(printer_id) for printer_id in covering}
+        started = current - self.covering
+        returned = self.covering - current
+        if started:
+            self.logger.warning(f"Failover: cubriendo la cola de {', '.join(sorted(started))} (principal caída o atrasada)")
+        if returned:
+            self.logger.info(f"Failover: {', '.join(sorted(returned))} volvió a estar al día; se le devuelve la cola")
+        if started or returned:
+            self.force_heartbeat()
+        self.covering = current
+
+    def decode_jobs(self, jobs: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+        """Valida y decodifica los payloads una sola vez; los mal formados se rechazan con el motivo."""
+        valid: list[Dict[str, Any]] = []
+        for job in jobs:
+            job_id = str(job.get("id") or "")
+            try:
+                decode_job(job)
+            except CatalogMissError as error:
+                # Catálogo local incompleto: el job vuelve a pending y, sin versión en el poll,
+                # el backend lo entrega con nombres; el catálogo se baja completo de nuevo.
+                self.logger.warning(f"Job {job_id}: catálogo local sin {error}; se pide con nombres")
+                catalog_cache().reset()
+                try:
+                    self.release_job(job_id, reason="catálogo local desactualizado")
+                except Exception as release_error:
+                    self.logger.error(f"No se pudo devolver el job {job_id}: {release_error}")
+                continue
+            except JobDecodeError as error:
+                self.logger.error(f"Job {job_id} rechazado: {error}")
+                try:
+                    self.ack(job_id, "failed", reason=f"payload inválido: {error}")
+                except Exception as ack_error:
+                    self.logger.error(f"No se pudo enviar ack failed: {ack_error}")
+                continue
+            valid.append(job)
+        return valid
+
+    def track_leases(self, jobs: list[Dict[str, Any]]) -> None:
+        now = time.monotonic()
+        with self.leases_lock:
+            for job in jobs:
+                job_id = str(job.get("id") or "")
+                if job_id:
+                    self.leased_jobs.setdefault(job_id, now)
+
+    def renew_leases(self) -> None:
+        with self.leases_lock:
+            job_ids = list(self.leased_jobs)
+        if not job_ids:
+            return
+        url = f"{self.state.api_base}/api/print/jobs/lease"
+        response = self.session.post(url, json={"jobIds": job_ids, "leaseSeconds": LEASE_SECONDS}, timeout=10)
+        response.raise_for_status()
+
+    def lease_keeper(self) -> None:
+        while True:
+            time.sleep(LEASE_SECONDS / 3)
+            try:
+                self.renew_leases()
+            except Exception as error:
+                self.logger.warning(f"No se pudo renovar leases: {error}")
+            if CATALOG_ENABLED and time.time() - catalog_cache().synced_at >= CATALOG_SYNC_SECONDS:
+                try:
+                    self.sync_catalog()
+                except Exception as error:
+                    self.logger.warning(f"No se pudo sincronizar el catálogo: {error}")
+            try:
+                # Con el poll espaciado (servicio cerrado) el heartbeat sale desde aquí: el backend
+                # da por caído al agente tras 90 s sin heartbeat y activaría el failover.
+                self.heartbeat()
+            except Exception as error:
+                self.logger.warning(f"No se pudo enviar heartbeat: {error}")
+
+    def sync_catalog(self) -> None:
+        """Trae del backend lo cambiado en el catálogo desde la versión local (todo si no hay)."""
+        catalog = catalog_cache()
+        catalog.synced_at = time.time()
+        params = {"since": catalog.version} if catalog.version else {}
+        response = self.session.get(f"{self.state.api_base}/api/print/catalog", params=params, timeout=20)
+        response.raise_for_status()
+        data = json_loads(response.content)
+        previous = catalog.version
+        received = catalog.apply(data)
+        if received or catalog.version != previous:
+            catalog.save()
+            self.logger.info(f"Catálogo sincronizado: {received} cambio(s), versión {catalog.version or '-'}")
+
+    def release_job(self, job_id: str, reason: Optional[str] = None) -> None:
+        """Devuelve un job reclamado a pending sin marcarlo como fallido."""
+        url = f"{self.state.api_base}/api/print/jobs/{job_id}/release"
+        try:
+            response = self.session.post(url, json={"reason": reason} if reason else {}, timeout=20)
+            response.raise_for_status()
+        finally:
+            with self.leases_lock:
+                self.leased_jobs.pop(job_id, None)
+
+    def recover_processing_jobs(self) -> None:
+        """
+        Al arrancar, revisa los jobs propios que quedaron en processing (caída entre fetch y ack).
+        Los ya impresos se confirman; el resto se retoma (hasta RECOVER_LIMIT) o se devuelve a pending.
+        """
+        url = f"{self.state.api_base}/api/print/jobs"
+        response = self.session.get(url, params={"status": "processing", "limit": "50"}, timeout=20)
+        response.raise_for_status()
+        jobs = response.json().get("jobs") or []
+        if not isinstance(jobs, list) or not jobs:
+            return
+
+        with self.leases_lock:
+            in_flight = set(self.leased_jobs)
+        jobs = [job for job in jobs if str(job.get("id") or "") and str(job.get("id")) not in in_flight]
+        jobs.sort(key=lambda job: str(job.get("created_at") or ""))
+
+        resumed = 0
+        for job in jobs:
+            job_id = str(job.get("id"))
+            try:
+                if job_id in self.journal:
+                    self.ack(job_id, "done", info="recuperado")
+                elif resumed < RECOVER_LIMIT:
+                    self.track_leases([job])
+                    self.deferred_jobs.append(job)
+                    resumed += 1
+                else:
+                    self.release_job(job_id, reason="recuperado al reiniciar agente")
+            except Exception as error:
+                self.logger.warning(f"No se pudo recuperar job {job_id}: {error}")
+
+        self.logger.info(f"Recuperación al iniciar: {len(jobs)} job(s) en processing, {resumed} retomado(s)")
 
     def ack(self, job_id: str, status: str, info: Optional[str] = None, reason: Optional[str] = None) -> None:
         url = f"{self.state.api_base}/api/print/jobs/{job_id}/ack"
@@ -616,46 +1582,620 @@ class Agent:
             body["reason"] = reason
         if status == "done":
             body["printedAt"] = datetime.utcnow().isoformat() + "Z"
-        response = self.session.post(url, json=body, timeout=20)
-        response.raise_for_status()
+        try:
+            response = self.session.post(url, json=body, timeout=20)
+            response.raise_for_status()
+        finally:
+            with self.leases_lock:
+                self.leased_jobs.pop(job_id, None)
+
+    def profile(self, printer_name: str) -> PrinterProfile:
+        """Perfil de la impresora; un grupo usa el de su primer miembro (los miembros son iguales)."""
+        return resolve_profile(self.router.members(printer_name)[0] if printer_name else printer_name)
+
+    def render_ticket(self, ticket: TicketPayload, printer_name: str) -> bytes:
+        """Bytes ESC/POS de una copia del ticket para el perfil de la impresora, memorizados en RenderCache."""
+        return render_ticket(ticket, self.profile(printer_name), self.render_cache)
+
+    def render_document(self, document: DocumentPayload, printer_name: str) -> bytes:
+        """Bytes ESC/POS de una copia del documento de caja, con el mismo RenderCache que las comandas."""
+        return render_document(document, self.profile(printer_name), self.render_cache)
+
+    def apply_history(self, ticket: TicketPayload) -> Optional[TicketPayload]:
+        """
+        En una edición ("adicionales") imprime solo la diferencia contra lo último impreso de la
+        comanda. Devuelve None si no hay cambios. Sin registro local se usa lo enviado por el backend.
+        """
+        if ticket.modo != "adicionales" or not ticket.comanda_id:
+            return ticket
+        try:
+            previous = self.comandas.get(ticket.comanda_id)
+        except Exception as error:
+            self.logger.warning(f"No se pudo leer historial de comandas: {error}")
+            return ticket
+        if previous is None:
+            return ticket
+        changes = diff_items(previous, ticket.snapshot)
+        if not changes:
+            return None
+        return replace(ticket, items=changes, modo="cambios")
+
+    def remember_comanda(self, job: Dict[str, Any]) -> None:
+        ticket = decode_job(job)
+        if not ticket.comanda_id or not ticket.snapshot:
+            return
+        try:
+            self.comandas.save(ticket.comanda_id, ticket.snapshot)
+        except Exception as error:
+            self.logger.warning(f"No se pudo guardar historial de comandas: {error}")
+
+    def archive_ticket(self, job: Dict[str, Any], stations: str, printer_name: str, data: bytes) -> None:
+        """Guarda lo que salió por la impresora en el historial local de reimpresiones."""
+        if self.tickets is None:
+            return
+        try:
+            self.tickets.add(
+                decode_job(job), str(job.get("id") or ""), str(job.get("external_id") or ""),
+                printer_name, stations, data,
+            )
+        except Exception as error:
+            self.logger.warning(f"No se pudo guardar el ticket en el historial: {error}")
+
+    def reprint_tickets(self, body: Dict[str, Any]) -> tuple[int, Dict[str, Any]]:
+        """POST /reimprimir: {"id": 123} o {"external_id": "..."}, opcional "impresora"."""
+        if self.tickets is None:
+            return 404, {"success": False, "error": "Historial de tickets desactivado"}
+        override = str(body.get("impresora") or "")
+
+        def write(printer_name: str, data: bytes) -> None:
+            # El historial guarda el miembro que imprimió: sin impresora indicada se reimprime en su
+            # grupo, que elige un miembro en servicio. Sin acks: no hay job del backend que confirmar.
+            target = printer_name if override else self.router.group_of(printer_name)
+            if {self.breaker.state(member) for member in self.router.members(target)} == {"open"}:
+                raise RuntimeError(f"Impresora fuera de servicio: {target}")
+            self.spool_write(target, data)
+
+        started = time.perf_counter()
+        try:
+            ticket_id = int(body["id"]) if body.get("id") not in (None, "") else None
+            ids = self.tickets.reprint(ticket_id, str(body.get("external_id") or ""), override, write)
+        except (ValueError, TypeError) as error:
+            return 400, {"success": False, "error": str(error)}
+        except LookupError as error:
+            return 404, {"success": False, "error": str(error)}
+        except Exception as error:
+            self.logger.error(f"Error reimprimiendo desde el historial: {error}")
+            return 502, {"success": False, "error": str(error)}
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.logger.info(f"Reimpresión local de ticket(s) {ids} en {elapsed_ms} ms")
+        return 200, {"success": True, "reimpresos": ids, "ms": elapsed_ms}
+
+    def render_job(self, job: Dict[str, Any]) -> list[tuple[str, str, bytes]]:
+        """
+        Devuelve las partes a imprimir como (estaciones, impresora, bytes), una por impresora.
+        Sin routing.json es una sola parte en la impresora por defecto. Cada ticket se renderiza
+        una sola vez y se repite `copies` veces (cada copia con su corte): N copias son una
+        sola escritura y un solo ack. Una edición sin cambios no produce partes.
+        """
+        ticket = self.apply_history(decode_job(job))
+        if ticket is None:
+            return []
+        document: Optional[DocumentPayload] = job.get("document")
+        copies = ticket.format.copies
+        default_printer: Optional[str] = None
+
+        parts: dict[str, tuple[list[str], list[bytes]]] = {}
+        for station, part in self.router.route(ticket):
+            if station is not None:
+                printer_name = station.impresora
+            else:
+                if default_printer is None:
+                    default_printer = self.state.printer_name or autodetect_printer() or get_default_printer_name()
+                    if not default_printer:
+                        raise RuntimeError("No se detectó una impresora instalada en Windows")
+                printer_name = default_printer
+            names, chunks = parts.setdefault(printer_name, ([], []))
+            names.append(station.nombre if station else "caja" if document else "cocina")
+            if document is not None:
+                chunks.append(self.render_document(document, printer_name) * copies)
+            else:
+                chunks.append(self.render_ticket(part, printer_name) * copies)
+
+        return [(", ".join(names), printer_name, b"".join(chunks)) for printer_name, (names, chunks) in parts.items()]
+
+    def spool_write(self, printer_name: str, data: bytes) -> tuple[str, Optional[int]]:
+        """
+        spool_write que alimenta el circuit breaker, a través del grupo si printer_name lo es
+        (PrinterPool). Devuelve (impresora usada, id en la cola).
+        """
+        return self.pool.write(printer_name, data)
+
+
+    def print_parts(self, job: Dict[str, Any], parts: list[tuple[str, str, bytes]]) -> None:
+        """
+        Imprime las partes en paralelo (una escritura por impresora). Las ya impresas quedan en
+        job["printed_parts"] para que un reintento no las duplique; si alguna falla se lanza su error.
+        """
+        printed: set[str] = job.setdefault("printed_parts", set())
+        pending = [part for part in parts if part[1] not in printed]
+        if not pending:
+            return
+        spool_jobs: list[tuple[str, int]] = job.setdefault("spool_jobs", [])
+        if len(pending) == 1:
+            names, printer_name, data = pending[0]
+            member, spool_id = self.spool_write(printer_name, data)
+            printed.add(printer_name)
+            if spool_id:
+                spool_jobs.append((member, spool_id))
+            self.archive_ticket(job, names, member, data)
+            return
+
+        errors: dict[str, Exception] = {}
+
+        def write(names: str, printer_name: str, data: bytes) -> None:
+            try:
+                member, spool_id = self.spool_write(printer_name, data)
+                printed.add(printer_name)
+                if spool_id:
+                    spool_jobs.append((member, spool_id))
+            except Exception as error:
+                errors[printer_name] = error
+                return
+            self.archive_ticket(job, names, member, data)
+
+        threads = [threading.Thread(target=write, args=part, daemon=True) for part in pending]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            # Un spooler colgado manda: el job se reporta sin reintentos.
+            hung = [error for error in errors.values() if isinstance(error, SpoolerTimeoutError)]
+            first = hung[0] if hung else next(iter(errors.values()))
+            stations = ", ".join(names for names, printer_name, _ in pending if printer_name in errors)
+            error_type = SpoolerTimeoutError if hung else RuntimeError
+            raise error_type(f"{first} (estación: {stations})") from first
 
     def process_job(self, job: Dict[str, Any]) -> None:
         job_id = str(job.get("id") or "")
         if not job_id:
             return
 
-        payload = job.get("payload") or {}
-        if not isinstance(payload, dict):
-            payload = {"items": []}
+        parts = self.render_job(job)
+        self.print_parts(job, parts)
+        self.journal.add(job_id)
+        self.finish_external_id(str(job.get("external_id") or ""), printed=True)
+        self.remember_comanda(job)
 
-        width, _paper_width, font_size = resolve_format(payload)
+        if not parts:
+            self.ack(job_id, "done", info="sin cambios")
+            self.logger.info(f"Job sin cambios para imprimir: {job_id}")
+            return
 
-        text = payload.get("raw_text")
-        if not text:
-            text = format_ticket(payload, width=width)
+        details = []
+        copies = decode_job(job).format.copies
+        if copies > 1:
+            details.append(f"{copies} copias")
+        if len(parts) > 1:
+            details.append(" / ".join(names for names, _, _ in parts))
+        suffix = f" ({'; '.join(details)})" if details else ""
+        if job.get("spool_jobs"):
+            # El ack done sale cuando el trabajo termina en el spooler (SpoolTracker)
+            self.spool.track(job_id, job["spool_jobs"], f"ok{suffix}")
+            return
+        self.ack(job_id, "done", info=f"ok{suffix}")
+        self.logger.info(f"Job impreso: {job_id}{suffix}")
 
-        printer_name = self.state.printer_name or autodetect_printer() or get_default_printer_name()
-        if not printer_name:
-            raise RuntimeError("No se detectó una impresora instalada en Windows")
+    def on_spool_done(self, job_id: str, status: str, info: str) -> None:
+        if status == "done":
+            self.ack(job_id, "done", info=info)
+            self.logger.info(f"Job impreso: {job_id} ({info})")
+        else:
+            self.ack(job_id, status, reason=info)
+            self.logger.warning(f"Job {job_id}: {info}")
+
+    def agent_targets(self) -> set[str]:
+        """Destinos del agente (su impresora y las de estaciones); cada uno puede ser un grupo."""
+        printers = {self.state.printer_name} | {station.impresora for station in self.router.load()}
+        return {name for name in printers if name}
+
+    def agent_printers(self) -> set[str]:
+        """Impresoras de Windows a las que escribe el agente (los grupos expandidos en sus miembros)."""
+        return {member for name in self.agent_targets() for member in self.router.members(name)}
+
+    def down_printers(self) -> list[str]:
+        """Destinos con el circuito abierto en todos sus miembros: no se les puede mandar nada."""
+        return sorted(
+            name for name in self.agent_targets()
+            if {self.breaker.state(member) for member in self.router.members(name)} == {"open"}
+        )
 
-        print_bytes(printer_name, escpos_wrap(text, font_size=font_size))
-        self.ack(job_id, "done", info="ok")
-        self.logger.info(f"Job impreso: {job_id}")
+    def on_trial(self) -> bool:
+        """Algún destino sin miembros cerrados depende de una impresora a prueba (half-open)."""
+        for name in self.agent_targets():
+            states = {self.breaker.state(member) for member in self.router.members(name)}
+            if "closed" not in states and "half_open" in states:
+                return True
+        return False
+
+    def spool_headroom(self) -> Optional[int]:
+        """
+        Cuántos trabajos más admite la cola de Windows antes de SPOOL_MAX_DEPTH (el destino más
+        cargado del agente manda; un grupo suma el lugar libre de sus miembros en servicio). None si
+        el límite está desactivado o la cola no se puede consultar.
+        """
+        if SPOOL_MAX_DEPTH <= 0:
+            return None
+        printers = self.agent_printers()
+        self.spool.watch_printers(printers)
+        depths = {}
+        for name in printers:
+            queue = spool_queue(name)
+            if queue is not None:
+                depths[name] = self.spool.depths[name] = len(queue)
+        self.spool_empty = not any(depths.values())
+        room: Dict[str, tuple[int, int]] = {}
+        for target in self.agent_targets():
+            members = [name for name in self.router.members(target) if name in depths]
+            if len(members) > 1:
+                members = [name for name in members if self.breaker.state(name) != "open"] or members
+            if members:
+                room[target] = (
+                    sum(max(SPOOL_MAX_DEPTH - depths[name], 0) for name in members),
+                    min(depths[name] for name in members),
+                )
+        if not room:
+            return None
+        printer_name = min(room, key=lambda name: room[name][0])
+        headroom, depth = room[printer_name]
+        blocked = headroom == 0
+        if blocked != self.spool_blocked:
+            if blocked:
+                self.logger.info(
+                    f"La cola de Windows de {printer_name} tiene {depth} trabajos: "
+                    "no se reclaman jobs nuevos"
+                )
+            else:
+                self.logger.info(f"La cola de Windows bajó a {depth} trabajos: se reanuda la toma de jobs")
+            self.spool_blocked = blocked
+            self.force_heartbeat()
+        return headroom
+
+    def claim_external_id(self, external_id: str) -> str:
+        """
+        Reserva un external_id para imprimirlo.
+        Devuelve "claimed", "printing" (otra vía lo está imprimiendo) o "printed".
+        """
+        if not external_id:
+            return "claimed"
+        with self.external_ids_lock:
+            current = self.recent_external_ids.get(external_id)
+            if current:
+                return current
+            self.recent_external_ids[external_id] = "printing"
+            while len(self.recent_external_ids) > RECENT_EXTERNAL_IDS:
+                self.recent_external_ids.popitem(last=False)
+            return "claimed"
+
+    def finish_external_id(self, external_id: str, printed: bool) -> None:
+        if not external_id:
+            return
+        with self.external_ids_lock:
+            if printed:
+                self.recent_external_ids[external_id] = "printed"
+            else:
+                self.recent_external_ids.pop(external_id, None)
+
+    def reconcile_jobs(self, jobs: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+        """
+        Filtra jobs que no deben imprimirse de nuevo: los del journal local (impresos pero
+        sin ack) y los ya entregados por LAN (por external_id). Ambos se confirman sin
+        imprimir; los que se están imprimiendo por LAN se posponen al siguiente ciclo.
+        """
+        pending: list[Dict[str, Any]] = []
+        for job in jobs:
+            job_id = str(job.get("id") or "")
+            if job_id in self.journal:
+                try:
+                    self.ack(job_id, "done", info="ya impreso")
+                except Exception as error:
+                    self.logger.error(f"No se pudo enviar ack de job ya impreso {job_id}: {error}")
+                continue
+            status = self.claim_external_id(str(job.get("external_id") or ""))
+            if status == "claimed":
+                pending.append(job)
+            elif status == "printing":
+                self.deferred_jobs.append(job)
+            else:
+                try:
+                    self.ack(job_id, "done", info="lan-direct")
+                    self.logger.info(f"Job {job_id} ya impreso por LAN")
+                except Exception as error:
+                    self.logger.error(f"No se pudo enviar ack de job LAN {job_id}: {error}")
+        return pending
+
+    def use_local_id(self, external_id: str, exp: int) -> bool:
+        """
+        Marca el external_id de un token LAN como usado hasta su exp. False si ya se usó: un token
+        capturado no se puede reenviar aunque el external_id ya no esté en recent_external_ids.
+        """
+        now = int(time.time())
+        with self.external_ids_lock:
+            for used_id in [key for key, used_exp in self.used_local_ids.items() if used_exp < now]:
+                del self.used_local_ids[used_id]
+            if external_id in self.used_local_ids:
+                return False
+            self.used_local_ids[external_id] = exp
+            return True
+
+    def print_local_job(self, body: Dict[str, Any]) -> tuple[int, Dict[str, Any]]:
+        """Imprime un job entregado directamente por el frontend en la red local."""
+        external_id = str(body.get("externalId") or "")
+        payload = body.get("payload")
+        if not external_id or not isinstance(payload, dict):
+            return 400, {"success": False, "error": "externalId y payload son requeridos"}
+
+        job_type = str(body.get("type") or "")
+        token = str(body.get("token") or "")
+        if not verify_local_token(self.state.api_key, external_id, body.get("exp"), token, job_type, payload):
+            return 401, {"success": False, "error": "Token inválido o expirado"}
+        if not self.use_local_id(external_id, int(body["exp"])):
+            return 409, {"success": False, "error": "Token ya usado"}
+
+        job = {"external_id": external_id, "type": body.get("type"), "payload": payload}
+        if self.recorder:
+            self.record([dict(job)], "lan")
+        try:
+            decode_job(job)
+        except JobDecodeError as error:
+            return 400, {"success": False, "error": f"payload inválido: {error}"}
+
+        down = self.down_printers()
+        if down:
+            # El frontend no reintenta: la copia en la nube queda pending hasta que la impresora vuelva
+            return 503, {"success": False, "error": f"Impresora fuera de servicio: {', '.join(down)}"}
+
+        if self.claim_external_id(external_id) != "claimed":
+            return 200, {"success": True, "duplicado": True}
+
+        # Hay pedidos: el poll vuelve al ritmo rápido (la copia en la nube llega enseguida)
+        self.note_activity()
+        try:
+            self.print_parts(job, self.render_job(job))
+        except Exception as error:
+            self.finish_external_id(external_id, printed=False)
+            self.logger.error(f"Error imprimiendo job LAN {external_id}: {error}")
+            return 502, {"success": False, "error": str(error)}
+
+        self.finish_external_id(external_id, printed=True)
+        self.remember_comanda(job)
+        self.logger.info(f"Job LAN impreso: {external_id}")
+        return 200, {"success": True}
+
+    def start_local_server(self, port: int = LAN_PORT) -> None:
+        try:
+            self.local_server = start_local_server(self, port, APP_NAME, PROFILE_DIR)
+        except OSError as error:
+            self.logger.warning(f"No se pudo abrir el puerto LAN {port}: {error}")
+            return
+        self.logger.info(f"Impresión directa por LAN escuchando en el puerto {port}")
+
+    def coalesce_jobs(self, jobs: list[Dict[str, Any]], max_jobs: int = COALESCE_MAX_JOBS) -> list[Dict[str, Any]]:
+        """
+        Durante una ráfaga, espera hasta COALESCE_MS por más jobs para imprimirlos juntos.
+        Un job aislado (sin actividad reciente) se devuelve sin esperar. max_jobs limita lo que se
+        reclama (el lugar libre en la cola de Windows o el job de prueba del circuito).
+        """
+        now = time.monotonic()
+        bursting = len(jobs) > 1 or (now - self.last_jobs_at) < POLL_SECONDS * 2
+        self.last_jobs_at = now
+        if not bursting:
+            return jobs
+
+        deadline = now + COALESCE_MS / 1000.0
+        last_batch = len(jobs)
+        while len(jobs) < max_jobs:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Si la última página vino llena hay más esperando: pedir ya; si no, esperar la ventana.
+            if last_batch < JOB_LIMIT:
+                time.sleep(remaining)
+            more = self.fetch_jobs(limit=min(JOB_LIMIT, max_jobs - len(jobs)))
+            if not more:
+                break
+            jobs.extend(more)
+            last_batch = len(more)
+        return jobs
+
+    def process_batch(self, jobs: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+        """
+        Imprime los jobs agrupados por impresora en una sola escritura al spooler
+        (cada ticket con su propio corte) y envía un ack por job.
+        Devuelve los jobs que deben reintentarse de forma individual.
+        """
+        retry: list[Dict[str, Any]] = []
+        groups: dict[str, list[tuple[str, bytes]]] = {}
+        jobs_by_id: dict[str, Dict[str, Any]] = {}
+
+        comandas_en_lote: set[str] = set()
+        for job in jobs:
+            job_id = str(job.get("id") or "")
+            if not job_id:
+                continue
+            try:
+                # Dos ediciones de la misma comanda no se agrupan: la segunda se calcula
+                # contra lo impreso por la primera.
+                comanda_id = decode_job(job).comanda_id
+                if comanda_id and comanda_id in comandas_en_lote:
+                    retry.append(job)
+                    continue
+                if comanda_id:
+                    comandas_en_lote.add(comanda_id)
+                parts = self.render_job(job)
+            except Exception as error:
+                self.logger.error(f"Error preparando job {job_id}: {error}")
+                retry.append(job)
+                continue
+            if len(parts) != 1:
+                # Comanda repartida entre estaciones o sin cambios: se procesa por separado
+                retry.append(job)
+                continue
+            _, printer_name, data = parts[0]
+            jobs_by_id[job_id] = job
+            groups.setdefault(printer_name, []).append((job_id, data))
+
+        def write_chunk(printer_name: str, chunk: list[tuple[str, bytes]]) -> None:
+            try:
+                member, spool_id = self.spool_write(printer_name, b"".join(data for _, data in chunk))
+            except SpoolerTimeoutError as error:
+                self.logger.error(f"Spooler colgado imprimiendo lote en {printer_name}: {error}")
+                for job_id, _ in chunk:
+                    self.finish_external_id(str(jobs_by_id[job_id].get("external_id") or ""), printed=False)
+                    try:
+                        self.ack(job_id, "failed", reason=str(error))
+                    except Exception as ack_error:
+                        self.logger.error(f"No se pudo enviar ack failed: {ack_error}")
+                return
+            except Exception as error:
+                self.logger.error(f"Error imprimiendo lote en {printer_name}: {error}")
+                retry.extend(jobs_by_id[job_id] for job_id, _ in chunk)
+                return
+
+            for job_id, data in chunk:
+                self.journal.add(job_id)
+                self.finish_external_id(str(jobs_by_id[job_id].get("external_id") or ""), printed=True)
+                self.remember_comanda(jobs_by_id[job_id])
+                self.archive_ticket(jobs_by_id[job_id], "", member, data)
+                if spool_id:
+                    self.spool.track(job_id, [(member, spool_id)], "ok")
+                    continue
+                try:
+                    self.ack(job_id, "done", info="ok")
+                except Exception as ack_error:
+                    # Ya está impreso: no reintentar para no duplicar el ticket.
+                    self.logger.error(f"No se pudo enviar ack done de {job_id}: {ack_error}")
+            self.logger.info(f"Lote impreso en {member}: {len(chunk)} job(s)")
+
+        threads: list[threading.Thread] = []
+        for printer_name, entries in groups.items():
+            # Un grupo reparte el lote entre sus miembros en servicio y los escribe en paralelo
+            members = [name for name in self.router.members(printer_name) if self.breaker.state(name) != "open"]
+            per_member = -(-len(entries) // max(len(members), 1))
+            chunk: list[tuple[str, bytes]] = []
+            chunk_size = 0
+            chunks: list[list[tuple[str, bytes]]] = []
+            for job_id, data in entries:
+                if chunk and (chunk_size + len(data) > COALESCE_MAX_BYTES or len(chunk) >= per_member):
+                    chunks.append(chunk)
+                    chunk, chunk_size = [], 0
+                chunk.append((job_id, data))
+                chunk_size += len(data)
+            if chunk:
+                chunks.append(chunk)
+
+            if len(members) > 1:
+                threads += [
+                    threading.Thread(target=write_chunk, args=(printer_name, chunk), daemon=True) for chunk in chunks
+                ]
+                continue
+            for chunk in chunks:
+                write_chunk(printer_name, chunk)
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return retry
+
+    def release_down(self, job: Dict[str, Any]) -> None:
+        """Devuelve a pending un job que no se pudo imprimir porque la impresora está fuera de servicio."""
+        job_id = str(job.get("id") or "")
+        self.finish_external_id(str(job.get("external_id") or ""), printed=False)
+        try:
+            self.release_job(job_id, reason="impresora fuera de servicio")
+        except Exception as error:
+            self.logger.error(f"No se pudo devolver el job {job_id} a la cola: {error}")
 
     def run_forever(self) -> None:
-        backoff = 0
+        backoff = 0.0
         while True:
             try:
                 self.reload_runtime_state()
+                self.breaker.probe()
+                if self.down_printers():
+                    # Impresora caída: los jobs esperan pending en el backend (o los toma el standby)
+                    self.heartbeat()
+                    time.sleep(POLL_SECONDS)
+                    continue
+                headroom = self.spool_headroom()
+                if headroom == 0:
+                    # La impresora no está sacando trabajos: que la cola espere en el backend
+                    # (o la tome un agente de respaldo) en vez de apilarse en Windows.
+                    self.heartbeat()
+                    time.sleep(POLL_SECONDS)
+                    continue
+                # Cuántos jobs pueden ir al spooler en esta vuelta: el lugar libre en la cola de
+                # Windows, o uno solo con el circuito a prueba (decide si la impresora volvió).
+                trial = self.on_trial()
+                cap = 1 if trial else headroom
+                limit = DRAIN_JOB_LIMIT if self.draining else JOB_LIMIT
+                if cap is not None:
+                    # Los diferidos ya están reclamados y ocupan lugar
+                    limit = min(limit, max(cap - len(self.deferred_jobs), 0))
+                fetched = self.fetch_jobs(limit) if limit > 0 else []
+                if (
+                    limit > 0
+                    and self.update_drain(fetched, limit)
+                    and len(fetched) >= limit
+                    and self.spool_empty
+                    and not trial
+                ):
+                    # Completar el primer lote para colapsar versiones y resumir vencidos de una vez
+                    # (solo con la cola de Windows vacía; lo que sobra espera diferido, ver abajo)
+                    fetched += self.fetch_jobs(DRAIN_JOB_LIMIT - len(fetched))
+                jobs = self.deferred_jobs + fetched
+                self.deferred_jobs = []
+                if self.startup_profile:
+                    self.startup_profile.mark("first_poll")
+                    self.startup_profile.report()
+                    self.startup_profile = None
                 self.heartbeat()
-                jobs = self.fetch_jobs()
+                if not self.recovered:
+                    self.recover_processing_jobs()
+                    self.recovered = True
 
                 if not jobs:
-                    backoff = 0
-                    time.sleep(POLL_SECONDS)
+                    backoff = 0.0
+                    if not self.deferred_jobs:
+                        self.wait_next_poll()
                     continue
 
+                if COALESCE_MS > 0:
+                    jobs = self.coalesce_jobs(jobs, COALESCE_MAX_JOBS if cap is None else min(COALESCE_MAX_JOBS, cap))
+
+                jobs = self.reconcile_jobs(jobs)
+                if self.draining:
+                    jobs = self.drain_jobs(jobs)
+                if not jobs:
+                    time.sleep(0.2)
+                    continue
+                if cap is not None and len(jobs) > cap:
+                    # El lote no pasa del lugar libre: el resto queda reclamado (con lease) para la
+                    # próxima vuelta, donde vuelve a pasar por reconcile_jobs.
+                    for job in jobs[cap:]:
+                        self.finish_external_id(str(job.get("external_id") or ""), printed=False)
+                    self.deferred_jobs = jobs[cap:] + self.deferred_jobs
+                    jobs = jobs[:cap]
+
+                if COALESCE_MS > 0:
+                    jobs = self.process_batch(jobs)
+
                 for job in jobs:
+                    if self.down_printers():
+                        self.release_down(job)
+                        continue
                     attempts = 0
                     while True:
                         attempts += 1
@@ -664,7 +2204,16 @@ class Agent:
                             break
                         except Exception as error:
                             self.logger.error(f"Error en job {job.get('id')}: {error}")
-                            if attempts >= 3:
+                            if (
+                                self.down_printers()
+                                and not job.get("printed_parts")
+                                and not isinstance(error, (SpoolerTimeoutError, JobDecodeError))
+                            ):
+                                self.release_down(job)
+                                break
+                            # Un driver colgado o un payload inválido no se reintentan: se reporta y la cola sigue.
+                            if attempts >= 3 or isinstance(error, (SpoolerTimeoutError, JobDecodeError)):
+                                self.finish_external_id(str(job.get("external_id") or ""), printed=False)
                                 try:
                                     self.ack(str(job.get("id")), "failed", reason=str(error))
                                 except Exception as ack_error:
@@ -672,10 +2221,11 @@ class Agent:
                                 break
                             time.sleep(1)
 
-                backoff = 0
+                backoff = 0.0
             except Exception as error:
-                backoff = 1 if backoff == 0 else min(backoff * 2, 60)
-                self.logger.warning(f"Loop error: {error} (reintento en {backoff}s)")
+                # Decorrelated jitter: tras un reinicio del backend los agentes no reintentan al unísono
+                backoff = min(BACKOFF_MAX_SECONDS, random.uniform(BACKOFF_BASE_SECONDS, max(backoff, BACKOFF_BASE_SECONDS) * 3))
+                self.logger.warning(f"Loop error: {error} (reintento en {backoff:.1f}s)")
                 time.sleep(backoff)
 
 
@@ -716,13 +2266,92 @@ def start_background_agent(logger: logging.Logger) -> None:
         logger.warning(f"No se pudo iniciar agente en segundo plano: {error}")
 
 
+def verify_saved_printer(state: AgentState, logger: logging.Logger) -> None:
+    # Si la impresora guardada ya no existe, intentamos autodetectar una nueva.
+    # EnumPrinters puede tardar con impresoras de red: se ejecuta fuera del camino al primer poll.
+    installed = get_installed_printers()
+    if installed and state.printer_name not in installed:
+        detected = autodetect_printer()
+        if detected:
+            logger.info(f"Impresora guardada no encontrada; usando {detected}")
+            state.printer_name = detected
+            save_state(state)
+
+
+def install_profile_signal(agent: Agent) -> None:
+    """SIGUSR2 (o SIGBREAK con consola en Windows) activa/desactiva el perfilado."""
+    import signal
+
+    signum = getattr(signal, "SIGUSR2", None) or getattr(signal, "SIGBREAK", None)
+    if signum is None:
+        return
+    try:
+        signal.signal(signum, lambda *_: threading.Thread(target=agent.profiler.toggle, daemon=True).start())
+    except (ValueError, OSError):
+        pass
+
+
+def ticket_history_cli(args: list[str]) -> int:
+    """
+    Consulta y reimpresión desde la consola, sin la nube ni el agente en marcha:
+
+        printer_agent.py --historial mesa=5 desde=2026-10-19
+        printer_agent.py --reimprimir 123                      # id del historial
+        printer_agent.py --reimprimir <external_id> impresora="EPSON BAR"
+    """
+    options = dict(arg.split("=", 1) for arg in args if "=" in arg and not arg.startswith("--"))
+    values = [arg for arg in args if "=" not in arg and not arg.startswith("--")]
+    if TICKET_HISTORY_MAX_MB <= 0:
+        print("Historial de tickets desactivado (MONTIS_TICKET_HISTORY_MB=0).")
+        return 1
+    history = TicketHistory(TICKET_HISTORY_PATH)
+    try:
+        if "--reimprimir" in args:
+            target = values[0] if values else options.get("id") or options.get("external_id") or ""
+            started = time.perf_counter()
+            ids = history.reprint(
+                int(target) if target.isdigit() else None,
+                "" if target.isdigit() else target,
+                options.get("impresora", ""),
+            )
+            print(f"Reimpreso(s) {ids} en {(time.perf_counter() - started) * 1000:.1f} ms")
+            return 0
+        tickets = history.search(
+            mesa=options.get("mesa", ""),
+            external_id=options.get("external_id", ""),
+            usuario=options.get("usuario", ""),
+            desde=parse_history_time(options.get("desde")),
+            hasta=parse_history_time(options.get("hasta")),
+            limit=int(options.get("limite") or TICKET_HISTORY_LIMIT),
+        )
+    except (ValueError, LookupError) as error:
+        print(error)
+        return 1
+    for ticket in tickets:
+        printed_at = datetime.fromtimestamp(ticket["printed_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        mesa = f"mesa {ticket['mesa']}" if ticket["mesa"] else "-"
+        print(
+            f"#{ticket['id']:<6} {printed_at}  {mesa:<10} {ticket['usuario']:<14} "
+            f"{ticket['impresora']:<20} {ticket['external_id'] or ticket['job_id']}"
+        )
+    if not tickets:
+        print("Sin tickets en el historial local para esos filtros.")
+    return 0
+
+
 def main() -> None:
+    if "--historial" in sys.argv or "--reimprimir" in sys.argv:
+        sys.exit(ticket_history_cli(sys.argv[1:]))
+
     logger = setup_logger()
     logger.info("=== Montis Printer Agent ===")
 
-    background_mode = "--background" in sys.argv
+    profile = StartupProfile(logger) if "--startup-profile" in sys.argv else None
+    background_mode = "--background" in sys.argv or profile is not None
 
     state = load_state()
+    if profile:
+        profile.mark("state_loaded")
 
     if not background_mode:
         state = pair_device(DEFAULT_API_BASE if not state else state.api_base, logger, state)
@@ -739,22 +2368,27 @@ def main() -> None:
         logger.info("No hay estado guardado para ejecutar en segundo plano.")
         return
 
-    register_startup(logger)
+    # Un agente de pruebas (MONTIS_PRINT_TO_DIR) no debe reemplazar el autoinicio del real
+    if not PRINT_TO_DIR:
+        register_startup(logger)
 
     lock = acquire_single_instance_lock()
     if not lock:
         logger.info("Ya existe una instancia en segundo plano ejecutándose.")
         return
 
-    # Si la impresora guardada ya no existe, intentamos autodetectar una nueva
-    installed = get_installed_printers()
-    if installed and state.printer_name not in installed:
-        detected = autodetect_printer()
-        if detected:
-            state.printer_name = detected
-            save_state(state)
+    threading.Thread(target=verify_saved_printer, args=(state, logger), daemon=True).start()
 
     agent = Agent(state, logger)
+    threading.Thread(target=agent.lease_keeper, daemon=True).start()
+    if LAN_PORT:
+        agent.start_local_server()
+    if profile:
+        profile.mark("session_ready")
+        agent.startup_profile = profile
+    if "--profile" in sys.argv:
+        agent.profiler.start()
+    install_profile_signal(agent)
 
     worker = threading.Thread(target=agent.run_forever, daemon=False)
     worker.start()
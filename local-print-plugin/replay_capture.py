@@ -0,0 +1,221 @@
+"""
+Reproduce una captura de jobs (grabada con MONTIS_CAPTURE) para dimensionar equipos por sede.
+
+Los jobs se encolan en el backend de pruebas (fake_backend.py) respetando sus tiempos de llegada,
+acelerados con --speed, y los procesa el Agent real de printer_agent.py. La impresora se simula a
+velocidad física (líneas por segundo + tiempo de corte), así que --speed 10 equivale a 10 veces la
+carga de la captura sobre el mismo hardware.
+
+    python replay_capture.py capture-20261017-195500.jsonl.gz --speed 10
+    python replay_capture.py captura.jsonl.gz --speed 100 --lps 60 --coalesce-ms 150 --json
+    python replay_capture.py captura.jsonl.gz --speed 10 --mm-s 250   # tiempos del emulador ESC/POS
+    python replay_capture.py captura.jsonl.gz --speed 20 --pool 2 --coalesce-ms 150   # grupo de 2 impresoras
+
+Reporta la demora en cola (encolado -> ack) por percentiles, el throughput y la ocupación de la
+impresora. Con --pool N la impresora del agente es un grupo (routing.json "grupos") de N impresoras
+simuladas iguales.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def load_capture(path: str) -> list[Dict[str, Any]]:
+    opener = gzip.open if path.endswith(".gz") else open
+    records = []
+    with opener(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "t" in record:
+                    records.append(record)
+        except EOFError:
+            # Captura de un agente que sigue corriendo (o que se cerró sin terminar el gzip):
+            # todo lo grabado hasta el último flush es legible.
+            pass
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class PrinterSink:
+    """
+    Impresora térmica simulada: una sola cabeza por impresora, tiempo según líneas y cortes o,
+    con mm_per_second, según el papel que ocupa cada ticket en escpos_emulator.
+    """
+
+    def __init__(self, lines_per_second: float, cut_seconds: float, mm_per_second: Optional[float] = None):
+        self.lines_per_second = lines_per_second
+        self.cut_seconds = cut_seconds
+        self.mm_per_second = mm_per_second
+        self.locks: Dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+        self.busy_seconds = 0.0
+        self.bytes = 0
+        self.writes = 0
+
+    def write(self, printer_name: str, data: bytes) -> None:
+        with self.lock:
+            printer_lock = self.locks.setdefault(printer_name, threading.Lock())
+        if self.mm_per_second:
+            from escpos_emulator import print_seconds
+
+            seconds = print_seconds(data, self.mm_per_second)
+        else:
+            lines = data.count(b"\n")
+            cuts = data.count(b"\x1dV")
+            seconds = lines / self.lines_per_second + cuts * self.cut_seconds
+        with printer_lock:
+            time.sleep(seconds)
+        with self.lock:
+            self.busy_seconds += seconds
+            self.bytes += len(data)
+            self.writes += 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay de una captura de jobs contra el agente real")
+    parser.add_argument("capture", help="Archivo .jsonl.gz grabado con MONTIS_CAPTURE")
+    parser.add_argument("--speed", type=float, default=1.0, help="Aceleración de las llegadas (1, 10, 100...)")
+    parser.add_argument("--lps", type=float, default=40.0, help="Líneas por segundo de la impresora simulada")
+    parser.add_argument("--cut", type=float, default=0.3, help="Segundos por corte de papel")
+    parser.add_argument(
+        "--mm-s", type=float, default=None, help="Velocidad en mm/s con el modelo de papel del emulador (ignora --lps)"
+    )
+    parser.add_argument("--coalesce-ms", type=int, default=None, help="MONTIS_COALESCE_MS para el agente")
+    parser.add_argument("--pool", type=int, default=1, help="Impresoras iguales en el grupo del agente")
+    parser.add_argument("--timeout", type=float, default=None, help="Segundos máximos de espera tras el último job")
+    parser.add_argument("--json", action="store_true", help="Imprime el reporte como JSON")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture)
+    if not records:
+        print("La captura no tiene jobs.")
+        sys.exit(1)
+
+    # El agente lee APP_DIR y sus ajustes al importarse: se aísla en un directorio temporal.
+    os.environ["APPDATA"] = tempfile.mkdtemp(prefix="montis-replay-")
+    os.environ["MONTIS_LAN_PORT"] = "0"
+    os.environ.pop("MONTIS_CAPTURE", None)
+    if args.coalesce_ms is not None:
+        os.environ["MONTIS_COALESCE_MS"] = str(args.coalesce_ms)
+
+    import fake_backend
+    import printer_agent
+    import spooler
+    from http.server import ThreadingHTTPServer
+
+    backend = fake_backend.FakeBackend()
+    printer = backend.add_printer("replay", is_default=True)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), fake_backend.FakeBackendHandler)
+    server.backend = backend  # type: ignore[attr-defined]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    sink = PrinterSink(args.lps, args.cut, args.mm_s)
+    spooler.print_bytes = sink.write
+    if args.pool > 1:
+        os.makedirs(printer_agent.APP_DIR, exist_ok=True)
+        with open(printer_agent.ROUTING_PATH, "w", encoding="utf-8") as f:
+            json.dump({"grupos": {"REPLAY": [f"REPLAY {n}" for n in range(1, args.pool + 1)]}}, f)
+
+    logger = logging.getLogger("montis-replay")
+    logger.addHandler(logging.StreamHandler(sys.stderr))
+    logger.setLevel(logging.WARNING)
+    state = printer_agent.AgentState(
+        api_base=f"http://127.0.0.1:{server.server_address[1]}",
+        printer_id=printer["id"],
+        api_key=printer["api_key"],
+        fingerprint="replay",
+        printer_name="REPLAY",
+    )
+    agent = printer_agent.Agent(state, logger)
+    threading.Thread(target=agent.run_forever, daemon=True).start()
+
+    t0 = records[0]["t"]
+    duration = (records[-1]["t"] - t0) / args.speed
+    started = time.time()
+    job_ids: list[str] = []
+    for record in records:
+        delay = started + (record["t"] - t0) / args.speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        payload = record.get("payload") if isinstance(record.get("payload"), dict) else {}
+        job_ids += backend.enqueue(1, printer["id"], payload, str(record.get("type") or "kitchen_ticket"))
+
+    deadline = time.time() + (args.timeout if args.timeout is not None else 120 + duration)
+    pending: Optional[int] = None
+    while time.time() < deadline:
+        with backend.lock:
+            pending = sum(1 for job_id in job_ids if backend.jobs[job_id]["acked_at"] is None)
+        if pending == 0:
+            break
+        time.sleep(0.1)
+
+    with backend.lock:
+        jobs = [dict(backend.jobs[job_id]) for job_id in job_ids]
+    acked = [job for job in jobs if job["acked_at"] is not None]
+    delays = [job["acked_at"] - job["created_at"] for job in acked]
+    wall = (max(job["acked_at"] for job in acked) - started) if acked else time.time() - started
+
+    report = {
+        "jobs": len(jobs),
+        "done": sum(1 for job in jobs if job["status"] == "done"),
+        "failed": sum(1 for job in jobs if job["status"] == "failed"),
+        "sin_ack": len(jobs) - len(acked),
+        "speed": args.speed,
+        "impresoras": max(args.pool, 1),
+        "duracion_llegadas_s": round(duration, 2),
+        "duracion_total_s": round(wall, 2),
+        "throughput_jobs_min": round(len(acked) / wall * 60, 1) if wall > 0 else 0.0,
+        "demora_cola_s": {
+            "p50": round(percentile(delays, 0.50), 2),
+            "p95": round(percentile(delays, 0.95), 2),
+            "p99": round(percentile(delays, 0.99), 2),
+            "max": round(max(delays), 2) if delays else 0.0,
+        },
+        "impresora": {
+            "escrituras": sink.writes,
+            "bytes": sink.bytes,
+            "ocupacion_pct": round(sink.busy_seconds / max(args.pool, 1) / wall * 100, 1) if wall > 0 else 0.0,
+        },
+    }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"Captura: {args.capture} ({report['jobs']} jobs, velocidad {args.speed:g}x, {report['impresoras']} impresora(s))")
+    print(f"  Llegadas en {report['duracion_llegadas_s']} s, todo confirmado en {report['duracion_total_s']} s")
+    print(f"  Resultado: {report['done']} done, {report['failed']} failed, {report['sin_ack']} sin ack")
+    print(f"  Throughput: {report['throughput_jobs_min']} jobs/min")
+    d = report["demora_cola_s"]
+    print(f"  Demora en cola (s): p50 {d['p50']}  p95 {d['p95']}  p99 {d['p99']}  max {d['max']}")
+    p = report["impresora"]
+    print(f"  Impresora: {p['escrituras']} escrituras, {p['bytes']} bytes, ocupación {p['ocupacion_pct']}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,11 +14,65 @@ import tempfile
 import platform
 from datetime import datetime
 
+from ticket_render import (
+    DOCUMENT_TYPES,
+    PROFILES_BY_NAME,
+    JobDecodeError,
+    RenderCache,
+    decode_document,
+    decode_ticket,
+    match_profile,
+    render_document,
+    render_ticket,
+)
+
+# pywin32 (opcional fuera de Windows): driver de cada impresora para elegir su perfil como el agente
+try:
+    import win32print  # type: ignore
+except ImportError:
+    win32print = None
+
 app = Flask(__name__)
 CORS(app)  # Permitir peticiones desde cualquier origen
 
 PORT = 8001
 VERSION = "2.0.0"
+MAX_DOCUMENTOS_LOTE = 20
+MAX_COPIAS = 5
+
+# Tickets estructurados ya renderizados (compartido entre peticiones; RenderCache es thread-safe)
+RENDER_CACHE = RenderCache()
+# Impresora -> descripción del driver ("nombre,driver,ubicación"), consultada una vez
+DRIVERS_IMPRESORAS = {}
+
+
+def driver_impresora(impresora):
+    """Descripción instalada de la impresora (EnumPrinters, igual que el agente); '' si no se conoce."""
+    if impresora not in DRIVERS_IMPRESORAS:
+        descripciones = {}
+        if win32print is not None:
+            try:
+                flags = win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
+                for fila in win32print.EnumPrinters(flags):
+                    if len(fila) >= 3 and fila[2]:
+                        descripciones[str(fila[2])] = str(fila[1] or '')
+            except Exception:
+                pass
+        DRIVERS_IMPRESORAS.update(descripciones)
+        DRIVERS_IMPRESORAS.setdefault(impresora, '')
+    return DRIVERS_IMPRESORAS[impresora]
+
+
+def resolver_perfil(impresora, perfil=None, driver=None):
+    """
+    Perfil de la impresora con las mismas reglas que resolve_profile del agente: "perfil" de la
+    petición o MONTIS_PRINTER_PROFILE si están definidos; si no, patrón en el nombre o el driver
+    (el de la petición o el instalado en Windows).
+    """
+    forzado = str(perfil or os.getenv('MONTIS_PRINTER_PROFILE') or '').strip().lower()
+    if forzado in PROFILES_BY_NAME:
+        return PROFILES_BY_NAME[forzado]
+    return match_profile(impresora, driver if driver is not None else driver_impresora(impresora))
 
 
 def obtener_impresoras():
@@ -61,28 +115,51 @@ def obtener_impresoras():
         return []
 
 
-def imprimir_texto_raw(texto, impresora, cortar=True, encoding='cp850'):
+def construir_buffer(texto, cortar=True, encoding='cp850'):
     """
-    Imprime texto raw en una impresora térmica usando comandos ESC/POS
+    Construye el buffer ESC/POS de un documento (init + página de códigos + texto + corte)
+    """
+    # Comandos ESC/POS estándar
+    ESC_INIT = bytes([0x1B, 0x40])  # ESC @ - Inicializar impresora
+    ESC_CODEPAGE = bytes([0x1B, 0x74, 0x02])  # ESC t 2 - Página de códigos CP850
+    GS_CUT = bytes([0x1D, 0x56, 0x00])  # GS V 0 - Cortar papel
+
+    # Convertir texto a bytes con el encoding especificado
+    texto_bytes = texto.encode(encoding, errors='replace')
+
+    # Agregar saltos de línea antes del corte
+    feed_lines = b'\n\n\n\n'
+
+    # Construir buffer final
+    buffer_final = ESC_INIT + ESC_CODEPAGE + texto_bytes + feed_lines
+
+    if cortar:
+        buffer_final += GS_CUT
+
+    return buffer_final
+
+
+def construir_buffer_ticket(payload, impresora, perfil=None, tipo=None, driver=None):
+    """
+    Renderiza un payload de comanda (el mismo que consume printer_agent.py) con ticket_render.
+    Devuelve (bytes de una copia, copias del formato). Lanza JobDecodeError si el payload es inválido.
+    perfil fuerza un perfil de impresora; si no, se detecta por el nombre y el driver como en el
+    agente (driver opcional; por defecto el instalado en Windows).
+    tipo "receipt", "invoice" o "cash_close" renderiza el documento de caja en lugar de la comanda.
+    """
+    profile = resolver_perfil(impresora, perfil, driver)
+    if tipo in DOCUMENT_TYPES:
+        documento = decode_document(tipo, payload)
+        return render_document(documento, profile, RENDER_CACHE), documento.format.copies
+    ticket = decode_ticket(payload)
+    return render_ticket(ticket, profile, RENDER_CACHE), ticket.format.copies
+
+
+def enviar_a_impresora(buffer_final, impresora):
+    """
+    Envía un buffer raw a la impresora como un único documento del spooler (copy /b)
     """
     try:
-        # Comandos ESC/POS estándar
-        ESC_INIT = bytes([0x1B, 0x40])  # ESC @ - Inicializar impresora
-        ESC_CODEPAGE = bytes([0x1B, 0x74, 0x02])  # ESC t 2 - Página de códigos CP850
-        GS_CUT = bytes([0x1D, 0x56, 0x00])  # GS V 0 - Cortar papel
-        
-        # Convertir texto a bytes con el encoding especificado
-        texto_bytes = texto.encode(encoding, errors='replace')
-        
-        # Agregar saltos de línea antes del corte
-        feed_lines = b'\n\n\n\n'
-        
-        # Construir buffer final
-        buffer_final = ESC_INIT + ESC_CODEPAGE + texto_bytes + feed_lines
-        
-        if cortar:
-            buffer_final += GS_CUT
-        
         # Crear archivo temporal
         with tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix='.bin') as temp_file:
             temp_file.write(buffer_final)
@@ -121,6 +198,132 @@ def imprimir_texto_raw(texto, impresora, cortar=True, encoding='cp850'):
         raise Exception(f"Error durante impresión: {str(e)}")
 
 
+def imprimir_texto_raw(texto, impresora, cortar=True, encoding='cp850'):
+    """
+    Imprime texto raw en una impresora térmica usando comandos ESC/POS
+    """
+    try:
+        buffer_final = construir_buffer(texto, cortar, encoding)
+    except LookupError as e:
+        raise Exception(f"Error durante impresión: encoding no soportado ({e})")
+    return enviar_a_impresora(buffer_final, impresora)
+
+
+def validar_documento(doc):
+    """
+    Valida los tipos de un documento de impresión antes de construir el buffer.
+    Devuelve el mensaje de error o None si el documento es válido.
+    """
+    texto = doc.get('texto')
+    payload = doc.get('payload')
+    impresora = doc.get('impresora')
+    if (not texto and payload is None) or not impresora:
+        return 'Faltan parámetros requeridos: texto o payload, impresora'
+    if not isinstance(impresora, str):
+        return 'impresora debe ser texto'
+    if payload is None and not isinstance(texto, str):
+        return 'texto debe ser texto'
+    if payload is not None and not isinstance(payload, dict):
+        return 'payload debe ser un objeto'
+    for campo in ('perfil', 'tipo', 'driver', 'encoding'):
+        if doc.get(campo) is not None and not isinstance(doc[campo], str):
+            return f'{campo} debe ser texto'
+    return None
+
+
+def imprimir_lote(documentos):
+    """
+    Imprime varios documentos agrupando por impresora.
+    Los documentos de una misma impresora se envían como un solo trabajo del
+    spooler (cada uno con su propio init y corte). Devuelve un resultado por documento.
+    """
+    resultados = [None] * len(documentos)
+    grupos = {}
+
+    for indice, doc in enumerate(documentos):
+        if not isinstance(doc, dict):
+            resultados[indice] = {'indice': indice, 'success': False, 'error': 'Documento inválido'}
+            continue
+
+        texto = doc.get('texto')
+        payload = doc.get('payload')
+        impresora = doc.get('impresora')
+        error = validar_documento(doc)
+        if error:
+            resultados[indice] = {
+                'indice': indice,
+                'impresora': impresora if isinstance(impresora, str) else None,
+                'success': False,
+                'error': error
+            }
+            continue
+
+        copias_formato = 1
+        try:
+            if payload is not None:
+                buffer_doc, copias_formato = construir_buffer_ticket(
+                    payload, impresora, doc.get('perfil'), doc.get('tipo'), doc.get('driver')
+                )
+            else:
+                buffer_doc = construir_buffer(texto, doc.get('cortar', True), doc.get('encoding', 'cp850'))
+        except LookupError as e:
+            resultados[indice] = {
+                'indice': indice,
+                'impresora': impresora,
+                'success': False,
+                'error': f'Encoding no soportado: {e}'
+            }
+            continue
+        except JobDecodeError as e:
+            resultados[indice] = {
+                'indice': indice,
+                'impresora': impresora,
+                'success': False,
+                'error': f'Payload inválido: {e}'
+            }
+            continue
+        except (TypeError, ValueError, AttributeError) as e:
+            resultados[indice] = {
+                'indice': indice,
+                'impresora': impresora,
+                'success': False,
+                'error': f'Documento inválido: {e}'
+            }
+            continue
+
+        try:
+            copias = int(doc.get('copias', copias_formato))
+        except (TypeError, ValueError):
+            copias = 0
+        if copias < 1 or copias > MAX_COPIAS:
+            resultados[indice] = {
+                'indice': indice,
+                'impresora': impresora,
+                'success': False,
+                'error': f'copias debe estar entre 1 y {MAX_COPIAS}'
+            }
+            continue
+
+        grupos.setdefault(impresora, []).append((indice, buffer_doc * copias, copias))
+
+    for impresora, docs in grupos.items():
+        buffer_grupo = b''.join(buffer_doc for _, buffer_doc, _ in docs)
+        print(f"🖨️  Lote para {impresora}: {len(docs)} documento(s), {len(buffer_grupo)} bytes")
+        try:
+            enviar_a_impresora(buffer_grupo, impresora)
+            error = None
+        except Exception as e:
+            error = str(e)
+
+        for indice, _, copias in docs:
+            resultado = {'indice': indice, 'impresora': impresora, 'success': error is None, 'copias': copias}
+            if error:
+                resultado['error'] = error
+            resultados[indice] = resultado
+
+    return resultados
+
+
 # ========================
 # RUTAS / ENDPOINTS
 # ========================
@@ -158,25 +361,49 @@ def listar_impresoras():
 
 @app.route('/imprimir', methods=['POST'])
 def imprimir():
-    """Endpoint para enviar impresión a una impresora térmica"""
+    """
+    Endpoint para enviar impresión a una impresora térmica.
+    Acepta texto ya formateado ("texto") o el payload estructurado de la comanda ("payload"),
+    que se renderiza con ticket_render igual que en el agente remoto. Con "tipo" (receipt,
+    invoice, cash_close) el payload es un documento de caja.
+    """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({
+                'success': False,
+                'error': 'El cuerpo debe ser un objeto JSON'
+            }), 400
         
         texto = data.get('texto')
+        payload = data.get('payload')
         impresora = data.get('impresora')
         cortar = data.get('cortar', True)
         encoding = data.get('encoding', 'cp850')
         
-        if not texto or not impresora:
+        error = validar_documento(data)
+        if error:
             return jsonify({
                 'success': False,
-                'error': 'Faltan parámetros requeridos: texto, impresora'
+                'error': error
             }), 400
         
         print(f"🖨️  Solicitud de impresión para: {impresora}")
         
-        # Ejecutar impresión
-        imprimir_texto_raw(texto, impresora, cortar, encoding)
+        if payload is not None:
+            try:
+                buffer_ticket, copias = construir_buffer_ticket(
+                    payload, impresora, data.get('perfil'), data.get('tipo'), data.get('driver')
+                )
+            except JobDecodeError as e:
+                return jsonify({
+                    'success': False,
+                    'error': f'Payload inválido: {e}'
+                }), 400
+            enviar_a_impresora(buffer_ticket * copias, impresora)
+        else:
+            # Ejecutar impresión
+            imprimir_texto_raw(texto, impresora, cortar, encoding)
         
         return jsonify({
             'success': True,
@@ -191,6 +418,52 @@ def imprimir():
         }), 500
 
 
+@app.route('/imprimir/lote', methods=['POST'])
+def imprimir_lote_endpoint():
+    """Endpoint para imprimir varios documentos en una sola petición"""
+    try:
+        data = request.get_json(silent=True) or {}
+        documentos = data.get('documentos')
+
+        if not isinstance(documentos, list) or not documentos:
+            return jsonify({
+                'success': False,
+                'error': 'Falta parámetro requerido: documentos (lista)'
+            }), 400
+
+        if len(documentos) > MAX_DOCUMENTOS_LOTE:
+            return jsonify({
+                'success': False,
+                'error': f'Máximo {MAX_DOCUMENTOS_LOTE} documentos por lote'
+            }), 400
+
+        print(f"🖨️  Solicitud de lote: {len(documentos)} documento(s)")
+
+        resultados = imprimir_lote(documentos)
+        impresos = sum(1 for r in resultados if r['success'])
+
+        if impresos == len(resultados):
+            codigo = 200
+        elif impresos > 0:
+            codigo = 207
+        else:
+            codigo = 500
+
+        return jsonify({
+            'success': impresos == len(resultados),
+            'resultados': resultados,
+            'total': len(resultados),
+            'impresos': impresos
+        }), codigo
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/probar', methods=['POST'])
 def probar():
     """Endpoint de prueba de conexión"""
@@ -240,6 +513,7 @@ def home():
             'status': '/status',
             'impresoras': '/impresoras [GET]',
             'imprimir': '/imprimir [POST]',
+            'imprimir_lote': '/imprimir/lote [POST]',
             'probar': '/probar [POST]'
         }
     })
@@ -256,6 +530,7 @@ def main():
     print(f"  - http://localhost:{PORT}/status")
     print(f"  - http://localhost:{PORT}/impresoras")
     print(f"  - http://localhost:{PORT}/imprimir")
+    print(f"  - http://localhost:{PORT}/imprimir/lote")
     print("=" * 60)
     print("Presione Ctrl+C para detener el servicio")
     print("=" * 60)
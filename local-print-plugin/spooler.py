@@ -0,0 +1,490 @@
+"""
+Cola de impresión de Windows del agente: escritura RAW al spooler con plazo máximo, consulta y
+borrado de trabajos en cola, estado del dispositivo, seguimiento de los trabajos entregados
+(SpoolTracker) y circuit breaker por impresora (PrinterBreaker).
+
+Lo usa printer_agent.py. Sin Windows se prueba con MONTIS_PRINT_TO_DIR, MONTIS_FAKE_SPOOLER
+(fake_spooler.py) o MONTIS_ESCPOS_EMULATOR (escpos_emulator.py).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+# win32print es una DLL liviana y se usa desde el inicio (printer_agent.py la reutiliza).
+try:
+    import win32print  # type: ignore
+except Exception:
+    win32print = None
+
+# Pruebas sin impresora física: win32print emulado (escpos_emulator.py), tickets en ese directorio
+ESCPOS_EMULATOR_DIR = os.getenv("MONTIS_ESCPOS_EMULATOR") or ""
+if ESCPOS_EMULATOR_DIR:
+    from escpos_emulator import install_win32print
+
+    win32print = install_win32print(ESCPOS_EMULATOR_DIR)
+
+# Plazo máximo de una escritura al spooler (driver USB colgado en WritePrinter/EndDocPrinter)
+PRINT_DEADLINE_SECONDS = float(os.getenv("MONTIS_PRINT_DEADLINE", "20") or 20)
+MAX_HUNG_SPOOLER_CALLS = 3
+# Cola de Windows: el ack done se envía cuando el trabajo sale del spooler (no al entregarlo) y
+# no se reclaman jobs nuevos mientras la impresora tenga SPOOL_MAX_DEPTH o más trabajos en cola.
+SPOOL_MAX_DEPTH = int(os.getenv("MONTIS_SPOOL_MAX_DEPTH", "5") or 0)
+SPOOL_POLL_SECONDS = 1.0
+# Tras este plazo sin salir de la cola se confirma igual (saldrá al reanudar la impresora)
+SPOOL_CONFIRM_TIMEOUT_SECONDS = 600
+# Pruebas sin Windows: directorio del spooler simulado (fake_spooler.py)
+FAKE_SPOOLER_DIR = os.getenv("MONTIS_FAKE_SPOOLER") or ""
+# Pruebas sin impresora: los bytes ESC/POS se escriben como archivos en este directorio.
+PRINT_TO_DIR = os.getenv("MONTIS_PRINT_TO_DIR") or ""
+# JOB_STATUS_* de winspool.h
+JOB_STATUS_PAUSED = 0x1
+JOB_STATUS_ERROR = 0x2
+JOB_STATUS_DELETING = 0x4
+JOB_STATUS_OFFLINE = 0x20
+JOB_STATUS_PAPEROUT = 0x40
+JOB_STATUS_PRINTED = 0x80
+JOB_STATUS_DELETED = 0x100
+JOB_STATUS_BLOCKED = 0x200
+JOB_STATUS_USER_INTERVENTION = 0x400
+JOB_STATUS_COMPLETE = 0x1000
+JOB_STATUS_STUCK = (
+    JOB_STATUS_PAUSED | JOB_STATUS_ERROR | JOB_STATUS_OFFLINE | JOB_STATUS_PAPEROUT
+    | JOB_STATUS_BLOCKED | JOB_STATUS_USER_INTERVENTION
+)
+# PRINTER_STATUS_* / PRINTER_ATTRIBUTE_* de winspool.h (GetPrinter nivel 2)
+PRINTER_STATUS_DOWN = {
+    0x2: "con error",
+    0x10: "sin papel",
+    0x80: "fuera de línea",
+    0x1000: "no disponible",
+    0x400000: "tapa abierta",
+}
+PRINTER_ATTRIBUTE_WORK_OFFLINE = 0x400
+JOB_CONTROL_DELETE = 5
+# Circuit breaker por impresora: tras BREAKER_FAILURES escrituras fallidas seguidas se dejan de
+# reclamar jobs (quedan pending en el backend) y se prueba el dispositivo cada BREAKER_PROBE_SECONDS.
+# 0 desactiva el breaker (cada job se reintenta 3 veces y se reporta failed).
+BREAKER_FAILURES = int(os.getenv("MONTIS_BREAKER_FAILURES", "3") or 0)
+BREAKER_PROBE_SECONDS = float(os.getenv("MONTIS_BREAKER_PROBE", "10") or 10)
+# Grupos de impresoras (routing.json "grupos"): un miembro con la cola trabada más de
+# POOL_FAILOVER_SECONDS sale del grupo y sus trabajos pendientes pasan a otro miembro.
+POOL_FAILOVER_SECONDS = float(os.getenv("MONTIS_POOL_FAILOVER", "8") or 8)
+
+
+_fake_spooler: Any = None
+_fake_spooler_lock = threading.Lock()
+
+
+def fake_spooler() -> Any:
+    global _fake_spooler
+    with _fake_spooler_lock:
+        if _fake_spooler is None:
+            from fake_spooler import FakeSpooler
+
+            _fake_spooler = FakeSpooler(FAKE_SPOOLER_DIR, output_dir=PRINT_TO_DIR or None)
+        return _fake_spooler
+
+
+def print_bytes(printer_name: str, data: bytes) -> Optional[int]:
+    """Envía los bytes al spooler. Devuelve el id del trabajo en la cola de Windows (None si no hay cola)."""
+    if FAKE_SPOOLER_DIR:
+        return fake_spooler().submit(printer_name, data)
+
+    if PRINT_TO_DIR:
+        os.makedirs(PRINT_TO_DIR, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in printer_name)
+        with open(os.path.join(PRINT_TO_DIR, f"{time.time_ns()}-{safe_name}.bin"), "wb") as f:
+            f.write(data)
+        return None
+
+    if win32print is None:
+        raise RuntimeError("pywin32 no disponible")
+
+    handle = win32print.OpenPrinter(printer_name)
+    try:
+        spool_job_id = win32print.StartDocPrinter(handle, 1, ("Montis Kitchen Ticket", None, "RAW"))
+        try:
+            win32print.StartPagePrinter(handle)
+            win32print.WritePrinter(handle, data)
+            win32print.EndPagePrinter(handle)
+        finally:
+            win32print.EndDocPrinter(handle)
+    finally:
+        win32print.ClosePrinter(handle)
+    return int(spool_job_id) if spool_job_id else None
+
+
+def spool_queue(printer_name: str) -> Optional[list[tuple[int, int]]]:
+    """Trabajos en la cola de Windows de la impresora como (id, JOB_STATUS_*); None si no se puede consultar."""
+    if FAKE_SPOOLER_DIR:
+        return fake_spooler().enum_jobs(printer_name)
+    if win32print is None or PRINT_TO_DIR or not printer_name:
+        return None
+    try:
+        handle = win32print.OpenPrinter(printer_name)
+    except Exception:
+        return None
+    try:
+        return [(int(job["JobId"]), int(job.get("Status") or 0)) for job in win32print.EnumJobs(handle, 0, 999, 1)]
+    except Exception:
+        return None
+    finally:
+        win32print.ClosePrinter(handle)
+
+
+def spool_cancel(printer_name: str, spool_id: int) -> bool:
+    """Borra un trabajo de la cola de Windows (JOB_CONTROL_DELETE). False si no se pudo."""
+    if FAKE_SPOOLER_DIR:
+        return fake_spooler().cancel(printer_name, spool_id)
+    if win32print is None or PRINT_TO_DIR or not printer_name:
+        return False
+    try:
+        handle = win32print.OpenPrinter(printer_name)
+    except Exception:
+        return False
+    try:
+        win32print.SetJob(handle, spool_id, 0, None, JOB_CONTROL_DELETE)
+        return True
+    except Exception:
+        return False
+    finally:
+        win32print.ClosePrinter(handle)
+
+
+def spool_status_text(status: int) -> str:
+    if status & JOB_STATUS_PAPEROUT:
+        return "sin papel"
+    if status & JOB_STATUS_OFFLINE:
+        return "fuera de línea"
+    if status & (JOB_STATUS_ERROR | JOB_STATUS_USER_INTERVENTION | JOB_STATUS_BLOCKED):
+        return "con error"
+    if status & JOB_STATUS_PAUSED:
+        return "en pausa"
+    return "en cola"
+
+
+def probe_printer(printer_name: str) -> Optional[str]:
+    """
+    Consulta el estado del dispositivo sin imprimir. Devuelve el motivo por el que no puede
+    imprimir, o None si responde (o si no hay forma de consultarlo: la prueba es el siguiente job).
+    """
+    if hung_spooler_calls(printer_name) >= MAX_HUNG_SPOOLER_CALLS:
+        return "spooler sin respuesta"
+    if FAKE_SPOOLER_DIR:
+        return "en pausa" if fake_spooler().paused(printer_name) else None
+    if win32print is None or PRINT_TO_DIR or not printer_name:
+        return None
+    try:
+        handle = win32print.OpenPrinter(printer_name)
+    except Exception as error:
+        return f"no se pudo abrir: {error}"
+    try:
+        info = win32print.GetPrinter(handle, 2)
+    except Exception as error:
+        return f"sin estado: {error}"
+    finally:
+        win32print.ClosePrinter(handle)
+    status = int(info.get("Status") or 0)
+    if int(info.get("Attributes") or 0) & PRINTER_ATTRIBUTE_WORK_OFFLINE:
+        return "fuera de línea"
+    return next((text for flag, text in PRINTER_STATUS_DOWN.items() if status & flag), None)
+
+
+class SpoolerTimeoutError(RuntimeError):
+    """La escritura al spooler no terminó dentro del plazo; el hilo quedó abandonado."""
+
+
+class SpoolCancelledError(RuntimeError):
+    """on_stuck borró el trabajo trabado de la cola pero no pudo reenviarlo: no se imprimió."""
+
+
+_hung_spooler_threads: dict[str, list[threading.Thread]] = {}
+_hung_spooler_lock = threading.Lock()
+
+
+def hung_spooler_calls(printer_name: Optional[str] = None) -> int:
+    """Cantidad de llamadas al spooler abandonadas que siguen colgadas en el driver."""
+    with _hung_spooler_lock:
+        for name in list(_hung_spooler_threads):
+            _hung_spooler_threads[name] = [t for t in _hung_spooler_threads[name] if t.is_alive()]
+            if not _hung_spooler_threads[name]:
+                del _hung_spooler_threads[name]
+        if printer_name is not None:
+            return len(_hung_spooler_threads.get(printer_name, []))
+        return sum(len(threads) for threads in _hung_spooler_threads.values())
+
+
+def spool_write(printer_name: str, data: bytes, deadline: float = PRINT_DEADLINE_SECONDS) -> Optional[int]:
+    """
+    Ejecuta print_bytes en un hilo propio con plazo máximo.
+    Si el driver no responde a tiempo el hilo se abandona (no se puede interrumpir una
+    llamada nativa) y se lanza SpoolerTimeoutError; la siguiente escritura usa un hilo nuevo.
+    """
+    if hung_spooler_calls(printer_name) >= MAX_HUNG_SPOOLER_CALLS:
+        raise SpoolerTimeoutError(f"Spooler de {printer_name} sin respuesta ({MAX_HUNG_SPOOLER_CALLS} llamadas colgadas)")
+
+    result: Dict[str, Any] = {}
+
+    def run() -> None:
+        try:
+            result["job_id"] = print_bytes(printer_name, data)
+        except BaseException as error:
+            result["error"] = error
+
+    thread = threading.Thread(target=run, name=f"spooler-{printer_name}", daemon=True)
+    thread.start()
+    thread.join(deadline)
+    if thread.is_alive():
+        with _hung_spooler_lock:
+            _hung_spooler_threads.setdefault(printer_name, []).append(thread)
+        raise SpoolerTimeoutError(
+            f"El spooler de {printer_name} no respondió en {deadline:g}s (el ticket podría salir tarde)"
+        )
+    if "error" in result:
+        raise result["error"]
+    return result.get("job_id")
+
+
+class SpoolTracker:
+    """
+    Sigue en segundo plano los trabajos entregados al spooler de Windows: el job se confirma
+    (on_done) recién cuando su trabajo sale de la cola, sin bloquear al worker. También mide la
+    profundidad de cola de cada impresora para el backpressure del agente. Si una impresora queda
+    trabada POOL_FAILOVER_SECONDS, on_stuck puede mover sus trabajos a otra (grupos); si los borra
+    sin poder reenviarlos lanza SpoolCancelledError y el job se confirma failed.
+    """
+
+    def __init__(
+        self,
+        on_done: Callable[[str, str, str], None],
+        logger: logging.Logger,
+        on_stuck: Optional[Callable[[str, tuple[str, int]], Optional[list[tuple[str, int]]]]] = None,
+    ):
+        self.on_done = on_done
+        self.on_stuck = on_stuck
+        self.logger = logger
+        self.lock = threading.Lock()
+        # job_id -> {"spool": {(impresora, id en la cola): último estado}, "info", "since", "warned"}
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.depths: Dict[str, int] = {}
+        # impresora -> monotonic desde que tiene trabajos trabados
+        self.stuck_since: Dict[str, float] = {}
+        self.printers: set[str] = set()
+        self.thread: Optional[threading.Thread] = None
+
+    def ensure_running(self) -> None:
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="spool-tracker", daemon=True)
+                self.thread.start()
+
+    def watch_printers(self, printers: set[str]) -> None:
+        with self.lock:
+            self.printers = {name for name in printers if name}
+        self.ensure_running()
+
+    def track(self, job_id: str, spool_jobs: list[tuple[str, int]], info: str) -> None:
+        with self.lock:
+            self.pending[job_id] = {
+                "spool": {key: 0 for key in spool_jobs},
+                "info": info,
+                "since": time.monotonic(),
+                "warned": False,
+            }
+        self.ensure_running()
+
+    def depth(self, printer_name: str) -> int:
+        return self.depths.get(printer_name, 0)
+
+    def run(self) -> None:
+        while True:
+            time.sleep(SPOOL_POLL_SECONDS)
+            try:
+                self.poll()
+            except Exception as error:
+                self.logger.warning(f"No se pudo revisar la cola de Windows: {error}")
+
+    def poll(self) -> None:
+        with self.lock:
+            printers = set(self.printers)
+            for entry in self.pending.values():
+                printers.update(printer_name for printer_name, _ in entry["spool"])
+            entries = list(self.pending.items())
+        queues = {printer_name: spool_queue(printer_name) for printer_name in printers}
+        now = time.monotonic()
+        for printer_name, queue in queues.items():
+            if queue is not None:
+                self.depths[printer_name] = len(queue)
+            if queue and any(status & JOB_STATUS_STUCK for _, status in queue):
+                self.stuck_since.setdefault(printer_name, now)
+            else:
+                self.stuck_since.pop(printer_name, None)
+
+        for job_id, entry in entries:
+            result = self.check(job_id, entry, queues, now)
+            if result is None:
+                continue
+            try:
+                self.on_done(job_id, *result)
+            except Exception as error:
+                # Queda pendiente y se reintenta en la próxima vuelta
+                self.logger.error(f"No se pudo confirmar job {job_id}: {error}")
+                continue
+            with self.lock:
+                self.pending.pop(job_id, None)
+
+    def check(
+        self, job_id: str, entry: Dict[str, Any], queues: Dict[str, Optional[list[tuple[int, int]]]], now: float
+    ) -> Optional[tuple[str, str]]:
+        """("done" | "failed", info) cuando el job terminó en el spooler; None si sigue en cola."""
+        remaining: Dict[tuple[str, int], int] = {}
+        cancelled = False
+        for key, last_status in entry["spool"].items():
+            printer_name, spool_id = key
+            queue = queues.get(printer_name)
+            if queue is None:
+                # Cola no consultable: se da por impreso, como al entregarlo al spooler
+                continue
+            status = dict(queue).get(spool_id)
+            if status is None or status & (JOB_STATUS_PRINTED | JOB_STATUS_COMPLETE):
+                if last_status & (JOB_STATUS_DELETING | JOB_STATUS_DELETED):
+                    cancelled = True
+                continue
+            since = self.stuck_since.get(printer_name)
+            if self.on_stuck and since is not None and now - since >= POOL_FAILOVER_SECONDS:
+                try:
+                    moved = self.on_stuck(job_id, key)
+                except SpoolCancelledError:
+                    cancelled = True
+                    continue
+                if moved is not None:
+                    remaining.update((new_key, 0) for new_key in moved)
+                    continue
+            remaining[key] = status
+            if status & JOB_STATUS_STUCK and not entry["warned"]:
+                entry["warned"] = True
+                self.logger.warning(
+                    f"Job {job_id}: {printer_name} {spool_status_text(status)}; se confirma cuando salga de la cola"
+                )
+        entry["spool"] = remaining
+        if cancelled:
+            return "failed", "cancelado en la cola de Windows"
+        if not remaining:
+            return "done", entry["info"]
+        if now - entry["since"] > SPOOL_CONFIRM_TIMEOUT_SECONDS:
+            return "done", f"{entry['info']} (sin confirmación del spooler)"
+        return None
+
+
+class PrinterBreaker:
+    """
+    Circuit breaker por impresora. closed: se imprime normal. open: tras BREAKER_FAILURES
+    escrituras fallidas seguidas; el agente no reclama jobs y prueba el dispositivo cada
+    BREAKER_PROBE_SECONDS. half_open: la prueba respondió y el próximo job decide (éxito cierra,
+    falla reabre).
+    """
+
+    def __init__(self, logger: logging.Logger, on_change: Optional[Callable[[], None]] = None):
+        self.logger = logger
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        # impresora -> {"state", "failures", "error", "since", "probed"}
+        self.printers: Dict[str, Dict[str, Any]] = {}
+
+    def entry(self, printer_name: str) -> Dict[str, Any]:
+        return self.printers.setdefault(
+            printer_name, {"state": "closed", "failures": 0, "error": "", "since": 0.0, "probed": 0.0}
+        )
+
+    def state(self, printer_name: str) -> str:
+        with self.lock:
+            entry = self.printers.get(printer_name)
+            return entry["state"] if entry else "closed"
+
+    def record_success(self, printer_name: str) -> None:
+        with self.lock:
+            entry = self.printers.get(printer_name)
+            if entry is None or (entry["state"] == "closed" and not entry["failures"]):
+                return
+            reopened = entry["state"] != "closed"
+            self.printers[printer_name] = {**entry, "state": "closed", "failures": 0, "error": ""}
+        if reopened:
+            self.logger.info(f"Impresora {printer_name} de nuevo en servicio: se reanuda la cola")
+            self.changed()
+
+    def record_failure(self, printer_name: str, error: Exception) -> None:
+        if BREAKER_FAILURES <= 0:
+            return
+        with self.lock:
+            entry = self.entry(printer_name)
+            entry["failures"] += 1
+            entry["error"] = str(error)
+            trip = entry["state"] == "half_open" or (
+                entry["state"] == "closed" and entry["failures"] >= BREAKER_FAILURES
+            )
+            if trip:
+                entry.update(state="open", since=time.time(), probed=time.monotonic())
+        if trip:
+            self.logger.warning(
+                f"Impresora {printer_name} fuera de servicio ({error}): no se le envían trabajos "
+                f"y se prueba cada {BREAKER_PROBE_SECONDS:g}s"
+            )
+            self.changed()
+
+    def trip(self, printer_name: str, reason: str) -> None:
+        """Abre el circuito sin esperar BREAKER_FAILURES (impresora de un grupo con la cola trabada)."""
+        with self.lock:
+            entry = self.entry(printer_name)
+            tripped = entry["state"] != "open"
+            entry["error"] = reason
+            if tripped:
+                entry.update(state="open", since=time.time(), probed=time.monotonic())
+        if tripped:
+            self.logger.warning(f"Impresora {printer_name} fuera del grupo ({reason}): se prueba cada {BREAKER_PROBE_SECONDS:g}s")
+            self.changed()
+
+    def probe(self) -> None:
+        """Prueba las impresoras abiertas cuya última prueba tiene más de BREAKER_PROBE_SECONDS."""
+        now = time.monotonic()
+        with self.lock:
+            due = [
+                name for name, entry in self.printers.items()
+                if entry["state"] == "open" and now - entry["probed"] >= BREAKER_PROBE_SECONDS
+            ]
+            for name in due:
+                self.printers[name]["probed"] = now
+        for name in due:
+            reason = probe_printer(name)
+            with self.lock:
+                entry = self.printers[name]
+                if entry["state"] != "open":
+                    continue
+                if reason:
+                    entry["error"] = reason
+                    continue
+                entry["state"] = "half_open"
+            self.logger.info(f"Impresora {name} responde: se prueba con el próximo job")
+            self.changed()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Impresoras con el circuito no cerrado, para el heartbeat."""
+        with self.lock:
+            return {
+                name: {
+                    "state": entry["state"],
+                    "error": entry["error"],
+                    "since": datetime.fromtimestamp(entry["since"], timezone.utc).isoformat(),
+                }
+                for name, entry in self.printers.items()
+                if entry["state"] != "closed"
+            }
+
+    def changed(self) -> None:
+        if self.on_change:
+            self.on_change()
@@ -0,0 +1,292 @@
+"""
+Ruteo del agente según routing.json: reparto de los ítems de una comanda entre estaciones
+(StationRouter) y grupos de impresoras iguales con balanceo y failover (PrinterPool).
+
+Lo usa printer_agent.py.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Dict, Optional
+
+from spooler import (
+    MAX_HUNG_SPOOLER_CALLS,
+    PrinterBreaker,
+    SpoolCancelledError,
+    SpoolerTimeoutError,
+    hung_spooler_calls,
+    spool_cancel,
+    spool_queue,
+    spool_write,
+)
+from ticket_render import TicketItem, TicketPayload
+
+# Trabajos recientes de grupos que se conservan para reenviarlos a otro miembro
+POOL_WRITES_KEPT = 200
+
+
+@dataclass(slots=True)
+class Station:
+    nombre: str
+    impresora: str
+    categorias: frozenset[str] = frozenset()
+    productos: frozenset[str] = frozenset()
+
+
+class StationRouter:
+    """
+    Reparte los ítems de una comanda entre estaciones (bar, cocina, ...) según routing.json:
+
+        {"estaciones": [{"nombre": "bar", "impresora": "EPSON BAR",
+                         "categorias": ["Bebidas"], "productos": ["Limonada"]}]}
+
+    Un ítem va a la estación indicada por su pista `estacion`, o a la primera cuya lista de
+    categorías o productos (nombre o id) lo contenga; el resto va a la impresora por defecto.
+    `__format.estacion` envía el ticket completo a esa estación. El archivo se relee si cambia.
+
+    "grupos" define pools de impresoras iguales: una estación (o la impresora del agente) cuyo
+    nombre es un grupo imprime en el miembro menos cargado que esté en servicio.
+
+        {"grupos": {"COCINA": ["EPSON COCINA 1", "EPSON COCINA 2"]}}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mtime: Optional[float] = None
+        self.stations: list[Station] = []
+        self.pools: Dict[str, tuple[str, ...]] = {}
+
+    def load(self) -> list[Station]:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        with self.lock:
+            if mtime == self.mtime:
+                return self.stations
+            self.mtime = mtime
+            self.stations = []
+            self.pools = {}
+            if mtime is None:
+                return self.stations
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+                for entry in config.get("estaciones") or []:
+                    nombre = str(entry.get("nombre") or "").strip().lower()
+                    impresora = str(entry.get("impresora") or "").strip()
+                    if not nombre or not impresora:
+                        continue
+                    self.stations.append(
+                        Station(
+                            nombre=nombre,
+                            impresora=impresora,
+                            categorias=frozenset(str(c).strip().lower() for c in entry.get("categorias") or []),
+                            productos=frozenset(str(p).strip().lower() for p in entry.get("productos") or []),
+                        )
+                    )
+                for nombre, miembros in (config.get("grupos") or {}).items():
+                    members = tuple(dict.fromkeys(str(m).strip() for m in miembros or [] if str(m).strip()))
+                    if str(nombre).strip() and members:
+                        self.pools[str(nombre).strip()] = members
+            except Exception:
+                self.stations = []
+                self.pools = {}
+            return self.stations
+
+    def members(self, printer_name: str) -> tuple[str, ...]:
+        """Impresoras de Windows detrás de un nombre: los miembros del grupo, o la misma impresora."""
+        self.load()
+        return self.pools.get(printer_name) or (printer_name,)
+
+    def group_of(self, printer_name: str) -> str:
+        """Grupo al que pertenece una impresora de Windows, o la misma impresora si no está en ninguno."""
+        self.load()
+        return next((name for name, members in self.pools.items() if printer_name in members), printer_name)
+
+    def station_for(self, item: TicketItem, stations: list[Station]) -> Optional[Station]:
+        if item.estacion:
+            hint = item.estacion.lower()
+            for station in stations:
+                if station.nombre == hint:
+                    return station
+        categoria = item.categoria.lower()
+        nombre = item.nombre.lower()
+        for station in stations:
+            if categoria and categoria in station.categorias:
+                return station
+            if nombre in station.productos or (item.producto_id and item.producto_id.lower() in station.productos):
+                return station
+        return None
+
+    def route(self, ticket: TicketPayload) -> list[tuple[Optional[Station], TicketPayload]]:
+        """Divide el ticket por estación. None representa la impresora por defecto."""
+        stations = self.load()
+        if not stations:
+            return [(None, ticket)]
+
+        if ticket.estacion or not ticket.items:
+            hint = ticket.estacion.lower()
+            station = next((st for st in stations if st.nombre == hint), None)
+            return [(station, ticket)]
+
+        groups: dict[Optional[str], list[TicketItem]] = {}
+        by_name: dict[Optional[str], Optional[Station]] = {None: None}
+        for item in ticket.items:
+            station = self.station_for(item, stations)
+            key = station.nombre if station else None
+            by_name[key] = station
+            groups.setdefault(key, []).append(item)
+
+        return [
+            (by_name[key], replace(ticket, items=tuple(items), estacion=key or ""))
+            for key, items in groups.items()
+        ]
+
+
+class PrinterPool:
+    """
+    Escrituras al spooler a través de los grupos de StationRouter: cada trabajo va al miembro menos
+    cargado que esté en servicio según el PrinterBreaker, y uno que se traba en la cola de un
+    miembro pasa a otro (on_stuck, para SpoolTracker).
+    """
+
+    def __init__(self, router: StationRouter, breaker: PrinterBreaker, logger: logging.Logger):
+        self.router = router
+        self.breaker = breaker
+        self.logger = logger
+        # Escrituras en curso y último uso por miembro (reparto), y los trabajos recientes
+        # (miembro, id en la cola) -> (grupo, bytes) para reenviarlos si el miembro se traba
+        self.lock = threading.Lock()
+        self.inflight: Dict[str, int] = {}
+        self.used: Dict[str, float] = {}
+        self.writes: OrderedDict[tuple[str, int], tuple[str, bytes]] = OrderedDict()
+        # Trabajos ya movidos (None: borrados sin poder reenviarlos); un lote en la cola es un solo
+        # trabajo para varios jobs
+        self.moved: OrderedDict[tuple[str, int], Optional[list[tuple[str, int]]]] = OrderedDict()
+
+    def write(self, printer_name: str, data: bytes) -> tuple[str, Optional[int]]:
+        """
+        spool_write que alimenta el circuit breaker. Con un grupo escribe en el miembro menos
+        cargado y, si la escritura falla, pasa al siguiente. Devuelve (impresora usada, id en la cola).
+        """
+        members = self.router.members(printer_name)
+        if len(members) == 1:
+            try:
+                spool_id = spool_write(members[0], data)
+            except Exception as error:
+                self.breaker.record_failure(members[0], error)
+                raise
+            self.breaker.record_success(members[0])
+            return members[0], spool_id
+
+        tried: set[str] = set()
+        last_error: Optional[Exception] = None
+        while True:
+            member = self.pick_member(members, tried)
+            if member is None:
+                raise last_error or RuntimeError(f"Grupo {printer_name}: ninguna impresora en servicio")
+            tried.add(member)
+            try:
+                spool_id = spool_write(member, data)
+            except SpoolerTimeoutError as error:
+                # El trabajo pudo haber salido: no se repite en otro miembro
+                self.breaker.record_failure(member, error)
+                raise
+            except Exception as error:
+                self.breaker.record_failure(member, error)
+                self.logger.warning(f"{member} falló ({error}): el trabajo pasa a otro miembro de {printer_name}")
+                last_error = error
+                continue
+            finally:
+                with self.lock:
+                    self.inflight[member] -= 1
+            self.breaker.record_success(member)
+            if spool_id:
+                with self.lock:
+                    self.writes[(member, spool_id)] = (printer_name, data)
+                    while len(self.writes) > POOL_WRITES_KEPT:
+                        self.writes.popitem(last=False)
+            return member, spool_id
+
+    def pick_member(self, members: tuple[str, ...], skip: set[str]) -> Optional[str]:
+        """
+        Miembro del grupo para el próximo trabajo: uno a prueba (half-open) primero y si no el de
+        menor cola de Windows más escrituras en curso; a igual carga, el usado hace más tiempo.
+        """
+        candidates = [
+            name for name in members
+            if name not in skip
+            and self.breaker.state(name) != "open"
+            and hung_spooler_calls(name) < MAX_HUNG_SPOOLER_CALLS
+        ]
+        if not candidates:
+            return None
+        depths = {}
+        for name in candidates:
+            queue = spool_queue(name)
+            depths[name] = len(queue) if queue is not None else 0
+        with self.lock:
+            member = min(
+                candidates,
+                key=lambda name: (
+                    self.breaker.state(name) != "half_open",
+                    depths[name] + self.inflight.get(name, 0),
+                    self.used.get(name, 0.0),
+                ),
+            )
+            self.inflight[member] = self.inflight.get(member, 0) + 1
+            self.used[member] = time.monotonic()
+        return member
+
+    def on_stuck(self, job_id: str, key: tuple[str, int]) -> Optional[list[tuple[str, int]]]:
+        """
+        Un trabajo de grupo trabado en la cola de un miembro se borra ahí y se reenvía a otro miembro
+        (que saca el miembro trabado del grupo hasta que la prueba del breaker lo vea bien).
+        Devuelve los nuevos (impresora, id) a seguir, o None si el trabajo se queda donde está.
+        Lanza SpoolCancelledError si se borró y ningún miembro lo pudo recibir.
+        """
+        member, spool_id = key
+        with self.lock:
+            if key in self.moved:
+                moved = self.moved[key]
+                if moved is None:
+                    raise SpoolCancelledError(f"{member}: trabajo {spool_id} borrado sin reenviar")
+                return moved
+            written = self.writes.get(key)
+        if written is None:
+            return None
+        printer_name, data = written
+        others = [name for name in self.router.members(printer_name) if name != member]
+        if not any(self.breaker.state(name) != "open" for name in others):
+            return None
+        if not spool_cancel(member, spool_id):
+            return None
+        with self.lock:
+            self.writes.pop(key, None)
+        self.breaker.trip(member, "cola trabada")
+        try:
+            new_member, new_id = self.write(printer_name, data)
+        except Exception as error:
+            # Ya se borró del miembro trabado: el job (y los demás del mismo lote) sale failed
+            self.logger.error(f"Job {job_id}: no se pudo pasar a otro miembro de {printer_name}: {error}")
+            self.remember_moved(key, None)
+            raise SpoolCancelledError(str(error)) from error
+        self.logger.warning(f"Job {job_id}: {member} trabada, el trabajo pasa a {new_member}")
+        moved = [(new_member, new_id)] if new_id else []
+        self.remember_moved(key, moved)
+        return moved
+
+    def remember_moved(self, key: tuple[str, int], moved: Optional[list[tuple[str, int]]]) -> None:
+        with self.lock:
+            self.moved[key] = moved
+            while len(self.moved) > POOL_WRITES_KEPT:
+                self.moved.popitem(last=False)
@@ -0,0 +1,57 @@
+"""
+Pruebas de failover entre un agente principal y uno de respaldo (MONTIS_FAILOVER_ROLE=standby)
+contra fake_backend.py, con el spooler simulado:
+
+    python -m pytest test_failover.py -q
+"""
+
+from conftest import wait_for
+
+
+def jobs_by_id(backend, ids):
+    with backend.lock:
+        return {job_id: dict(backend.jobs[job_id]) for job_id in ids}
+
+
+def all_done(backend, ids):
+    return all(job["status"] == "done" for job in jobs_by_id(backend, ids).values())
+
+
+def test_standby_takes_jobs_only_while_the_primary_heartbeat_is_stale(backend, start_agent, stop_agent):
+    backend.stale_seconds = 3
+    primary = backend.add_printer("principal", is_default=True)
+    standby = backend.add_printer("respaldo")
+    principal = start_agent(primary, "EPSON PRINCIPAL")
+    respaldo = start_agent(standby, "EPSON RESPALDO", failover_role="standby")
+    wait_for(lambda: primary["last_seen_at"] and standby["meta"].get("failover_role") == "standby")
+
+    ids = backend.enqueue(3, primary["id"])
+    wait_for(lambda: all_done(backend, ids))
+    for job in jobs_by_id(backend, ids).values():
+        assert job["printed_by"] == "principal"
+        assert job["claimed_by_printer_id"] is None
+    assert respaldo.covering == set()
+
+    # Principal cerrado: su heartbeat envejece y el respaldo toma la cola
+    stop_agent(principal)
+    ids = backend.enqueue(3, primary["id"])
+    wait_for(lambda: all_done(backend, ids), timeout=10)
+    for job in jobs_by_id(backend, ids).values():
+        # El ack del respaldo vale por claimed_by_printer_id aunque el job sea de la principal
+        assert job["printer_id"] == primary["id"]
+        assert job["claimed_by_printer_id"] == standby["id"]
+        assert job["printed_by"] == "respaldo"
+    assert respaldo.covering == {primary["id"]}
+    assert standby["meta"].get("failover_role") == "standby"
+
+
+def test_primary_does_not_take_jobs_of_other_printers(backend, start_agent):
+    primary = backend.add_printer("principal", is_default=True)
+    other = backend.add_printer("barra")
+    start_agent(primary, "EPSON PRINCIPAL")
+    wait_for(lambda: primary["last_seen_at"])
+
+    ids = backend.enqueue(2, other["id"])
+    mine = backend.enqueue(1, primary["id"])
+    wait_for(lambda: all_done(backend, mine))
+    assert {job["status"] for job in jobs_by_id(backend, ids).values()} == {"pending"}
@@ -0,0 +1,52 @@
+"""
+Pruebas del servidor LAN del agente (local_server.py) con un agente contra fake_backend.py:
+
+    python -m pytest test_local_server.py -q
+"""
+
+import http.client
+import json
+
+import pytest
+
+import printer_agent
+from local_server import LAN_MAX_BODY, start_local_server
+
+
+@pytest.fixture
+def lan(backend, make_agent, tmp_path):
+    agent = make_agent(backend.add_printer("principal", is_default=True))
+    server = start_local_server(agent, 0, printer_agent.APP_NAME, str(tmp_path / "profiles"))
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def post(port, path, body, headers):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        connection.putrequest("POST", path)
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b"{}")
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize("length", ["abc", "-1", "", str(LAN_MAX_BODY + 1)])
+def test_bad_content_length_is_rejected(lan, length):
+    headers = {"Content-Type": "application/json"}
+    if length:
+        headers["Content-Length"] = length
+    status, body = post(lan, "/jobs", b"{}", headers)
+    assert status == (413 if length == str(LAN_MAX_BODY + 1) else 400)
+    assert body == {"success": False, "error": "Cuerpo inválido"}
+
+
+def test_job_without_valid_token_is_unauthorized(lan):
+    data = json.dumps({"externalId": "ext-1", "exp": 0, "token": "x", "payload": {}}).encode()
+    status, body = post(lan, "/jobs", data, {"Content-Type": "application/json", "Content-Length": str(len(data))})
+    assert status == 401
+    assert body["success"] is False
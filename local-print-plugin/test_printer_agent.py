@@ -0,0 +1,298 @@
+"""
+Pruebas del loop del agente (printer_agent.py) contra fake_backend.py y el spooler simulado:
+
+    python -m pytest test_printer_agent.py -q
+"""
+
+import json
+import threading
+import time
+
+import printer_agent
+from conftest import PRINTER_NAME, wait_for
+from fake_backend import FakeBackend
+from ticket_history import REPRINT_HEADER
+from ticket_render import decode_ticket
+
+
+def statuses(backend):
+    with backend.lock:
+        return sorted(job["status"] for job in backend.jobs.values())
+
+
+def test_isolated_job_is_not_held_for_the_coalescing_window(backend, make_agent, monkeypatch):
+    monkeypatch.setattr(printer_agent, "COALESCE_MS", 2000)
+    printer = backend.add_printer("principal", is_default=True)
+    agent = make_agent(printer)
+    backend.enqueue(1, printer["id"])
+
+    started = time.monotonic()
+    jobs = agent.coalesce_jobs(agent.fetch_jobs())
+    assert len(jobs) == 1
+    assert time.monotonic() - started < 1
+
+
+def test_burst_waits_the_window_and_collects_late_jobs(backend, make_agent, monkeypatch):
+    monkeypatch.setattr(printer_agent, "COALESCE_MS", 500)
+    printer = backend.add_printer("principal", is_default=True)
+    agent = make_agent(printer)
+    backend.enqueue(1, printer["id"])
+    agent.last_jobs_at = time.monotonic()
+
+    threading.Timer(0.1, backend.enqueue, args=(2, printer["id"])).start()
+    started = time.monotonic()
+    jobs = agent.coalesce_jobs(agent.fetch_jobs())
+    assert len(jobs) == 3
+    assert time.monotonic() - started >= 0.5
+    assert statuses(backend) == ["processing"] * 3
+
+
+def test_coalescing_claims_no_more_than_max_jobs(backend, make_agent, monkeypatch):
+    monkeypatch.setattr(printer_agent, "COALESCE_MS", 500)
+    printer = backend.add_printer("principal", is_default=True)
+    agent = make_agent(printer)
+    backend.enqueue(12, printer["id"])
+
+    jobs = agent.coalesce_jobs(agent.fetch_jobs(), max_jobs=7)
+    assert len(jobs) == 7
+    assert statuses(backend) == ["pending"] * 5 + ["processing"] * 7
+
+
+def test_coalesced_batches_fit_the_spool_headroom(backend, start_agent, fake_spool, monkeypatch):
+    monkeypatch.setattr(printer_agent, "COALESCE_MS", 200)
+    monkeypatch.setattr(printer_agent, "SPOOL_MAX_DEPTH", 3)
+    printer = backend.add_printer("principal", is_default=True)
+    backend.enqueue(8, printer["id"])
+    fake_spool.pause(PRINTER_NAME)
+    agent = start_agent(printer)
+
+    # Cada lote es un solo trabajo en la cola de Windows y reclama a lo sumo el lugar libre:
+    # 3 jobs (1 trabajo), luego 2 y luego 1 hasta llenar la cola
+    wait_for(lambda: len(fake_spool.enum_jobs(PRINTER_NAME)) == 3)
+    time.sleep(0.5)
+    assert agent.spool_blocked
+    assert statuses(backend) == ["pending"] * 2 + ["processing"] * 6
+    assert agent.deferred_jobs == []
+
+    fake_spool.resume(PRINTER_NAME)
+    wait_for(lambda: statuses(backend) == ["done"] * 8, timeout=15)
+
+
+def test_leases_of_claimed_jobs_are_renewed_until_acked(backend, make_agent):
+    printer = backend.add_printer("principal", is_default=True)
+    agent = make_agent(printer)
+    first, second = backend.enqueue(2, printer["id"])
+    agent.fetch_jobs()
+    with backend.lock:
+        backend.jobs[first]["lease_expires_at"] = backend.jobs[second]["lease_expires_at"] = time.time() + 1
+
+    agent.ack(first, "done", info="ok")
+    agent.renew_leases()
+    with backend.lock:
+        assert backend.jobs[second]["lease_expires_at"] > time.time() + printer_agent.LEASE_SECONDS - 5
+        assert backend.jobs[first]["lease_expires_at"] is None
+    assert list(agent.leased_jobs) == [second]
+
+
+def test_startup_recovery_acks_printed_jobs_and_resumes_the_rest(backend, make_agent, monkeypatch):
+    monkeypatch.setattr(printer_agent, "RECOVER_LIMIT", 1)
+    printer = backend.add_printer("principal", is_default=True)
+    printed, resumed, released = backend.enqueue(3, printer["id"])
+    # Un agente anterior los reclamó y se cerró antes del ack; el primero alcanzó a imprimirse
+    backend.claim(printer, 3, 60, failover=False)
+    agent = make_agent(printer)
+    agent.journal.add(printed)
+
+    agent.recover_processing_jobs()
+    with backend.lock:
+        assert backend.jobs[printed]["status"] == "done"
+        assert backend.jobs[printed]["info"] == "recuperado"
+        assert backend.jobs[resumed]["status"] == "processing"
+        assert backend.jobs[released]["status"] == "pending"
+    assert [job["id"] for job in agent.deferred_jobs] == [resumed]
+    assert resumed in agent.leased_jobs
+
+
+def test_recovered_job_is_printed_by_the_loop(backend, start_agent, fake_spool):
+    printer = backend.add_printer("principal", is_default=True)
+    (job_id,) = backend.enqueue(1, printer["id"])
+    backend.claim(printer, 1, 600, failover=False)
+    start_agent(printer)
+
+    wait_for(lambda: statuses(backend) == ["done"])
+    assert backend.jobs[job_id]["info"] == "ok"
+    assert fake_spool.printed == 1
+
+
+def enqueue_backlog(backend, printer):
+    """Dos comandas de hace 30 min (vencidas) y una de hace 2 min, como tras una caída de conexión."""
+    old = [
+        backend.enqueue(1, printer["id"], {"mesas": [{"numero": mesa}], "usuario": {"nombre": "Ana"},
+                                           "items": [{"nombre": "Arepa", "cantidad": 2}]}, age_seconds=1800)[0]
+        for mesa in ("4", "7")
+    ]
+    (fresh,) = backend.enqueue(1, printer["id"], age_seconds=120)
+    return old, fresh
+
+
+def test_drain_prints_one_summary_for_stale_jobs(backend, make_agent, fake_spool, monkeypatch):
+    monkeypatch.setattr(printer_agent, "DRAIN_TTL_SECONDS", 900)
+    monkeypatch.setattr(printer_agent, "DRAIN_STALE_MODE", "resumen")
+    printer = backend.add_printer("principal", is_default=True)
+    agent = make_agent(printer)
+    old, fresh = enqueue_backlog(backend, printer)
+    fake_spool.pause(PRINTER_NAME)
+
+    jobs = agent.fetch_jobs(printer_agent.DRAIN_JOB_LIMIT)
+    assert agent.update_drain(jobs, printer_agent.JOB_LIMIT)
+    assert [job["id"] for job in agent.drain_jobs(jobs)] == [fresh]
+
+    with backend.lock:
+        for job_id in old:
+            assert backend.jobs[job_id]["status"] == "expired"
+            assert backend.jobs[job_id]["info"] == "en resumen de atrasados"
+    assert agent.drain_stats == {"impresos": 1, "reemplazados": 0, "vencidos": 2}
+    (summary,) = [data for _, _, data, _ in fake_spool.queues[PRINTER_NAME]]
+    assert b"PEDIDOS ATRASADOS" in summary
+    assert b"Mesa 4 (Ana)" in summary and b"Mesa 7 (Ana)" in summary
+    assert b"Total: 2 pedido(s)" in summary
+
+
+def test_drain_expires_stale_jobs_without_printing(backend, make_agent, fake_spool, monkeypatch):
+    monkeypatch.setattr(printer_agent, "DRAIN_TTL_SECONDS", 900)
+    monkeypatch.setattr(printer_agent, "DRAIN_STALE_MODE", "expirar")
+    printer = backend.add_printer("principal", is_default=True)
+    agent = make_agent(printer)
+    old, fresh = enqueue_backlog(backend, printer)
+
+    jobs = agent.fetch_jobs(printer_agent.DRAIN_JOB_LIMIT)
+    assert agent.update_drain(jobs, printer_agent.JOB_LIMIT)
+    assert [job["id"] for job in agent.drain_jobs(jobs)] == [fresh]
+    with backend.lock:
+        assert {backend.jobs[job_id]["info"] for job_id in old} == {"vencido sin imprimir"}
+    assert fake_spool.enum_jobs(PRINTER_NAME) == []
+
+
+def test_stale_jobs_print_normally_when_the_summary_fails(backend, make_agent, monkeypatch):
+    monkeypatch.setattr(printer_agent, "DRAIN_TTL_SECONDS", 900)
+    monkeypatch.setattr(printer_agent, "DRAIN_STALE_MODE", "resumen")
+    printer = backend.add_printer("principal", is_default=True)
+    agent = make_agent(printer)
+    old, fresh = enqueue_backlog(backend, printer)
+
+    def fail(printer_name, data):
+        raise OSError("sin respuesta")
+
+    monkeypatch.setattr(agent, "spool_write", fail)
+    jobs = agent.fetch_jobs(printer_agent.DRAIN_JOB_LIMIT)
+    agent.update_drain(jobs, printer_agent.JOB_LIMIT)
+    # El más nuevo primero; los vencidos quedan al final, del más viejo al más nuevo
+    assert [job["id"] for job in agent.drain_jobs(jobs)] == [fresh, *old]
+    assert statuses(backend) == ["processing"] * 3
+
+
+def test_reprint_goes_through_the_printer_group(backend, make_agent, fake_spool, tmp_path):
+    printer = backend.add_printer("principal", is_default=True)
+    agent = make_agent(printer, printer_name="COCINA")
+    (tmp_path / "principal" / "routing.json").write_text(
+        json.dumps({"grupos": {"COCINA": ["EPSON 1", "EPSON 2"]}}), encoding="utf-8"
+    )
+    ticket = decode_ticket({"mesas": [{"numero": "5"}], "items": [{"nombre": "Arepa", "cantidad": 1}]})
+    ticket_id = agent.tickets.add(ticket, "job-1", "ext-1", "EPSON 1", "cocina", b"ticket")
+
+    # El miembro que lo imprimió está fuera de servicio: la reimpresión sale por el otro
+    agent.breaker.trip("EPSON 1", "prueba")
+    assert agent.reprint_tickets({"id": ticket_id})[0] == 200
+    assert fake_spool.enum_jobs("EPSON 1") == []
+    ((_, _, data, _),) = fake_spool.queues["EPSON 2"]
+    assert data == REPRINT_HEADER + b"ticket"
+
+    agent.breaker.trip("EPSON 2", "prueba")
+    code, body = agent.reprint_tickets({"external_id": "ext-1"})
+    assert code == 502
+    assert body["error"] == "Impresora fuera de servicio: COCINA"
+    assert agent.reprint_tickets({"id": ticket_id + 1})[0] == 404
+
+
+CATALOG = {
+    "productos": [{"id": "p1", "nombre": "Arepa", "categoria_id": "c1"}, {"id": "p2", "nombre": "Limonada"}],
+    "categorias": [{"id": "c1", "nombre": "Comidas"}],
+    "personalizaciones": [{"id": "x1", "nombre": "sin queso"}, {"id": "x2", "nombre": "con huevo"}],
+    "usuarios": [{"id": "u1", "nombre": "Ana"}],
+}
+ORDER = {
+    "mesas": [{"numero": "5"}],
+    "usuario": {"id": "u1", "nombre": "Ana"},
+    "items": [
+        {"producto_id": "p1", "nombre": "Arepa", "categoria": "Comidas", "cantidad": 2,
+         "personalizaciones": ["sin queso", "con huevo"], "personalizacion_ids": ["x1", "x2"]},
+        {"producto_id": "p2", "nombre": "Limonada", "cantidad": 1},
+        {"nombre": "Producto libre", "cantidad": 1},
+    ],
+}
+
+
+def set_catalog(backend):
+    backend.catalog_overlap = 0
+    backend.set_catalog(CATALOG)
+    # En segundos enteros: la versión ISO (microsegundos) que devuelve el agente las representa exactas
+    for rows in backend.catalog.values():
+        for row in rows.values():
+            row["updated_at"] = float(int(row["updated_at"]))
+
+
+def catalog_agent(backend, make_agent, tmp_path, monkeypatch):
+    """Agente con catálogo local en tmp_path, sincronizado con el del backend."""
+    set_catalog(backend)
+    printer = backend.add_printer("principal", is_default=True)
+    agent = make_agent(printer)
+    monkeypatch.setattr(printer_agent, "CATALOG_ENABLED", True)
+    monkeypatch.setattr(printer_agent, "_catalog", printer_agent.CatalogCache(str(tmp_path / "catalog.json")))
+    agent.sync_catalog()
+    return agent, printer
+
+
+def test_compacted_payload_expands_to_the_original(tmp_path):
+    catalog = printer_agent.CatalogCache(str(tmp_path / "catalog.json"))
+    backend = FakeBackend()
+    set_catalog(backend)
+    assert catalog.apply(backend.catalog_since(None)) == 6
+
+    (job,) = backend.compact([{"type": "kitchen_ticket", "payload": ORDER}], printer_agent.parse_timestamp(catalog.version))
+    compacted = job["payload"]
+    assert "nombre" not in compacted["items"][0] and "personalizaciones" not in compacted["items"][0]
+    assert compacted["usuario"] == {"id": "u1"}
+    assert catalog.expand(compacted)["items"][2] == ORDER["items"][2]
+    assert decode_ticket(catalog.expand(compacted)) == decode_ticket(ORDER)
+
+
+def test_agent_expands_compacted_jobs_from_the_backend(backend, make_agent, tmp_path, monkeypatch):
+    agent, printer = catalog_agent(backend, make_agent, tmp_path, monkeypatch)
+    compacted = []
+    compact = backend.compact
+
+    def spy(jobs, version):
+        result = compact(jobs, version)
+        compacted.extend(result)
+        return result
+
+    monkeypatch.setattr(backend, "compact", spy)
+    backend.enqueue(1, printer["id"], ORDER)
+
+    (job,) = agent.fetch_jobs()
+    assert compacted[0]["payload"]["catalogo"]
+    assert job["ticket"] == decode_ticket(ORDER)
+
+
+def test_job_missing_from_the_local_catalog_is_released_with_names(backend, make_agent, tmp_path, monkeypatch):
+    agent, printer = catalog_agent(backend, make_agent, tmp_path, monkeypatch)
+    del printer_agent.catalog_cache().entries["productos"]["p2"]
+    (job_id,) = backend.enqueue(1, printer["id"], ORDER)
+
+    assert agent.fetch_jobs() == []
+    assert backend.jobs[job_id]["status"] == "pending"
+    assert backend.jobs[job_id]["info"] == "catálogo local desactualizado"
+    # Sin versión el siguiente poll llega con nombres
+    assert printer_agent.catalog_cache().version == ""
+    (job,) = agent.fetch_jobs()
+    assert job["ticket"] == decode_ticket(ORDER)
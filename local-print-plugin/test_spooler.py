@@ -0,0 +1,181 @@
+"""
+Pruebas del seguimiento de la cola de Windows (SpoolTracker) y del backpressure del agente
+(MONTIS_SPOOL_MAX_DEPTH) con el spooler simulado:
+
+    python -m pytest test_spooler.py -q
+"""
+
+import logging
+import time
+
+import pytest
+
+import printer_agent
+import spooler
+from conftest import PRINTER_NAME, wait_for
+from spooler import JOB_STATUS_DELETING, JOB_STATUS_PAPEROUT, PrinterBreaker, SpoolTracker
+
+LOGGER = logging.getLogger("test-spooler")
+
+
+@pytest.fixture
+def tracker(fake_spool, monkeypatch):
+    """SpoolTracker cuyo hilo no revisa la cola: cada prueba llama a poll() cuando corresponde."""
+    monkeypatch.setattr(spooler, "SPOOL_POLL_SECONDS", 3600)
+    done: dict[str, tuple[str, str]] = {}
+    tracker = SpoolTracker(lambda job_id, status, info: done.setdefault(job_id, (status, info)), LOGGER)
+    tracker.done = done  # type: ignore[attr-defined]
+    return tracker
+
+
+def test_job_is_done_only_after_it_leaves_the_queue(tracker, fake_spool):
+    fake_spool.pause(PRINTER_NAME)
+    spool_id = spooler.print_bytes(PRINTER_NAME, b"ticket")
+    tracker.track("job-1", [(PRINTER_NAME, spool_id)], "ok")
+    wait_for(lambda: fake_spool.enum_jobs(PRINTER_NAME) == [(spool_id, JOB_STATUS_PAPEROUT)])
+
+    tracker.poll()
+    assert tracker.done == {}
+    assert tracker.depth(PRINTER_NAME) == 1
+
+    fake_spool.resume(PRINTER_NAME)
+    wait_for(lambda: fake_spool.enum_jobs(PRINTER_NAME) == [])
+    tracker.poll()
+    assert tracker.done == {"job-1": ("done", "ok")}
+    assert tracker.pending == {}
+    assert tracker.depth(PRINTER_NAME) == 0
+
+
+def test_job_cancelled_in_the_queue_is_acked_failed(tracker, fake_spool):
+    fake_spool.pause(PRINTER_NAME)
+    spool_id = spooler.print_bytes(PRINTER_NAME, b"ticket")
+    tracker.track("job-1", [(PRINTER_NAME, spool_id)], "ok")
+
+    assert fake_spool.cancel(PRINTER_NAME, spool_id)
+    assert fake_spool.enum_jobs(PRINTER_NAME) == [(spool_id, JOB_STATUS_DELETING)]
+    tracker.poll()
+    assert tracker.done == {}
+
+    wait_for(lambda: fake_spool.enum_jobs(PRINTER_NAME) == [])
+    tracker.poll()
+    assert tracker.done == {"job-1": ("failed", "cancelado en la cola de Windows")}
+
+
+def test_job_stuck_past_the_timeout_is_acked_without_confirmation(tracker, fake_spool, monkeypatch):
+    fake_spool.pause(PRINTER_NAME)
+    spool_id = spooler.print_bytes(PRINTER_NAME, b"ticket")
+    tracker.track("job-1", [(PRINTER_NAME, spool_id)], "ok (2 copias)")
+    tracker.poll()
+    assert tracker.done == {}
+
+    monkeypatch.setattr(spooler, "SPOOL_CONFIRM_TIMEOUT_SECONDS", 0)
+    tracker.poll()
+    assert tracker.done == {"job-1": ("done", "ok (2 copias) (sin confirmación del spooler)")}
+    # El trabajo sigue en la cola de Windows: no se cancela, solo se deja de esperar
+    assert [job_id for job_id, _ in fake_spool.enum_jobs(PRINTER_NAME)] == [spool_id]
+
+
+def test_claims_are_capped_at_spool_max_depth(backend, start_agent, fake_spool, monkeypatch):
+    monkeypatch.setattr(printer_agent, "SPOOL_MAX_DEPTH", 3)
+    printer = backend.add_printer("principal", is_default=True)
+    backend.enqueue(8, printer["id"])
+    fake_spool.pause(PRINTER_NAME)
+    agent = start_agent(printer)
+
+    def statuses():
+        with backend.lock:
+            return sorted(job["status"] for job in backend.jobs.values())
+
+    wait_for(lambda: len(fake_spool.enum_jobs(PRINTER_NAME)) == 3)
+    claims = backend.claims
+    time.sleep(0.5)
+    # Con la cola de Windows llena el agente no vuelve a pedir jobs
+    assert backend.claims == claims
+    assert agent.spool_blocked
+    assert statuses() == ["pending"] * 5 + ["processing"] * 3
+
+    fake_spool.resume(PRINTER_NAME)
+    wait_for(lambda: statuses() == ["done"] * 8, timeout=15)
+    assert not agent.spool_blocked
+    assert fake_spool.printed == 8
+
+
+def test_breaker_opens_after_consecutive_failures_and_probes_back_to_half_open(fake_spool, monkeypatch):
+    monkeypatch.setattr(spooler, "BREAKER_FAILURES", 3)
+    monkeypatch.setattr(spooler, "BREAKER_PROBE_SECONDS", 0)
+    changes = []
+    breaker = PrinterBreaker(LOGGER, on_change=lambda: changes.append(breaker.state(PRINTER_NAME)))
+    error = RuntimeError("sin papel")
+
+    breaker.record_failure(PRINTER_NAME, error)
+    breaker.record_failure(PRINTER_NAME, error)
+    breaker.record_success(PRINTER_NAME)
+    breaker.record_failure(PRINTER_NAME, error)
+    breaker.record_failure(PRINTER_NAME, error)
+    assert breaker.state(PRINTER_NAME) == "closed"
+
+    breaker.record_failure(PRINTER_NAME, error)
+    assert breaker.state(PRINTER_NAME) == "open"
+    assert breaker.snapshot()[PRINTER_NAME]["error"] == "sin papel"
+
+    fake_spool.pause(PRINTER_NAME)
+    breaker.probe()
+    assert breaker.state(PRINTER_NAME) == "open"
+    assert breaker.snapshot()[PRINTER_NAME]["error"] == "en pausa"
+
+    fake_spool.resume(PRINTER_NAME)
+    breaker.probe()
+    assert breaker.state(PRINTER_NAME) == "half_open"
+    # En half_open una sola falla vuelve a abrir el circuito
+    breaker.record_failure(PRINTER_NAME, error)
+    assert breaker.state(PRINTER_NAME) == "open"
+
+    breaker.probe()
+    breaker.record_success(PRINTER_NAME)
+    assert breaker.state(PRINTER_NAME) == "closed"
+    assert breaker.snapshot() == {}
+    assert changes == ["open", "half_open", "open", "half_open", "closed"]
+
+
+@pytest.mark.parametrize("coalesce_ms", [0, 200])
+def test_half_open_printer_gets_a_single_trial_job(backend, start_agent, fake_spool, monkeypatch, coalesce_ms):
+    # Con MONTIS_COALESCE_MS el lote de la vuelta tampoco pasa del job de prueba
+    monkeypatch.setattr(printer_agent, "COALESCE_MS", coalesce_ms)
+    monkeypatch.setattr(spooler, "BREAKER_PROBE_SECONDS", 3600)
+    printer = backend.add_printer("principal", is_default=True)
+    agent = start_agent(printer)
+    agent.breaker.trip(PRINTER_NAME, "prueba")
+    # El heartbeat con el circuito abierto sale después del último poll de la vuelta en curso
+    wait_for(lambda: printer["meta"].get("circuit_open") is True)
+    ids = backend.enqueue(4, printer["id"])
+
+    def attempts():
+        with backend.lock:
+            return [backend.jobs[job_id]["attempts"] for job_id in ids]
+
+    def statuses():
+        with backend.lock:
+            return {backend.jobs[job_id]["status"] for job_id in ids}
+
+    time.sleep(0.3)
+    # Circuito abierto: los jobs esperan en el backend
+    assert attempts() == [0, 0, 0, 0]
+
+    real_print_bytes = spooler.print_bytes
+
+    def failing_print_bytes(printer_name, data):
+        monkeypatch.setattr(spooler, "BREAKER_PROBE_SECONDS", 3600)
+        raise OSError("sin respuesta")
+
+    monkeypatch.setattr(spooler, "print_bytes", failing_print_bytes)
+    monkeypatch.setattr(spooler, "BREAKER_PROBE_SECONDS", 0)
+    wait_for(lambda: sum(attempts()) == 1 and statuses() == {"pending"})
+    time.sleep(0.3)
+    # La prueba falló: se reclamó un solo job, volvió a pending y el circuito se reabrió
+    assert sorted(attempts()) == [0, 0, 0, 1]
+    assert agent.breaker.state(PRINTER_NAME) == "open"
+
+    monkeypatch.setattr(spooler, "print_bytes", real_print_bytes)
+    monkeypatch.setattr(spooler, "BREAKER_PROBE_SECONDS", 0)
+    wait_for(lambda: statuses() == {"done"}, timeout=10)
+    assert agent.breaker.state(PRINTER_NAME) == "closed"
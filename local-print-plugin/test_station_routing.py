@@ -0,0 +1,194 @@
+"""
+Pruebas de estaciones y grupos de impresoras (routing.json) con el spooler simulado:
+
+    python -m pytest test_station_routing.py -q
+"""
+
+import json
+import logging
+
+import pytest
+
+import spooler
+from conftest import wait_for
+from spooler import JOB_STATUS_PAPEROUT, PrinterBreaker, SpoolTracker
+from station_routing import PrinterPool, StationRouter
+from ticket_render import decode_ticket
+
+LOGGER = logging.getLogger("test-station-routing")
+
+
+def write_routing(tmp_path, config):
+    path = tmp_path / "routing.json"
+    path.write_text(json.dumps(config), encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture
+def pool(tmp_path, fake_spool):
+    router = StationRouter(write_routing(tmp_path, {"grupos": {"COCINA": ["EPSON 1", "EPSON 2"]}}))
+    return PrinterPool(router, PrinterBreaker(LOGGER), LOGGER)
+
+
+def test_stuck_job_that_cannot_be_resent_is_acked_failed(pool, fake_spool, monkeypatch):
+    monkeypatch.setattr(spooler, "POOL_FAILOVER_SECONDS", 0)
+    monkeypatch.setattr(spooler, "SPOOL_POLL_SECONDS", 3600)
+    fake_spool.pause("EPSON 1")
+    member, spool_id = pool.write("COCINA", b"ticket")
+    assert member == "EPSON 1"
+    wait_for(lambda: fake_spool.enum_jobs("EPSON 1") == [(spool_id, JOB_STATUS_PAPEROUT)])
+
+    real_print_bytes = spooler.print_bytes
+
+    def print_bytes(printer_name, data):
+        if printer_name == "EPSON 2":
+            raise OSError("EPSON 2 desconectada")
+        return real_print_bytes(printer_name, data)
+
+    monkeypatch.setattr(spooler, "print_bytes", print_bytes)
+    results = []
+    tracker = SpoolTracker(lambda job_id, status, info: results.append((job_id, status, info)), LOGGER, pool.on_stuck)
+    tracker.track("job-1", [(member, spool_id)], "ok")
+    tracker.track("job-2", [(member, spool_id)], "ok")  # mismo lote en la cola
+    tracker.poll()
+
+    assert results == [
+        ("job-1", "failed", "cancelado en la cola de Windows"),
+        ("job-2", "failed", "cancelado en la cola de Windows"),
+    ]
+    assert pool.breaker.state("EPSON 1") == "open"
+    # El trabajo trabado se borró de la cola: no sale cuando la impresora vuelve
+    fake_spool.resume("EPSON 1")
+    wait_for(lambda: fake_spool.enum_jobs("EPSON 1") == [])
+    assert fake_spool.printed == 0
+
+
+def test_pick_member_prefers_shortest_queue_then_least_recently_used(pool, fake_spool):
+    fake_spool.pause("EPSON 1")
+    fake_spool.submit("EPSON 1", b"en cola")
+    assert pool.write("COCINA", b"a")[0] == "EPSON 2"
+
+    fake_spool.resume("EPSON 1")
+    wait_for(lambda: not fake_spool.enum_jobs("EPSON 1") and not fake_spool.enum_jobs("EPSON 2"))
+    # A igual carga va el que se usó hace más tiempo
+    assert pool.pick_member(("EPSON 1", "EPSON 2"), set()) == "EPSON 1"
+
+
+def test_pick_member_skips_open_members_and_tries_half_open_first(pool, fake_spool, monkeypatch):
+    monkeypatch.setattr(spooler, "BREAKER_PROBE_SECONDS", 0)
+    for _ in range(spooler.BREAKER_FAILURES):
+        pool.breaker.record_failure("EPSON 1", OSError("fuera de línea"))
+    assert pool.pick_member(("EPSON 1", "EPSON 2"), set()) == "EPSON 2"
+    assert pool.pick_member(("EPSON 1", "EPSON 2"), {"EPSON 2"}) is None
+
+    pool.breaker.probe()
+    assert pool.breaker.state("EPSON 1") == "half_open"
+    fake_spool.pause("EPSON 1")
+    fake_spool.submit("EPSON 1", b"en cola")
+    # A prueba va primero aunque tenga más cola: decide si vuelve al grupo
+    assert pool.pick_member(("EPSON 1", "EPSON 2"), set()) == "EPSON 1"
+
+
+def test_failed_write_moves_to_next_member(pool, fake_spool, monkeypatch):
+    real_print_bytes = spooler.print_bytes
+
+    def print_bytes(printer_name, data):
+        if printer_name == "EPSON 1":
+            raise OSError("EPSON 1 desconectada")
+        return real_print_bytes(printer_name, data)
+
+    monkeypatch.setattr(spooler, "print_bytes", print_bytes)
+    member, spool_id = pool.write("COCINA", b"ticket")
+    assert member == "EPSON 2" and spool_id
+    assert pool.breaker.printers["EPSON 1"]["failures"] == 1
+    assert pool.inflight == {"EPSON 1": 0, "EPSON 2": 0}
+
+
+def test_stuck_member_hands_its_job_to_another_member(pool, fake_spool, monkeypatch):
+    monkeypatch.setattr(spooler, "POOL_FAILOVER_SECONDS", 0)
+    monkeypatch.setattr(spooler, "SPOOL_POLL_SECONDS", 3600)
+    fake_spool.pause("EPSON 1")
+    member, spool_id = pool.write("COCINA", b"ticket")
+    wait_for(lambda: fake_spool.enum_jobs("EPSON 1") == [(spool_id, JOB_STATUS_PAPEROUT)])
+
+    results = []
+    tracker = SpoolTracker(lambda job_id, status, info: results.append((job_id, status, info)), LOGGER, pool.on_stuck)
+    tracker.track("job-1", [(member, spool_id)], "ok")
+    tracker.poll()
+    assert results == []
+    assert pool.breaker.state("EPSON 1") == "open"
+    assert [key[0] for key in tracker.pending["job-1"]["spool"]] == ["EPSON 2"]
+
+    wait_for(lambda: fake_spool.printed == 1)
+    tracker.poll()
+    assert results == [("job-1", "done", "ok")]
+
+
+def test_router_without_groups_uses_the_printer_itself(tmp_path):
+    router = StationRouter(str(tmp_path / "no-existe.json"))
+    assert router.members("EPSON BAR") == ("EPSON BAR",)
+
+
+ROUTING = {
+    "estaciones": [
+        {"nombre": "Bar", "impresora": "EPSON BAR", "categorias": ["Bebidas"], "productos": ["Limonada", "p-cafe"]},
+        {"nombre": "Parrilla", "impresora": "EPSON PARRILLA", "categorias": ["Carnes"]},
+    ]
+}
+
+
+def routed(router, payload):
+    return [
+        (station.nombre if station else None, [item.nombre for item in part.items], part.estacion)
+        for station, part in router.route(decode_ticket(payload))
+    ]
+
+
+def test_route_splits_items_by_category_and_product(tmp_path):
+    router = StationRouter(write_routing(tmp_path, ROUTING))
+    payload = {
+        "items": [
+            {"nombre": "Arepa", "cantidad": 1},
+            {"nombre": "Cerveza", "cantidad": 2, "categoria": "bebidas"},
+            {"nombre": "Churrasco", "cantidad": 1, "categoria": "Carnes"},
+            {"nombre": "limonada", "cantidad": 1},
+            {"nombre": "Tinto", "cantidad": 1, "producto_id": "P-CAFE"},
+        ]
+    }
+    assert routed(router, payload) == [
+        (None, ["Arepa"], ""),
+        ("bar", ["Cerveza", "limonada", "Tinto"], "bar"),
+        ("parrilla", ["Churrasco"], "parrilla"),
+    ]
+
+
+def test_route_item_hint_wins_over_category(tmp_path):
+    router = StationRouter(write_routing(tmp_path, ROUTING))
+    payload = {
+        "items": [
+            {"nombre": "Cerveza michelada", "cantidad": 1, "categoria": "Bebidas", "estacion": "PARRILLA"},
+            {"nombre": "Jugo", "cantidad": 1, "categoria": "Bebidas", "estacion": "terraza"},
+        ]
+    }
+    # Una pista que no es una estación conocida cae en las reglas de categoría y producto
+    assert routed(router, payload) == [
+        ("parrilla", ["Cerveza michelada"], "parrilla"),
+        ("bar", ["Jugo"], "bar"),
+    ]
+
+
+def test_route_format_hint_sends_the_whole_ticket(tmp_path):
+    router = StationRouter(write_routing(tmp_path, ROUTING))
+    payload = {
+        "__format": {"estacion": "Bar"},
+        "items": [{"nombre": "Arepa", "cantidad": 1}, {"nombre": "Churrasco", "cantidad": 1, "categoria": "Carnes"}],
+    }
+    assert routed(router, payload) == [("bar", ["Arepa", "Churrasco"], "Bar")]
+    payload["__format"] = {"estacion": "terraza"}
+    assert routed(router, payload) == [(None, ["Arepa", "Churrasco"], "terraza")]
+
+
+def test_route_without_routing_file_uses_the_default_printer(tmp_path):
+    router = StationRouter(str(tmp_path / "routing.json"))
+    payload = {"items": [{"nombre": "Cerveza", "cantidad": 1, "categoria": "Bebidas"}]}
+    assert routed(router, payload) == [(None, ["Cerveza"], "")]
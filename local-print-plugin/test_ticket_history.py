@@ -0,0 +1,118 @@
+"""
+Pruebas del historial local del agente (ticket_history.py), sin impresora ni backend:
+
+    python -m pytest test_ticket_history.py -q
+"""
+
+import os
+import time
+
+import spooler
+from conftest import PRINTER_NAME
+from ticket_history import REPRINT_HEADER, ComandaHistory, TicketHistory, comanda_lines, diff_items
+from ticket_render import decode_items, decode_ticket
+
+
+def snapshot(*items):
+    return decode_items(list(items), "snapshot_items")
+
+
+def changes(previous, current):
+    return [(item.nombre, item.personalizaciones, item.cantidad, item.total) for item in diff_items(previous, current)]
+
+
+def test_diff_items_reports_added_lines_and_quantity_changes():
+    printed = comanda_lines(snapshot(
+        {"nombre": "Arepa", "cantidad": 2, "producto_id": "p1"},
+        {"nombre": "Limonada", "cantidad": 1, "producto_id": "p2"},
+        {"nombre": "Cerveza", "cantidad": 3, "producto_id": "p3"},
+    ))
+    current = snapshot(
+        {"nombre": "Arepa", "cantidad": 3, "producto_id": "p1"},
+        {"nombre": "Limonada", "cantidad": 1, "producto_id": "p2"},
+        {"nombre": "Cerveza", "cantidad": 1, "producto_id": "p3"},
+        {"nombre": "Arepa", "cantidad": 1, "producto_id": "p1", "personalizaciones": ["sin queso"]},
+    )
+    assert changes(printed, current) == [
+        ("Arepa", (), "+1", "3"),
+        ("Cerveza", (), "-2", "1"),
+        ("Arepa", ("sin queso",), "+1", ""),
+    ]
+
+
+def test_diff_items_reports_cancelled_lines_with_total_zero():
+    items = [
+        {"nombre": "Arepa", "cantidad": 2, "producto_id": "p1"},
+        {"nombre": "Limonada", "cantidad": 0.5, "producto_id": "p2"},
+    ]
+    printed = comanda_lines(snapshot(*items))
+    assert changes(printed, snapshot(items[0])) == [("Limonada", (), "-0.5", "0")]
+    # Sin cambios no hay nada que imprimir
+    assert changes(printed, snapshot(*items)) == []
+
+
+def test_diff_items_against_the_saved_comanda(tmp_path):
+    history = ComandaHistory(str(tmp_path / "printed_comandas.db"))
+    assert history.get("c1") is None
+    # Las líneas repetidas de un mismo producto se suman; el orden de personalizaciones no importa
+    history.save("c1", snapshot(
+        {"nombre": "Arepa", "cantidad": 1, "personalizaciones": ["sin queso", "con huevo"]},
+        {"nombre": "Arepa", "cantidad": 1, "personalizaciones": ["con huevo", "sin queso"]},
+        {"nombre": "Tinto", "cantidad": 1},
+    ))
+    current = snapshot(
+        {"nombre": "Arepa", "cantidad": 1, "personalizaciones": ["sin queso", "con huevo"]},
+        {"nombre": "Jugo", "cantidad": 2},
+    )
+    assert changes(history.get("c1"), current) == [
+        ("Arepa", ("sin queso", "con huevo"), "-1", "1"),
+        ("Jugo", (), "+2", ""),
+        ("Tinto", (), "-1", "0"),
+    ]
+
+
+def add_ticket(history, mesa, usuario="Ana", external_id="", data=b"ticket"):
+    ticket = decode_ticket({"mesas": [{"numero": mesa}], "usuario": {"nombre": usuario}})
+    return history.add(ticket, f"job-{mesa}", external_id, PRINTER_NAME, "cocina", data)
+
+
+def test_ticket_history_search_filters_newest_first(tmp_path):
+    history = TicketHistory(str(tmp_path / "ticket_history.db"))
+    first = add_ticket(history, "5", external_id="ext-1")
+    second = add_ticket(history, "7", usuario="Luis", external_id="ext-2")
+    third = add_ticket(history, "5", usuario="Luis", external_id="ext-3")
+
+    assert [t["id"] for t in history.search()] == [third, second, first]
+    assert [t["id"] for t in history.search(mesa="5")] == [third, first]
+    assert [t["id"] for t in history.search(usuario="Luis", mesa="5")] == [third]
+    assert [t["id"] for t in history.search(external_id="ext-2")] == [second]
+    assert [t["id"] for t in history.search(limit=2)] == [third, second]
+    assert history.search(desde=time.time() + 60) == []
+    assert len(history.search(desde=time.time() - 60, hasta=time.time() + 60)) == 3
+    assert history.search(external_id="ext-2")[0]["impresora"] == PRINTER_NAME
+
+
+def test_ticket_history_trims_oldest_tickets_over_max_bytes(tmp_path):
+    path = str(tmp_path / "ticket_history.db")
+    history = TicketHistory(path, max_bytes=10_000)
+    ids = [add_ticket(history, str(mesa), data=os.urandom(1500)) for mesa in range(10)]
+
+    # Se borra desde el más viejo y, al recortar, se baja al 90% del límite
+    kept = [t["id"] for t in history.search(limit=50)]
+    assert 0 < len(kept) < len(ids)
+    assert kept == list(reversed(ids[-len(kept):]))
+    assert history.total <= 10_000
+    assert history.load(ids[:1]) == []
+
+    # Al abrir con un límite menor se recorta también lo guardado
+    smaller = TicketHistory(path, max_bytes=4_000)
+    remaining = [t["id"] for t in smaller.search(limit=50)]
+    assert remaining == kept[:len(remaining)]
+    assert 0 < smaller.total <= 3_600
+
+def test_ticket_history_reprint_adds_the_header(tmp_path, fake_spool):
+    history = TicketHistory(str(tmp_path / "ticket_history.db"))
+    ticket_id = add_ticket(history, "5", external_id="ext-1", data=b"ticket")
+    assert history.reprint(external_id="ext-1") == [ticket_id]
+    ((_, _, data, _),) = fake_spool.queues[PRINTER_NAME]
+    assert data == REPRINT_HEADER + b"ticket"
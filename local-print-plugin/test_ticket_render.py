@@ -0,0 +1,194 @@
+"""
+Pruebas unitarias del render de tickets (sin impresora ni backend):
+
+    python -m pytest test_ticket_render.py -q
+"""
+
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+import ticket_render
+from ticket_render import (
+    PRINTER_PROFILES,
+    RenderCache,
+    code128_data,
+    decode_document,
+    decode_ticket,
+    escpos_code128,
+    order_code_block,
+    render_document,
+    render_ticket,
+)
+
+
+class FakeClock(datetime):
+    """datetime.now() controlado por la prueba."""
+
+    current = datetime(2026, 10, 19, 21, 5, 10)
+
+    @classmethod
+    def now(cls, tz=None):  # noqa: ARG003
+        return cls.current
+
+
+def ticket_payload():
+    return {"mesas": [{"numero": "5"}], "usuario": {"nombre": "Ana"}, "items": [{"nombre": "Arepa", "cantidad": 2}]}
+
+
+def test_cached_ticket_prints_time_of_each_print():
+    cache = RenderCache()
+    ticket = decode_ticket(ticket_payload())
+    with mock.patch.object(ticket_render, "datetime", FakeClock):
+        FakeClock.current = datetime(2026, 10, 19, 21, 5, 10)
+        first = render_ticket(ticket, cache=cache)
+        FakeClock.current = datetime(2026, 10, 19, 21, 5, 50)
+        same_minute = render_ticket(ticket, cache=cache)
+        FakeClock.current = datetime(2026, 10, 19, 21, 17, 0)
+        later = render_ticket(ticket, cache=cache)
+
+    assert b"21:05" in first
+    assert same_minute is first
+    assert b"21:17" in later and b"21:05" not in later
+    assert cache.hits == 1
+
+
+def test_cached_document_without_date_prints_time_of_each_print():
+    cache = RenderCache()
+    doc = decode_document("receipt", {"items": [{"nombre": "Arepa", "cantidad": 1, "precio_unitario": 5000}], "total": 5000})
+    with mock.patch.object(ticket_render, "datetime", FakeClock):
+        FakeClock.current = datetime(2026, 10, 19, 21, 5, 0)
+        first = render_document(doc, cache=cache)
+        FakeClock.current = datetime(2026, 10, 19, 22, 40, 0)
+        later = render_document(doc, cache=cache)
+
+    assert b"21:05" in first
+    assert b"22:40" in later and b"21:05" not in later
+
+
+def test_document_with_own_date_is_cached_across_minutes():
+    cache = RenderCache()
+    doc = decode_document("receipt", {"fecha": "2026-10-19 20:00", "items": [], "total": 0})
+    with mock.patch.object(ticket_render, "datetime", FakeClock):
+        FakeClock.current = datetime(2026, 10, 19, 21, 5, 0)
+        first = render_document(doc, cache=cache)
+        FakeClock.current = datetime(2026, 10, 19, 22, 40, 0)
+        later = render_document(doc, cache=cache)
+
+    assert later is first
+    assert b"2026-10-19 20:00" in first
+
+
+def profile(nombre):
+    return next(candidate for candidate in PRINTER_PROFILES if candidate.nombre == nombre)
+
+
+def test_code128_escapes_brace():
+    data = escpos_code128("A{B")
+    assert data.endswith(bytes([0x1D, 0x6B, 0x49, 6]) + b"{BA{{B")
+
+
+def test_code128_rejects_non_ascii_and_long_values():
+    assert code128_data("PEDIDO-Ñ") is None
+    assert code128_data("A" * 253) is not None
+    assert code128_data("A" * 254) is None
+    assert code128_data("{" * 127) is None
+    with pytest.raises(ValueError):
+        escpos_code128("caña")
+
+
+def test_order_code_falls_back_to_text_when_code128_cannot_encode():
+    star = profile("star-tsp")  # Code128 sin QR
+    assert b"\x1dkI" in order_code_block("A-1", "code128", star)
+    block = order_code_block("Ñ-1", "code128", star)
+    assert b"\x1dkI" not in block
+    assert "PEDIDO Ñ-1".encode(star.encoding) in block
+
+
+def document_lines_of(data):
+    """Líneas de los bytes renderizados; cada una conserva sus comandos de estilo."""
+    return data.split(b"\n")
+
+
+def test_receipt_breaks_down_vat_included_in_the_total():
+    doc = decode_document("receipt", {
+        "fecha": "2026-10-19 21:05",
+        "mesas": [{"salon": "A", "numero": "5"}],
+        "usuario": {"nombre": "Ana"},
+        "items": [
+            {"nombre": "Arepa", "cantidad": 2, "precio_unitario": 5000, "subtotal": 10000, "personalizaciones": ["sin queso"]},
+            {"nombre": "Limonada", "cantidad": 1, "precio_unitario": 1900, "subtotal": 1900},
+        ],
+        "total": 11900,
+        "porcentaje_iva": 19,
+        "metodo_pago": "efectivo",
+        "monto_pagado": 20000,
+        "cambio": 8100,
+    })
+    lines = document_lines_of(render_document(doc))
+    assert b"\x1bE\x01" + b"RECIBO DE PAGO".center(48).rstrip() + b"\x1bE\x00" in lines
+    assert b"Mesa(s): A-5" in lines and b"Atendido por: Ana" in lines
+    assert b"   2 Arepa                       5.000    10.000" in lines
+    assert b"     sin queso" in lines
+    assert b"SUBTOTAL" + b"10.000".rjust(40) in lines
+    assert b"IVA 19%" + b"1.900".rjust(41) in lines
+    # TOTAL en negrita y doble alto, con el ancho de columnas normal
+    assert b"\x1bE\x01\x1d!\x01TOTAL" + b"$11.900".rjust(43) + b"\x1d!\x00\x1bE\x00" in lines
+    assert b"EFECTIVO" + b"20.000".rjust(40) in lines
+    assert b"CAMBIO" + b"8.100".rjust(42) in lines
+    assert b"GRACIAS POR SU COMPRA".center(48).rstrip() in lines
+    assert lines[-1].endswith(b"\x1dV\x00")
+
+
+def test_invoice_on_58mm_prints_company_header_taxes_and_two_line_items():
+    doc = decode_document("invoice", {
+        "__format": {"paperWidth": "58mm"},
+        "numero": "FE-123",
+        "fecha": "2026-10-19 21:05",
+        "empresa": {"nombre": "Montis", "nit": "900.123.456-7", "responsable_iva": True, "direccion": "Calle 1"},
+        "cliente": {"nombre": "Luis", "documento": "123"},
+        "items": [{"nombre": "Bandeja paisa especial", "cantidad": 1, "precio_unitario": 32000, "subtotal": 32000}],
+        "subtotal": 30000,
+        "impuestos": [{"nombre": "INC", "tarifa": 8, "base": 30000, "valor": 2400}],
+        "total": 32400,
+        "pagos": [{"metodo": "tarjeta", "valor": 32400}],
+    })
+    lines = document_lines_of(render_document(doc))
+    assert b"\x1bE\x01" + b"Montis".center(32).rstrip() + b"\x1bE\x00" in lines
+    assert b"NIT: 900.123.456-7".center(32).rstrip() in lines
+    assert b"RESPONSABLE DE IVA".center(32).rstrip() in lines
+    assert b"\x1bE\x01" + b"FACTURA DE VENTA".center(32).rstrip() + b"\x1bE\x00" in lines
+    assert b"No. FE-123".center(32).rstrip() in lines
+    assert b"Cliente: Luis" in lines and b"Doc.: 123" in lines
+    assert b"1x Bandeja paisa especial" in lines
+    assert b"  1 x 32.000" + b"32.000".rjust(20) in lines
+    assert b"INC 8%" + b"2.400".rjust(26) in lines
+    assert b"INC 8%          30.000     2.400" in lines
+    assert b"TARJETA" + b"32.400".rjust(25) in lines
+
+
+def test_cash_close_prints_summary_with_decimals_and_no_footer():
+    doc = decode_document("cash_close", {
+        "fecha": "2026-10-19 23:00",
+        "caja": "Principal",
+        "usuario": {"nombre": "Luis"},
+        "datos": [{"etiqueta": "Desde", "valor": "2026-10-19 08:00"}],
+        "resumen_titulo": "VENTAS POR MEDIO DE PAGO",
+        "resumen": [
+            {"metodo": "efectivo", "cantidad": 12, "valor": 250000},
+            {"metodo": "tarjeta", "cantidad": 3, "valor": 90500.5},
+        ],
+        "total": 340500.5,
+        "decimales": 2,
+    })
+    lines = document_lines_of(render_document(doc))
+    assert b"\x1bE\x01" + b"CIERRE DE CAJA".center(48).rstrip() + b"\x1bE\x00" in lines
+    fecha = lines.index(b"Fecha: 2026-10-19 23:00")
+    assert lines[fecha + 1:fecha + 4] == [b"Caja: Principal", b"Cajero: Luis", b"Desde: 2026-10-19 08:00"]
+    assert b"\x1bE\x01VENTAS POR MEDIO DE PAGO\x1bE\x00" in lines
+    assert b"EFECTIVO (12)" + b"250.000,00".rjust(35) in lines
+    assert b"TARJETA (3)" + b"90.500,50".rjust(37) in lines
+    assert b"\x1bE\x01\x1d!\x01TOTAL" + b"$340.500,50".rjust(43) + b"\x1d!\x00\x1bE\x00" in lines
+    assert b"FORMA DE PAGO" not in b"\n".join(lines)
+    assert b"GRACIAS POR SU COMPRA" not in b"\n".join(lines)
@@ -0,0 +1,346 @@
+"""
+Historial local del agente en APP_DIR: último estado impreso de cada comanda (para imprimir solo
+la diferencia en las ediciones), tickets ya renderizados para reimprimir sin la nube y el journal
+de jobs impresos cuyo ack pudo no llegar al backend.
+
+Lo usa printer_agent.py (también desde --historial / --reimprimir y las rutas locales).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from spooler import spool_write
+from ticket_render import TicketItem, TicketPayload
+
+COMANDA_HISTORY_DAYS = 2
+# Historial local de tickets impresos (bytes ESC/POS) para reimprimir sin la nube:
+# --historial / --reimprimir o GET /historial y POST /reimprimir desde el propio PC. 0 = desactivado.
+TICKET_HISTORY_MAX_MB = float(os.getenv("MONTIS_TICKET_HISTORY_MB", "50") or 0)
+TICKET_HISTORY_LIMIT = 20
+PRINTED_JOURNAL_SIZE = 500
+# Encabezado de las reimpresiones (ESC @, centrado y negrita) para que cocina no repita el pedido
+REPRINT_HEADER = b"\x1b@\x1ba\x01\x1bE\x01*** REIMPRESION ***\n\x1bE\x00\x1ba\x00"
+
+
+def ensure_parent_dir(path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+
+def _quantity(value: Optional[str]) -> float:
+    try:
+        return float(value) if value is not None else 1.0
+    except ValueError:
+        return 1.0
+
+
+def _quantity_text(value: float) -> str:
+    return str(int(value)) if value == int(value) else f"{value:g}"
+
+
+def comanda_lines(snapshot: tuple[TicketItem, ...]) -> Dict[str, tuple[float, TicketItem]]:
+    """Agrupa el estado de la comanda por línea: key -> (cantidad total, primer ítem)."""
+    lines: Dict[str, tuple[float, TicketItem]] = {}
+    for item in snapshot:
+        cantidad, first = lines.get(item.key, (0.0, item))
+        lines[item.key] = (cantidad + _quantity(item.cantidad), first)
+    return lines
+
+
+def diff_items(previous: Dict[str, tuple[float, TicketItem]], snapshot: tuple[TicketItem, ...]) -> tuple[TicketItem, ...]:
+    """Líneas agregadas (+N), reducidas (-N) y canceladas (total 0) respecto a lo ya impreso."""
+    current = comanda_lines(snapshot)
+    changes: list[TicketItem] = []
+    for key, (cantidad, item) in current.items():
+        anterior = previous[key][0] if key in previous else 0.0
+        if cantidad == anterior:
+            continue
+        delta = cantidad - anterior
+        changes.append(
+            replace(
+                item,
+                cantidad=("+" if delta > 0 else "-") + _quantity_text(abs(delta)),
+                total=_quantity_text(cantidad) if anterior else "",
+            )
+        )
+    for key, (anterior, item) in previous.items():
+        if key not in current:
+            changes.append(replace(item, cantidad=f"-{_quantity_text(anterior)}", total="0"))
+    return tuple(changes)
+
+
+class ComandaHistory:
+    """
+    Último estado impreso de cada comanda (SQLite en APP_DIR, clave primaria comanda_id).
+    Permite imprimir en las ediciones solo la diferencia contra lo que ya salió en papel.
+    Los registros de más de COMANDA_HISTORY_DAYS días se descartan al abrir.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn: Any = None
+
+    def _connect(self) -> Any:
+        if self.conn is None:
+            import sqlite3
+
+            ensure_parent_dir(self.path)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS comandas ("
+                "comanda_id TEXT PRIMARY KEY, items TEXT NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_comandas_updated_at ON comandas(updated_at)")
+            conn.execute("DELETE FROM comandas WHERE updated_at < ?", (time.time() - COMANDA_HISTORY_DAYS * 86400,))
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def get(self, comanda_id: str) -> Optional[Dict[str, tuple[float, TicketItem]]]:
+        """Líneas ya impresas de la comanda, o None si no se imprimió desde este agente."""
+        with self.lock:
+            row = self._connect().execute("SELECT items FROM comandas WHERE comanda_id = ?", (comanda_id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return {
+                key: (float(cantidad), TicketItem(nombre=nombre, personalizaciones=tuple(personalizaciones)))
+                for key, cantidad, nombre, personalizaciones in json.loads(row[0])
+            }
+        except Exception:
+            return None
+
+    def save(self, comanda_id: str, snapshot: tuple[TicketItem, ...]) -> None:
+        lines = [
+            [key, cantidad, item.nombre, list(item.personalizaciones)]
+            for key, (cantidad, item) in comanda_lines(snapshot).items()
+        ]
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO comandas (comanda_id, items, updated_at) VALUES (?, ?, ?)",
+                (comanda_id, json.dumps(lines, ensure_ascii=False), time.time()),
+            )
+            conn.commit()
+
+
+class TicketHistory:
+    """
+    Tickets ya renderizados (bytes ESC/POS comprimidos) en SQLite, indexados por fecha, mesa,
+    external_id y usuario, para reimprimir al instante y sin internet. El archivo se mantiene
+    por debajo de max_bytes borrando los tickets más viejos.
+    """
+
+    def __init__(self, path: str, max_bytes: int = int(TICKET_HISTORY_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn: Any = None
+        self.total = 0
+
+    def _connect(self) -> Any:
+        if self.conn is None:
+            import sqlite3
+
+            ensure_parent_dir(self.path)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tickets ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, printed_at REAL NOT NULL, job_id TEXT NOT NULL, "
+                "external_id TEXT NOT NULL, comanda_id TEXT NOT NULL, mesa TEXT NOT NULL, usuario TEXT NOT NULL, "
+                "impresora TEXT NOT NULL, estaciones TEXT NOT NULL, size INTEGER NOT NULL, data BLOB NOT NULL)"
+            )
+            for column in ("printed_at", "external_id", "mesa", "usuario"):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_tickets_{column} ON tickets({column})")
+            self.total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM tickets").fetchone()[0]
+            self._trim(conn)
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def _trim(self, conn: Any) -> None:
+        if self.total <= self.max_bytes:
+            return
+        # Se libera hasta el 90% del límite para no recortar en cada ticket nuevo
+        excess = self.total - int(self.max_bytes * 0.9)
+        freed, last_id = 0, None
+        for ticket_id, size in conn.execute("SELECT id, size FROM tickets ORDER BY id"):
+            freed += size
+            last_id = ticket_id
+            if freed >= excess:
+                break
+        if last_id is not None:
+            conn.execute("DELETE FROM tickets WHERE id <= ?", (last_id,))
+            self.total -= freed
+
+    def add(self, ticket: TicketPayload, job_id: str, external_id: str, printer_name: str, stations: str, data: bytes) -> int:
+        import zlib
+
+        blob = zlib.compress(data, 6)
+        with self.lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                "INSERT INTO tickets (printed_at, job_id, external_id, comanda_id, mesa, usuario, impresora, "
+                "estaciones, size, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(), job_id, external_id, ticket.comanda_id, ", ".join(ticket.mesas),
+                    ticket.usuario, printer_name, stations, len(blob), blob,
+                ),
+            )
+            self.total += len(blob)
+            self._trim(conn)
+            conn.commit()
+            return int(cursor.lastrowid)
+
+    def search(
+        self,
+        mesa: str = "",
+        external_id: str = "",
+        usuario: str = "",
+        desde: Optional[float] = None,
+        hasta: Optional[float] = None,
+        limit: int = TICKET_HISTORY_LIMIT,
+    ) -> list[Dict[str, Any]]:
+        """Tickets que cumplen los filtros, del más nuevo al más viejo (sin los bytes)."""
+        clauses: list[str] = []
+        params: list[Any] = []
+        for column, value in (("mesa", mesa), ("external_id", external_id), ("usuario", usuario)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if desde is not None:
+            clauses.append("printed_at >= ?")
+            params.append(desde)
+        if hasta is not None:
+            clauses.append("printed_at < ?")
+            params.append(hasta)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT id, printed_at, job_id, external_id, comanda_id, mesa, usuario, impresora, estaciones "
+                f"FROM tickets{where} ORDER BY id DESC LIMIT ?",
+                (*params, max(1, limit)),
+            ).fetchall()
+        columns = ("id", "printed_at", "job_id", "external_id", "comanda_id", "mesa", "usuario", "impresora", "estaciones")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def load(self, ticket_ids: list[int]) -> list[tuple[int, str, bytes]]:
+        """(id, impresora, bytes) de cada ticket encontrado, en el orden en que se imprimieron."""
+        import zlib
+
+        if not ticket_ids:
+            return []
+        marks = ", ".join("?" for _ in ticket_ids)
+        with self.lock:
+            rows = self._connect().execute(
+                f"SELECT id, impresora, data FROM tickets WHERE id IN ({marks}) ORDER BY id", tuple(ticket_ids)
+            ).fetchall()
+        return [(ticket_id, printer_name, zlib.decompress(blob)) for ticket_id, printer_name, blob in rows]
+
+    def reprint(
+        self,
+        ticket_id: Optional[int] = None,
+        external_id: str = "",
+        printer_name: str = "",
+        write: Callable[[str, bytes], Any] = spool_write,
+    ) -> list[int]:
+        """
+        Reenvía al spooler los bytes guardados (con REPRINT_HEADER), sin pasar por la nube.
+        Por external_id se reimprimen todas sus partes (una por impresora). printer_name la
+        reemplaza, p. ej. si la impresora original está fuera de servicio. El agente pasa en
+        write su escritura por PrinterPool (grupos y circuit breaker).
+        """
+        if ticket_id is not None:
+            ids = [ticket_id]
+        elif external_id:
+            ids = [entry["id"] for entry in self.search(external_id=external_id, limit=50)]
+        else:
+            raise ValueError("Indique el id del ticket o el external_id")
+        tickets = self.load(ids)
+        if not tickets:
+            raise LookupError("Ticket no encontrado en el historial local")
+        for _, original_printer, data in tickets:
+            write(printer_name or original_printer, REPRINT_HEADER + data)
+        return [ticket_id for ticket_id, _, _ in tickets]
+
+
+def parse_history_time(value: Any) -> Optional[float]:
+    """Fecha local "2026-10-19" o "2026-10-19 21:30" (o epoch en segundos) -> timestamp."""
+    if value in (None, ""):
+        return None
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"Fecha inválida: {text}") from None
+
+
+class PrintedJournal:
+    """
+    Ids de jobs ya impresos, persistidos en APP_DIR (un id por línea).
+    Si el ack no llegó al backend (caída, reinicio) el job no se vuelve a imprimir.
+    """
+
+    def __init__(self, path: str, size: int = PRINTED_JOURNAL_SIZE):
+        self.path = path
+        self.size = size
+        self.lock = threading.Lock()
+        self.ids: OrderedDict[str, None] = OrderedDict()
+        self.lines = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    job_id = line.strip()
+                    if job_id:
+                        self.ids[job_id] = None
+                        self.ids.move_to_end(job_id)
+                        self.lines += 1
+            while len(self.ids) > self.size:
+                self.ids.popitem(last=False)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            self.ids.clear()
+
+    def __contains__(self, job_id: object) -> bool:
+        with self.lock:
+            return job_id in self.ids
+
+    def add(self, job_id: str) -> None:
+        if not job_id:
+            return
+        with self.lock:
+            self.ids[job_id] = None
+            while len(self.ids) > self.size:
+                self.ids.popitem(last=False)
+            try:
+                ensure_parent_dir(self.path)
+                if self.lines >= self.size * 2:
+                    # Compactar: reescribir solo los ids vigentes
+                    tmp_path = self.path + ".tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write("".join(f"{value}\n" for value in self.ids))
+                    os.replace(tmp_path, self.path)
+                    self.lines = len(self.ids)
+                else:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(f"{job_id}\n")
+                    self.lines += 1
+            except Exception:
+                pass
@@ -0,0 +1,1023 @@
+"""
+Render compartido de comandas y documentos de caja (recibo, factura, cierre de caja):
+payload estructurado -> texto -> bytes ESC/POS.
+
+Lo usan el agente remoto (printer_agent.py) y el servidor local (server.py, POST /imprimir con
+"payload"), así ambos caminos producen exactamente los mismos bytes para el mismo pedido y perfil
+de impresora. Sin dependencias externas (orjson es opcional) para que ambos ejecutables lo empaqueten.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Optional, Union
+
+# orjson es opcional: si está instalado decodifica los jobs 2-3x más rápido que json, pero en
+# una respuesta típica de claim eso son decenas de µs frente a un round-trip HTTP de decenas de ms.
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+MAX_COPIES = 5
+# Código del pedido al pie del ticket (QR o Code128) para que expo lo escanee
+ORDER_CODES = ("qr", "code128")
+ORDER_CODE_MAX_LEN = 64
+PAPER_DOTS = {"58mm": 384, "80mm": 576}
+# GS k 73 lleva el largo de los datos en un solo byte
+CODE128_MAX_BYTES = 255
+RENDER_CACHE_SIZE = 64
+RENDER_CACHE_TTL_SECONDS = 600
+# Tipos de job de caja (el resto son comandas de cocina)
+DOCUMENT_TYPES = ("receipt", "invoice", "cash_close")
+DOCUMENT_TITLES = {"receipt": "RECIBO DE PAGO", "invoice": "FACTURA DE VENTA", "cash_close": "CIERRE DE CAJA"}
+DOCUMENT_FOOTER = ("GRACIAS POR SU COMPRA", "VUELVA PRONTO")
+
+
+@dataclass(frozen=True)
+class PrinterProfile:
+    """
+    Capacidades ESC/POS de un modelo de impresora. Las columnas dependen del ancho de
+    cabezal (576 puntos en la mayoría de térmicas de 80 mm, 512 en la TM-T88).
+    """
+
+    nombre: str
+    # Subcadenas (en mayúsculas) que identifican el modelo en el nombre o driver de Windows
+    match: tuple[str, ...] = ()
+    columnas_80mm: tuple[int, int] = (48, 48)  # (Font A, Font B)
+    columnas_58mm: tuple[int, int] = (32, 32)
+    font_b: bool = False
+    # GS V 66 n: avanza hasta la cuchilla y hace corte parcial en un solo comando
+    corte_parcial: bool = False
+    # ESC 3 n (puntos); None deja el interlineado por defecto (30 puntos)
+    interlineado: Optional[int] = None
+    lineas_antes_de_corte: int = 3
+    codepage: int = 2  # ESC t n
+    encoding: str = "cp850"
+    # Simbologías nativas: QR con GS ( k (modelo 2) y Code128 con GS k 73
+    qr: bool = False
+    code128: bool = False
+
+    def columns(self, paper_width: str, font_size: str) -> int:
+        font_a, font_b = self.columnas_58mm if paper_width == "58mm" else self.columnas_80mm
+        if font_size == "large":
+            return font_a // 2
+        if font_size == "small" and self.font_b:
+            return font_b
+        return font_a
+
+
+GENERIC_PROFILE = PrinterProfile(nombre="generico")
+
+PRINTER_PROFILES: tuple[PrinterProfile, ...] = (
+    PrinterProfile(
+        nombre="epson-tm-t88",
+        match=("TM-T88",),
+        columnas_80mm=(42, 56),
+        columnas_58mm=(30, 40),
+        font_b=True,
+        corte_parcial=True,
+        interlineado=24,
+        lineas_antes_de_corte=0,
+        qr=True,
+        code128=True,
+    ),
+    PrinterProfile(
+        nombre="epson-tm",
+        match=("TM-T20", "TM-T82", "TM-M30", "TM-T70", "EPSON"),
+        columnas_80mm=(48, 64),
+        columnas_58mm=(32, 42),
+        font_b=True,
+        corte_parcial=True,
+        interlineado=24,
+        lineas_antes_de_corte=0,
+        qr=True,
+        code128=True,
+    ),
+    PrinterProfile(
+        nombre="star-tsp",
+        match=("TSP1", "TSP6", "TSP7", "STAR"),
+        columnas_80mm=(48, 64),
+        columnas_58mm=(32, 42),
+        font_b=True,
+        corte_parcial=True,
+        interlineado=24,
+        lineas_antes_de_corte=0,
+        # En emulación ESC/POS las TSP no interpretan GS ( k: el pedido sale en Code128
+        code128=True,
+    ),
+    PrinterProfile(
+        nombre="bixolon-srp",
+        match=("SRP-", "BIXOLON"),
+        columnas_80mm=(48, 64),
+        columnas_58mm=(32, 42),
+        font_b=True,
+        corte_parcial=True,
+        interlineado=24,
+        lineas_antes_de_corte=0,
+        qr=True,
+        code128=True,
+    ),
+    PrinterProfile(
+        # Genéricas chinas (Xprinter y clones "POS-80"): Font B fiable, corte GS V sin avance
+        nombre="xprinter",
+        match=("XP-", "XPRINTER", "POS-80", "POS80", "POS-58", "POS58"),
+        columnas_80mm=(48, 64),
+        columnas_58mm=(32, 42),
+        font_b=True,
+        interlineado=26,
+        lineas_antes_de_corte=3,
+        qr=True,
+        code128=True,
+    ),
+)
+
+PROFILES_BY_NAME = {profile.nombre: profile for profile in (GENERIC_PROFILE, *PRINTER_PROFILES)}
+
+def match_profile(printer_name: Optional[str], description: str = "") -> PrinterProfile:
+    """Primer perfil cuyo patrón aparezca en el nombre o driver de la impresora; genérico si ninguno coincide."""
+    haystack = f"{printer_name or ''} {description}".upper()
+    return next(
+        (candidate for candidate in PRINTER_PROFILES if any(token in haystack for token in candidate.match)),
+        GENERIC_PROFILE,
+    )
+
+
+def escpos_font_cmd(font_size: str, profile: PrinterProfile = GENERIC_PROFILE) -> bytes:
+    font_size = (font_size or '').lower()
+    font = b""
+    if profile.font_b:
+        # ESC M n: Font A (0) / Font B (1, más columnas por línea)
+        font = bytes([0x1B, 0x4D, 1 if font_size == 'small' else 0])
+    # GS ! n
+    if font_size == 'large':
+        return font + bytes([0x1D, 0x21, 0x11])
+    return font + bytes([0x1D, 0x21, 0x00])
+
+
+def escpos_wrap(
+    text: Union[str, bytes],
+    encoding: Optional[str] = None,
+    cut: bool = True,
+    font_size: str = 'normal',
+    profile: PrinterProfile = GENERIC_PROFILE,
+    trailer: bytes = b"",
+) -> bytes:
+    esc_init = bytes([0x1B, 0x40])
+    esc_codepage = bytes([0x1B, 0x74, profile.codepage])
+    # bytes = cuerpo ya codificado con sus propios comandos de estilo (documentos de caja)
+    payload = text if isinstance(text, bytes) else text.encode(encoding or profile.encoding, errors="replace")
+    data = esc_init + esc_codepage + escpos_font_cmd(font_size, profile)
+    if profile.interlineado is not None:
+        data += bytes([0x1B, 0x33, profile.interlineado])
+    data += payload
+    if trailer:
+        # Comandos al pie (código del pedido) antes del avance y el corte
+        data += b"\n" + trailer
+    data += b"\n" * (profile.lineas_antes_de_corte or 1)
+    if cut:
+        if profile.corte_parcial:
+            # GS V 66 0: avance mínimo hasta la cuchilla + corte parcial
+            data += bytes([0x1D, 0x56, 0x42, 0x00])
+        else:
+            data += bytes([0x1D, 0x56, 0x00])
+    return data
+
+
+def escpos_qr(value: str, module: int = 6) -> bytes:
+    """QR modelo 2 con GS ( k: modelo, tamaño de módulo, corrección M, guardar e imprimir."""
+    data = value.encode("utf-8")
+    size = len(data) + 3
+    return (
+        bytes([0x1D, 0x28, 0x6B, 0x04, 0x00, 0x31, 0x41, 0x32, 0x00])
+        + bytes([0x1D, 0x28, 0x6B, 0x03, 0x00, 0x31, 0x43, module])
+        + bytes([0x1D, 0x28, 0x6B, 0x03, 0x00, 0x31, 0x45, 0x31])
+        + bytes([0x1D, 0x28, 0x6B, size & 0xFF, size >> 8, 0x31, 0x50, 0x30])
+        + data
+        + bytes([0x1D, 0x28, 0x6B, 0x03, 0x00, 0x31, 0x51, 0x30])
+    )
+
+
+def code128_width(value: str, module: int) -> int:
+    """Ancho en puntos de un Code128 juego B: inicio + datos + verificador (11 módulos c/u), fin (13) y zonas quietas."""
+    return (11 * (len(value) + 2) + 13 + 20) * module
+
+
+def code128_data(value: str) -> Optional[bytes]:
+    """
+    Datos de GS k 73 para un Code128 juego B: "{B" + el valor con "{" escapado como "{{" (la
+    impresora lo toma como prefijo de función). None si el valor no es ASCII imprimible o no entra
+    en el byte de largo del comando.
+    """
+    if not value.isascii() or not value.isprintable():
+        return None
+    data = b"{B" + value.encode("ascii").replace(b"{", b"{{")
+    return data if len(data) <= CODE128_MAX_BYTES else None
+
+
+def escpos_code128(value: str, module: int = 2, height: int = 80) -> bytes:
+    """Code128 juego B con GS k 73 y el texto legible (HRI) debajo. ValueError si el valor no es codificable."""
+    data = code128_data(value)
+    if data is None:
+        raise ValueError(f"valor no codificable en Code128: {value!r}")
+    return (
+        bytes([0x1D, 0x68, height])  # GS h: alto en puntos
+        + bytes([0x1D, 0x77, module])  # GS w: ancho de módulo
+        + bytes([0x1D, 0x48, 0x02])  # GS H: HRI debajo
+        + bytes([0x1D, 0x66, 0x00])  # GS f: HRI en Font A
+        + bytes([0x1D, 0x6B, 0x49, len(data)])
+        + data
+    )
+
+
+def order_code_block(value: str, kind: str, profile: PrinterProfile, paper_width: str = "80mm") -> bytes:
+    """
+    Código del pedido al pie del ticket con los comandos nativos de la impresora (unas decenas de
+    bytes en lugar de una imagen raster). Si el perfil no soporta la simbología pedida (o un Code128
+    no entra en el ancho del papel) se usa la otra, y si ninguna sirve el valor sale como texto.
+    """
+    if not value or kind not in ORDER_CODES:
+        return b""
+    center, left = bytes([0x1B, 0x61, 0x01]), bytes([0x1B, 0x61, 0x00])
+    value = value[:ORDER_CODE_MAX_LEN]
+    paper_dots = PAPER_DOTS.get(paper_width, PAPER_DOTS["80mm"])
+
+    for symbology in ("qr", "code128") if kind == "qr" else ("code128", "qr"):
+        if symbology == "qr" and profile.qr:
+            module = 4 if paper_width == "58mm" else 6
+            caption = value.encode(profile.encoding, errors="replace")
+            return center + escpos_qr(value, module) + b"\n" + caption + b"\n" + left
+        if symbology == "code128" and profile.code128 and code128_data(value) is not None:
+            # Módulos de 1 punto (0,125 mm) no se leen bien: un valor largo pasa a QR o a texto
+            module = next((m for m in (3, 2) if code128_width(value, m) <= paper_dots), 0)
+            if module:
+                return center + escpos_code128(value, module) + b"\n" + left
+
+    columns = profile.columns(paper_width, "normal")
+    text = f"PEDIDO {value}"
+    if len(text) <= columns // 2:
+        # GS ! 0x11: doble ancho y alto
+        body = bytes([0x1D, 0x21, 0x11]) + text.encode(profile.encoding, errors="replace") + bytes([0x1D, 0x21, 0x00])
+    else:
+        body = "\n".join(dividir_texto(text, columns)).encode(profile.encoding, errors="replace")
+    return center + body + b"\n" + left
+
+
+def dividir_texto(texto: str, max_len: int) -> list[str]:
+    if len(texto) <= max_len:
+        return [texto]
+    palabras = texto.split(" ")
+    lineas: list[str] = []
+    actual = ""
+    for palabra in palabras:
+        candidate = (actual + " " + palabra).strip()
+        if len(candidate) <= max_len:
+            actual = candidate
+        else:
+            if actual:
+                lineas.append(actual)
+            actual = palabra
+    if actual:
+        lineas.append(actual)
+    return lineas
+
+
+def json_loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+class JobDecodeError(ValueError):
+    """Payload de job mal formado; el job se rechaza (ack failed) sin reintentos."""
+
+
+# Los structs de ticket no se modifican tras decodificar (se usa dataclasses.replace), por eso
+# son hashables sin ser frozen: frozen=True triplica el costo de construirlos.
+
+
+@dataclass(slots=True, unsafe_hash=True)
+class TicketFormat:
+    paper_width: str = "80mm"
+    font_size: str = "normal"
+    # Fuera de la igualdad/hash: N copias del mismo pedido comparten el render en caché
+    copies: int = field(default=1, compare=False)
+    # "qr" | "code128" | "" (sin código del pedido)
+    order_code: str = ""
+
+
+@dataclass(slots=True, unsafe_hash=True)
+class TicketItem:
+    nombre: str
+    cantidad: Optional[str] = None
+    personalizaciones: tuple[str, ...] = ()
+    observaciones: str = ""
+    producto_id: str = ""
+    categoria: str = ""
+    estacion: str = ""
+    # Solo en tickets de cambios: cantidad resultante tras la edición ("0" = cancelado)
+    total: str = ""
+
+    @property
+    def key(self) -> str:
+        """Identifica la línea de la comanda: producto + personalizaciones."""
+        return "|".join((self.producto_id or self.nombre, *sorted(self.personalizaciones)))
+
+
+@dataclass(slots=True, unsafe_hash=True)
+class TicketCliente:
+    nombre: str = "Cliente"
+    telefono: str = ""
+    direccion: str = ""
+    es_para_llevar: bool = False
+
+
+@dataclass(slots=True, unsafe_hash=True)
+class TicketPayload:
+    """
+    Payload de comanda ya validado. Los alias camelCase/snake_case se resuelven una sola vez
+    al decodificar; el render solo lee atributos. Es hashable: sirve directamente
+    como clave de RenderCache (campos volátiles como generado_en no se decodifican).
+    """
+
+    format: TicketFormat
+    tipo_pedido: str = "mesa"
+    usuario: str = "Usuario"
+    cliente: Optional[TicketCliente] = None
+    mesas: tuple[str, ...] = ()
+    items: tuple[TicketItem, ...] = ()
+    observaciones_generales: str = ""
+    raw_text: str = ""
+    estacion: str = ""
+    comanda_id: str = ""
+    # "completa" | "adicionales" (backend) | "cambios" (diff calculado por el agente)
+    modo: str = ""
+    snapshot: tuple[TicketItem, ...] = ()
+    # Valor del código al pie; vacío = comanda_id (el agente completa con external_id si falta)
+    codigo: str = ""
+
+    @property
+    def order_code_value(self) -> str:
+        return self.codigo or self.comanda_id
+
+
+@dataclass(slots=True, unsafe_hash=True)
+class DocumentLine:
+    descripcion: str
+    cantidad: str = ""
+    unitario: Optional[float] = None
+    total: Optional[float] = None
+    # Personalizaciones y observaciones, bajo la descripción
+    detalle: tuple[str, ...] = ()
+
+
+@dataclass(slots=True, unsafe_hash=True)
+class DocumentAmount:
+    concepto: str
+    valor: float
+    # Impuestos: base gravable y tarifa ("19%"); resumen de cierre: número de ventas
+    base: Optional[float] = None
+    tarifa: str = ""
+    cantidad: str = ""
+
+
+@dataclass(slots=True, unsafe_hash=True)
+class DocumentPayload:
+    """
+    Documento de caja ya validado (recibo, factura o cierre de caja). Igual que TicketPayload
+    es hashable y sirve como clave de RenderCache.
+    """
+
+    tipo: str
+    format: TicketFormat
+    titulo: str = ""
+    # Primera línea = nombre del negocio (en negrita)
+    encabezado: tuple[str, ...] = ()
+    numero: str = ""
+    fecha: str = ""
+    # (etiqueta, valor): mesa, cliente, cajero, período del cierre...
+    datos: tuple[tuple[str, str], ...] = ()
+    lineas: tuple[DocumentLine, ...] = ()
+    observaciones: str = ""
+    subtotal: Optional[float] = None
+    impuestos: tuple[DocumentAmount, ...] = ()
+    total: Optional[float] = None
+    pagos: tuple[DocumentAmount, ...] = ()
+    cambio: Optional[float] = None
+    resumen_titulo: str = ""
+    resumen: tuple[DocumentAmount, ...] = ()
+    pie: tuple[str, ...] = ()
+    decimales: int = 0
+    # Para el routing por estación y el historial local
+    usuario: str = ""
+    mesas: tuple[str, ...] = ()
+    estacion: str = "caja"
+
+
+def _first(data: Dict[str, Any], *keys: str) -> Any:
+    for key in keys:
+        value = data.get(key)
+        if value is not None:
+            return value
+    return None
+
+
+def _text(value: Any) -> str:
+    return "" if value is None else str(value)
+
+
+def clamp_copies(value: Any) -> int:
+    if value is None:
+        return 1
+    try:
+        return min(max(int(value), 1), MAX_COPIES)
+    except (TypeError, ValueError):
+        return 1
+
+
+def decode_format(fmt: Any, copies: Any = None) -> TicketFormat:
+    if not isinstance(fmt, dict):
+        fmt = {}
+    paper_width = str(_first(fmt, "paperWidth", "paper_width") or "80mm")
+    font_size = str(_first(fmt, "fontSize", "font_size") or "normal").lower()
+    order_code = str(_first(fmt, "orderCode", "order_code") or "").lower()
+    return TicketFormat(
+        paper_width,
+        font_size,
+        clamp_copies(copies if copies is not None else fmt.get("copies")),
+        order_code=order_code if order_code in ORDER_CODES else "",
+    )
+
+
+def decode_items(items_raw: Any, field_name: str) -> tuple[TicketItem, ...]:
+    if items_raw is None:
+        return ()
+    if not isinstance(items_raw, list):
+        raise JobDecodeError(f"{field_name} debe ser una lista")
+    items = []
+    for idx, item in enumerate(items_raw):
+        if not isinstance(item, dict):
+            raise JobDecodeError(f"{field_name}[{idx}] debe ser un objeto")
+        personalizaciones = item.get("personalizaciones") or []
+        if not isinstance(personalizaciones, list):
+            raise JobDecodeError(f"{field_name}[{idx}].personalizaciones debe ser una lista")
+        items.append(
+            TicketItem(
+                nombre=_text(item.get("nombre")) or "Producto",
+                cantidad=None if item.get("cantidad") is None else str(item.get("cantidad")),
+                personalizaciones=tuple(str(p) for p in personalizaciones if p),
+                observaciones=_text(item.get("observaciones")).strip(),
+                producto_id=_text(item.get("producto_id")),
+                categoria=_text(item.get("categoria")),
+                estacion=_text(_first(item, "estacion", "station")),
+            )
+        )
+    return tuple(items)
+
+
+def decode_ticket(payload: Any) -> TicketPayload:
+    """Convierte el payload JSON de un job en un TicketPayload. Lanza JobDecodeError si está mal formado."""
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        raise JobDecodeError(f"payload debe ser un objeto, llegó {type(payload).__name__}")
+
+    raw_text = payload.get("raw_text")
+    if raw_text is not None and not isinstance(raw_text, str):
+        raise JobDecodeError("raw_text debe ser texto")
+
+    items = decode_items(payload.get("items"), "items")
+    snapshot = decode_items(payload.get("snapshot_items"), "snapshot_items")
+
+    usuario = payload.get("usuario")
+    cliente_raw = payload.get("cliente")
+    cliente = None
+    if isinstance(cliente_raw, dict):
+        cliente = TicketCliente(
+            nombre=_text(cliente_raw.get("nombre")) or "Cliente",
+            telefono=_text(cliente_raw.get("telefono")),
+            direccion=_text(cliente_raw.get("direccion")),
+            es_para_llevar=bool(_first(cliente_raw, "es_para_llevar", "esParaLlevar")),
+        )
+    mesas_raw = payload.get("mesas") or []
+    if not isinstance(mesas_raw, list):
+        raise JobDecodeError("mesas debe ser una lista")
+
+    fmt = payload.get("__format")
+    return TicketPayload(
+        format=decode_format(fmt, payload.get("copies")),
+        tipo_pedido=str(_first(payload, "tipo_pedido", "tipoPedido") or "mesa"),
+        usuario=_text(usuario.get("nombre") if isinstance(usuario, dict) else None) or "Usuario",
+        cliente=cliente,
+        mesas=tuple(_text(m.get("numero")) for m in mesas_raw if isinstance(m, dict)),
+        items=items,
+        observaciones_generales=_text(payload.get("observaciones_generales")).strip(),
+        raw_text=raw_text or "",
+        estacion=_text(_first(fmt, "estacion", "station")) if isinstance(fmt, dict) else "",
+        comanda_id=_text(_first(payload, "comandaId", "comanda_id")),
+        modo=_text(payload.get("modo")),
+        snapshot=snapshot,
+        codigo=_text(payload.get("codigo")),
+    )
+
+
+def _amount(value: Any, field_name: str) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise JobDecodeError(f"{field_name} debe ser un número")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise JobDecodeError(f"{field_name} debe ser un número") from None
+
+
+def _list(payload: Dict[str, Any], key: str) -> list:
+    value = payload.get(key)
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise JobDecodeError(f"{key} debe ser una lista")
+    return value
+
+
+def _amounts(payload: Dict[str, Any], key: str, label_keys: tuple[str, ...]) -> tuple[DocumentAmount, ...]:
+    amounts = []
+    for idx, entry in enumerate(_list(payload, key)):
+        if not isinstance(entry, dict):
+            raise JobDecodeError(f"{key}[{idx}] debe ser un objeto")
+        valor = _amount(_first(entry, "valor", "total"), f"{key}[{idx}].valor")
+        tarifa = _first(entry, "tarifa", "porcentaje")
+        amounts.append(
+            DocumentAmount(
+                concepto=_text(_first(entry, *label_keys)).upper() or "OTRO",
+                valor=valor or 0.0,
+                base=_amount(entry.get("base"), f"{key}[{idx}].base"),
+                tarifa=f"{tarifa:g}%" if isinstance(tarifa, (int, float)) and not isinstance(tarifa, bool) else _text(tarifa),
+                cantidad=_text(entry.get("cantidad")),
+            )
+        )
+    return tuple(amounts)
+
+
+def _empresa_header(empresa: Dict[str, Any]) -> tuple[str, ...]:
+    """Encabezado del negocio con los campos de configuración de facturación."""
+    lineas = [_text(_first(empresa, "nombre", "nombre_empresa", "razon_social"))]
+    nit = _text(empresa.get("nit"))
+    if nit:
+        lineas.append(f"NIT: {nit}")
+    responsable_iva = empresa.get("responsable_iva")
+    if responsable_iva is not None:
+        lineas.append("RESPONSABLE DE IVA" if responsable_iva else "NO RESPONSABLE DE IVA")
+    lineas.append(_text(empresa.get("direccion")))
+    ubicacion = " - ".join(_text(empresa.get(key)) for key in ("departamento", "ciudad") if empresa.get(key))
+    lineas.append(ubicacion or _text(empresa.get("ubicacion_geografica")))
+    telefonos = [_text(t) for t in (empresa.get("telefonos") or []) if t] if isinstance(empresa.get("telefonos"), list) else []
+    if empresa.get("telefono2"):
+        telefonos.append(_text(empresa["telefono2"]))
+    if telefonos:
+        lineas.append(f"TEL: {' - '.join(telefonos)}")
+    return tuple(linea for linea in lineas if linea)
+
+
+def decode_document(job_type: str, payload: Any) -> DocumentPayload:
+    """
+    Payload de un job de caja (receipt, invoice, cash_close) -> DocumentPayload.
+    Con "porcentaje_iva" y sin "impuestos", el IVA se discrimina del total (IVA incluido, como
+    la caja). Lanza JobDecodeError si está mal formado.
+    """
+    if job_type not in DOCUMENT_TYPES:
+        raise JobDecodeError(f"tipo de documento desconocido: {job_type}")
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        raise JobDecodeError(f"payload debe ser un objeto, llegó {type(payload).__name__}")
+
+    empresa = payload.get("empresa")
+    encabezado_raw = _list(payload, "encabezado")
+    if encabezado_raw:
+        encabezado = tuple(_text(linea) for linea in encabezado_raw if linea)
+    elif isinstance(empresa, dict):
+        encabezado = _empresa_header(empresa)
+    else:
+        encabezado = ()
+
+    datos: list[tuple[str, str]] = []
+    if payload.get("caja"):
+        datos.append(("Caja", _text(payload["caja"])))
+    mesas_raw = _list(payload, "mesas")
+    mesas = tuple(
+        "-".join(_text(m.get(key)) for key in ("salon", "numero") if m.get(key)) for m in mesas_raw if isinstance(m, dict)
+    )
+    if mesas:
+        datos.append(("Mesa(s)", ", ".join(mesas)))
+    cliente = payload.get("cliente")
+    if isinstance(cliente, dict):
+        para_llevar = bool(_first(cliente, "es_para_llevar", "esParaLlevar"))
+        tipo_pedido = _text(_first(payload, "tipo_pedido", "tipoPedido"))
+        etiqueta = "Para llevar" if para_llevar else "Domicilio" if tipo_pedido == "domicilio" else "Cliente"
+        datos.append((etiqueta, _text(cliente.get("nombre")) or "Cliente"))
+        for label, key in (("Doc.", "documento"), ("Tel", "telefono"), ("Dir", "direccion")):
+            if cliente.get(key) and not (key == "direccion" and para_llevar):
+                datos.append((label, _text(cliente[key])))
+    usuario_raw = payload.get("usuario")
+    usuario = _text(usuario_raw.get("nombre") if isinstance(usuario_raw, dict) else usuario_raw)
+    if usuario:
+        datos.append(("Cajero" if job_type == "cash_close" else "Atendido por", usuario))
+    for idx, entry in enumerate(_list(payload, "datos")):
+        if isinstance(entry, dict):
+            datos.append((_text(entry.get("etiqueta")), _text(entry.get("valor"))))
+        elif isinstance(entry, list) and len(entry) == 2:
+            datos.append((_text(entry[0]), _text(entry[1])))
+        else:
+            raise JobDecodeError(f"datos[{idx}] debe ser {{etiqueta, valor}}")
+
+    lineas = []
+    for idx, item in enumerate(_list(payload, "items")):
+        if not isinstance(item, dict):
+            raise JobDecodeError(f"items[{idx}] debe ser un objeto")
+        personalizaciones = item.get("personalizaciones") or []
+        if not isinstance(personalizaciones, list):
+            raise JobDecodeError(f"items[{idx}].personalizaciones debe ser una lista")
+        detalle = [" | ".join(str(p) for p in personalizaciones if p)] if personalizaciones else []
+        if item.get("observaciones"):
+            detalle.append(f"Obs: {_text(item['observaciones']).strip()}")
+        lineas.append(
+            DocumentLine(
+                descripcion=_text(item.get("nombre")) or "Producto",
+                cantidad=_text(item.get("cantidad")),
+                unitario=_amount(_first(item, "precio_unitario", "unitario"), f"items[{idx}].precio_unitario"),
+                total=_amount(_first(item, "subtotal", "total"), f"items[{idx}].subtotal"),
+                detalle=tuple(d for d in detalle if d),
+            )
+        )
+
+    total = _amount(payload.get("total"), "total")
+    subtotal = _amount(payload.get("subtotal"), "subtotal")
+    impuestos = _amounts(payload, "impuestos", ("nombre", "concepto"))
+    porcentaje_iva = _amount(payload.get("porcentaje_iva"), "porcentaje_iva")
+    if not impuestos and porcentaje_iva and total is not None:
+        base = total / (1 + porcentaje_iva / 100)
+        impuestos = (DocumentAmount("IVA", total - base, base=base, tarifa=f"{porcentaje_iva:g}%"),)
+        subtotal = base
+
+    pagos = _amounts(payload, "pagos", ("metodo", "metodo_pago", "concepto"))
+    metodo_pago = _text(payload.get("metodo_pago"))
+    if not pagos and metodo_pago:
+        monto = _amount(payload.get("monto_pagado"), "monto_pagado")
+        pagos = (DocumentAmount(metodo_pago.upper(), monto if monto is not None else total or 0.0),)
+
+    pie_raw = payload.get("pie")
+    if pie_raw is None:
+        pie = DOCUMENT_FOOTER if job_type != "cash_close" else ()
+    elif isinstance(pie_raw, list):
+        pie = tuple(_text(linea) for linea in pie_raw if linea)
+    else:
+        raise JobDecodeError("pie debe ser una lista")
+
+    try:
+        decimales = min(max(int(payload.get("decimales") or 0), 0), 2)
+    except (TypeError, ValueError):
+        raise JobDecodeError("decimales debe ser un entero") from None
+
+    fmt = payload.get("__format")
+    return DocumentPayload(
+        tipo=job_type,
+        format=decode_format(fmt, payload.get("copies")),
+        titulo=_text(payload.get("titulo")) or DOCUMENT_TITLES[job_type],
+        encabezado=encabezado,
+        numero=_text(payload.get("numero")),
+        fecha=_text(payload.get("fecha")),
+        datos=tuple(datos),
+        lineas=tuple(lineas),
+        observaciones=_text(_first(payload, "observaciones", "observaciones_generales")).strip(),
+        subtotal=subtotal,
+        impuestos=impuestos,
+        total=total,
+        pagos=pagos,
+        cambio=_amount(payload.get("cambio"), "cambio"),
+        resumen_titulo=_text(payload.get("resumen_titulo")) or "RESUMEN",
+        resumen=_amounts(payload, "resumen", ("concepto", "metodo", "metodo_pago")),
+        pie=pie,
+        decimales=decimales,
+        usuario=usuario,
+        mesas=mesas,
+        estacion=(_text(_first(fmt, "estacion", "station")) if isinstance(fmt, dict) else "") or "caja",
+    )
+
+
+# (ticket o documento, perfil, minuto del encabezado Fecha/Hora o None si no depende de la hora)
+RenderKey = tuple[Union[TicketPayload, DocumentPayload], str, Optional[datetime]]
+
+
+class RenderCache:
+    """
+    Tickets ya renderizados (bytes ESC/POS de una copia), indexados por (TicketPayload o
+    DocumentPayload, perfil de impresora, minuto impreso en el encabezado).
+    Una reimpresión manual del mismo pedido reutiliza el render en vez de formatearlo de nuevo;
+    en otro minuto se renderiza otra vez para que la Fecha/Hora del ticket sea la de la impresión.
+    """
+
+    def __init__(self, size: int = RENDER_CACHE_SIZE, ttl: float = RENDER_CACHE_TTL_SECONDS):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[RenderKey, tuple[float, bytes]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: RenderKey) -> Optional[bytes]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: RenderKey, data: bytes) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic(), data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+def format_ticket(ticket: TicketPayload, width: int = 48, ahora: Optional[datetime] = None) -> str:
+    sep = "=" * width
+    sep2 = "-" * width
+
+    ahora = ahora or datetime.now()
+    lineas = [
+        f"Fecha: {ahora.strftime('%Y-%m-%d')}",
+        f"Hora:  {ahora.strftime('%H:%M')}",
+    ]
+
+    encabezado = f"Atendido por: {ticket.usuario}"
+    if len(encabezado) <= width:
+        lineas.append(encabezado)
+    else:
+        lineas.append("Atendido por:")
+        lineas.extend(["  " + parte for parte in dividir_texto(ticket.usuario, width - 2)])
+
+    cliente = ticket.cliente
+
+    lineas.append("")
+    if ticket.tipo_pedido == "domicilio" and cliente is not None:
+        lineas.append("*** PARA LLEVAR ***" if cliente.es_para_llevar else "*** DOMICILIO ***")
+        lineas.append(f"Cliente: {cliente.nombre}")
+        if cliente.telefono:
+            lineas.append(f"Tel: {cliente.telefono}")
+        if cliente.direccion and not cliente.es_para_llevar:
+            lineas.append("Direccion:")
+            lineas.extend(["  " + parte for parte in dividir_texto(cliente.direccion, width - 2)])
+    else:
+        mesa_txt = ", ".join(ticket.mesas)
+        if mesa_txt:
+            if len(mesa_txt) <= (width - 8):
+                lineas.append(f"Mesa(s): {mesa_txt}")
+            else:
+                lineas.append("Mesa(s):")
+                lineas.extend(["  " + parte for parte in dividir_texto(mesa_txt, width - 2)])
+
+    titulo_comanda = f"COMANDA {ticket.estacion.upper()}" if ticket.estacion else "COMANDA DE COCINA"
+    lineas.extend(["", sep, "     " + titulo_comanda, sep, ""])
+    if ticket.modo == "cambios":
+        lineas.extend(["*** MODIFICACION: SOLO CAMBIOS ***", ""])
+
+    if not ticket.items:
+        lineas.append("(Sin items)")
+    else:
+        for idx, item in enumerate(ticket.items):
+            if idx > 0:
+                lineas.append(sep2)
+            cantidad = item.cantidad
+            titulo = f"{cantidad}x {item.nombre}" if cantidad is not None else item.nombre
+            if len(titulo) <= width:
+                lineas.append(titulo)
+            else:
+                lineas.append(f"{cantidad}x")
+                lineas.extend(["  " + parte for parte in dividir_texto(item.nombre, width - 2)])
+
+            lineas.extend(["  " + p for p in item.personalizaciones])
+            if item.total == "0":
+                lineas.append("  ** CANCELADO **")
+            elif item.total:
+                lineas.append(f"  (total: {item.total})")
+
+            if item.observaciones:
+                lineas.append("")
+                lineas.append("  OBSERVACIONES:")
+                lineas.extend(["    " + parte for parte in dividir_texto(item.observaciones, width - 4)])
+
+    if ticket.observaciones_generales:
+        lineas.extend(["", sep, "OBSERVACIONES GENERALES:"])
+        lineas.extend(dividir_texto(ticket.observaciones_generales, width))
+
+    lineas.extend(["", "     ENVIADO A COCINA", sep, sep])
+    return "\n".join(lineas)
+
+
+def format_stale_summary(entries: list[tuple[str, TicketPayload]], ttl_minutes: int, width: int = 48) -> str:
+    """
+    Un solo ticket con los pedidos que vencieron en la cola (hora de creación, mesa/cliente e
+    ítems), en lugar de imprimir cada comanda atrasada por separado.
+    """
+    sep = "=" * width
+    sep2 = "-" * width
+    lineas = [sep, "  PEDIDOS ATRASADOS (NO IMPRESOS)", sep]
+    lineas.extend(dividir_texto(f"Llevaban más de {ttl_minutes} min en cola (caída de conexión).", width))
+    lineas.extend(dividir_texto("Confirmar con el mesero antes de preparar.", width))
+    for idx, (hora, ticket) in enumerate(entries):
+        lineas.append("" if idx == 0 else sep2)
+        if ticket.tipo_pedido == "domicilio" and ticket.cliente is not None:
+            destino = f"Domicilio {ticket.cliente.nombre}"
+        elif ticket.mesas:
+            destino = f"Mesa {', '.join(ticket.mesas)}"
+        else:
+            destino = ticket.estacion.upper() or "Pedido"
+        lineas.extend(dividir_texto(f"{hora}  {destino} ({ticket.usuario})", width))
+        items = ticket.snapshot if ticket.modo == "completa" and ticket.snapshot else ticket.items
+        for item in items:
+            titulo = f"{item.cantidad}x {item.nombre}" if item.cantidad is not None else item.nombre
+            lineas.extend(["  " + parte for parte in dividir_texto(titulo, width - 2)])
+        if not items and ticket.raw_text:
+            lineas.append("  (ticket de texto)")
+    lineas.extend(["", f"Total: {len(entries)} pedido(s)", sep])
+    return "\n".join(lineas)
+
+
+def render_ticket(ticket: TicketPayload, profile: PrinterProfile = GENERIC_PROFILE, cache: Optional[RenderCache] = None) -> bytes:
+    """Bytes ESC/POS de una copia del ticket para el perfil dado, memorizados en cache si se pasa uno."""
+    # El minuto va en la clave: el encabezado Fecha/Hora es el de esta impresión, no el del primer render
+    ahora = None if ticket.raw_text else datetime.now().replace(second=0, microsecond=0)
+    key = (ticket, profile.nombre, ahora)
+    data = cache.get(key) if cache is not None else None
+    if data is None:
+        fmt = ticket.format
+        width = profile.columns(fmt.paper_width, fmt.font_size)
+        text = ticket.raw_text or format_ticket(ticket, width=width, ahora=ahora)
+        trailer = order_code_block(ticket.order_code_value, fmt.order_code, profile, fmt.paper_width)
+        data = escpos_wrap(text, font_size=fmt.font_size, profile=profile, trailer=trailer)
+        if cache is not None:
+            cache.put(key, data)
+    return data
+
+
+def format_money(value: float, decimales: int = 0) -> str:
+    """Valor con separador de miles es-CO: 1234567.5 -> "1.234.568" (o "1.234.567,50")."""
+    text = f"{abs(value):,.{decimales}f}".replace(",", "_").replace(".", ",").replace("_", ".")
+    return f"-{text}" if value < 0 else text
+
+
+def _center(text: str, width: int) -> list[str]:
+    return [" " * ((width - len(parte)) // 2) + parte for parte in dividir_texto(text, width)]
+
+
+def _pair(label: str, value: str, width: int) -> list[str]:
+    """Etiqueta a la izquierda y valor alineado a la derecha; si no caben, el valor baja de línea."""
+    if len(label) + 1 + len(value) <= width:
+        return [label + value.rjust(width - len(label))]
+    return dividir_texto(label, width) + [value.rjust(width)]
+
+
+def document_lines(doc: DocumentPayload, width: int = 48, ahora: Optional[datetime] = None) -> list[tuple[str, str]]:
+    """
+    Líneas del documento como (estilo, texto): "" normal, "b" negrita, "t" total (negrita y
+    doble alto, que no cambia el ancho de las columnas). Con 40 columnas o más los ítems van en
+    tabla de una línea; en 58 mm cada ítem usa dos (descripción y valores).
+    """
+    sep = "=" * width
+    sep2 = "-" * width
+    money = lambda value: format_money(value, doc.decimales)  # noqa: E731
+    out: list[tuple[str, str]] = []
+
+    def add(lines: list[str], style: str = "") -> None:
+        out.extend((style, line) for line in lines)
+
+    if doc.encabezado:
+        add([sep])
+        add(_center(doc.encabezado[0], width), "b")
+        for linea in doc.encabezado[1:]:
+            add(_center(linea, width))
+    add([sep])
+    add(_center(doc.titulo, width), "b")
+    if doc.numero:
+        add(_center(f"No. {doc.numero}", width))
+    add([f"Fecha: {doc.fecha or (ahora or datetime.now()).strftime('%Y-%m-%d %H:%M')}"])
+    for label, value in doc.datos:
+        add(dividir_texto(f"{label}: {value}" if label else value, width))
+
+    if doc.lineas:
+        add([sep])
+        wide = width >= 40
+        if wide:
+            desc_width = width - 25
+            add([f"CANT {'DESCRIPCION':<{desc_width}}{'V.UNIT':>10}{'TOTAL':>10}"])
+        else:
+            add([f"{'DESCRIPCION':<{width - 10}}{'TOTAL':>10}"])
+        add([sep2])
+        for linea in doc.lineas:
+            unitario = money(linea.unitario) if linea.unitario is not None else ""
+            total = money(linea.total) if linea.total is not None else ""
+            if wide:
+                partes = dividir_texto(linea.descripcion, desc_width)
+                add([f"{linea.cantidad:>4} {partes[0]:<{desc_width}}{unitario:>10}{total:>10}"])
+                add(["     " + parte for parte in partes[1:]])
+            else:
+                titulo = f"{linea.cantidad}x {linea.descripcion}" if linea.cantidad else linea.descripcion
+                add(dividir_texto(titulo, width))
+                if linea.cantidad and unitario:
+                    add(_pair(f"  {linea.cantidad} x {unitario}", total, width))
+                elif total:
+                    add([total.rjust(width)])
+            for detalle in linea.detalle:
+                add(["     " + parte for parte in dividir_texto(detalle, width - 5)])
+
+    if doc.observaciones:
+        add([sep2, "Observaciones:"])
+        add(dividir_texto(doc.observaciones, width))
+
+    if doc.resumen:
+        add([sep])
+        add([doc.resumen_titulo], "b")
+        for entry in doc.resumen:
+            label = f"{entry.concepto} ({entry.cantidad})" if entry.cantidad else entry.concepto
+            add(_pair(label, money(entry.valor), width))
+
+    if doc.total is not None:
+        add([sep])
+        if doc.subtotal is not None and doc.impuestos:
+            add(_pair("SUBTOTAL", money(doc.subtotal), width))
+            for impuesto in doc.impuestos:
+                add(_pair(f"{impuesto.concepto} {impuesto.tarifa}".strip(), money(impuesto.valor), width))
+        add(_pair("TOTAL", f"${money(doc.total)}", width), "t")
+
+    if doc.impuestos:
+        # Discriminación de tarifas: base gravable e impuesto por tarifa
+        col = 12 if width >= 40 else 10
+        add([sep2])
+        add([f"{'TARIFA':<{width - 2 * col}}{'BASE':>{col}}{'IMPUESTO':>{col}}"])
+        for impuesto in doc.impuestos:
+            label = f"{impuesto.concepto} {impuesto.tarifa}".strip()[: width - 2 * col]
+            base = money(impuesto.base) if impuesto.base is not None else ""
+            add([f"{label:<{width - 2 * col}}{base:>{col}}{money(impuesto.valor):>{col}}"])
+
+    if doc.pagos or doc.cambio is not None:
+        add([sep2])
+        add(["FORMA DE PAGO"], "b")
+        for pago in doc.pagos:
+            add(_pair(pago.concepto, money(pago.valor), width))
+        if doc.cambio is not None:
+            add(_pair("CAMBIO", money(doc.cambio), width))
+
+    if doc.pie:
+        add([sep])
+        for linea in doc.pie:
+            add(_center(linea, width))
+    add([sep])
+    return out
+
+
+def format_document(doc: DocumentPayload, width: int = 48) -> str:
+    """Texto plano del documento (sin estilos)."""
+    return "\n".join(text for _, text in document_lines(doc, width))
+
+
+def render_document(doc: DocumentPayload, profile: PrinterProfile = GENERIC_PROFILE, cache: Optional[RenderCache] = None) -> bytes:
+    """Bytes ESC/POS de una copia del documento de caja, con negrita y TOTAL en doble alto."""
+    # Sin fecha en el payload el documento imprime la hora actual: el minuto va en la clave
+    ahora = None if doc.fecha else datetime.now().replace(second=0, microsecond=0)
+    key = (doc, profile.nombre, ahora)
+    data = cache.get(key) if cache is not None else None
+    if data is None:
+        fmt = doc.format
+        width = profile.columns(fmt.paper_width, fmt.font_size)
+        base_size = 0x11 if fmt.font_size == "large" else 0x00
+        styles = {
+            "b": (b"\x1bE\x01", b"\x1bE\x00"),
+            # ESC E 1 + GS ! doble alto; al cerrar se vuelve al tamaño base del formato
+            "t": (b"\x1bE\x01" + bytes([0x1D, 0x21, base_size | 0x01]), bytes([0x1D, 0x21, base_size]) + b"\x1bE\x00"),
+        }
+        chunks: list[bytes] = []
+        for style, text in document_lines(doc, width, ahora):
+            line = text.encode(profile.encoding, errors="replace")
+            if style:
+                start, end = styles[style]
+                line = start + line + end
+            chunks.append(line)
+        trailer = order_code_block(doc.numero, fmt.order_code, profile, fmt.paper_width)
+        data = escpos_wrap(b"\n".join(chunks), font_size=fmt.font_size, profile=profile, trailer=trailer)
+        if cache is not None:
+            cache.put(key, data)
+    return data